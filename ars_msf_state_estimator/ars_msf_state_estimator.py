@@ -6,16 +6,16 @@ from numpy import *
 import threading
 
 
-# ROS
-import rclpy
-from rclpy.time import Time
-
-import nav_msgs.msg
-from nav_msgs.msg import Path
-
-
 #
-import ars_lib_helpers.ars_lib_helpers as ars_lib_helpers
+from ars_msf_state_estimator.ars_msf_state_estimator_quat_simp import *
+from ars_msf_state_estimator.ars_msf_state_estimator_history import *
+from ars_msf_state_estimator.ars_msf_state_estimator_workspace import *
+from ars_msf_state_estimator.ars_msf_state_estimator_meas_queue import *
+from ars_msf_state_estimator.ars_msf_state_estimator_snapshot import *
+from ars_msf_state_estimator.ars_msf_state_estimator_steady_state import *
+from ars_msf_state_estimator.ars_msf_state_estimator_gating import *
+from ars_msf_state_estimator.ars_msf_state_estimator_imu import *
+from ars_msf_state_estimator.ars_msf_state_estimator_meas_model import *
 
 
 
@@ -24,26 +24,40 @@ class ArsMsfStateEstimator:
 
   #######
 
-  # Meas position
-  # z_t = [m_posi_x, m_posi_y, m_posi_z]
-  # Dim (z_t) = 3
-  flag_set_meas_robot_posi = None
-  meas_robot_posi_timestamp = None
-  meas_robot_posi = None
-  # Meas attitude
-  # z_a = [m_atti_yaw]
-  # Dim (z_a) = 1
-  flag_set_meas_robot_atti = None
-  meas_robot_atti_timestamp = None
-  meas_robot_atti_quat_simp = None
-  # Meas velocity
-  # z_v = [m_vel_lin_x_robot, m_vel_lin_y_robot, m_vel_lin_z_robot,
-  #       m_vel_ang_z_robot]
-  # Dim (z_v) = 4
-  flag_set_meas_robot_vel_robot = None
-  meas_robot_velo_timestamp = None
-  meas_robot_velo_lin_robot = None
-  meas_robot_velo_ang_robot = None
+  # Timestamps are integer nanoseconds (0: not set).
+  # No ROS dependency: the ROS wrapper converts the stamps
+
+  # Masks of the measurements (built-in models, registered first)
+  meas_mask_robot_posi = 1
+  meas_mask_robot_atti = 2
+  meas_mask_robot_vel_robot = 4
+
+  # Registry of the measurement models (ArsMsfStateEstimatorMeasModel),
+  # in the order of the stacked measurement. Each one has a mask (one bit)
+  # - Meas position (ArsMsfStateEstimatorMeasModelPosition)
+  # - Meas attitude (ArsMsfStateEstimatorMeasModelAttitude)
+  # - Meas velocity (ArsMsfStateEstimatorMeasModelVelRobot)
+  # - Models registered with registerMeasModel()
+  # - Additional sources of the config (meas_sources), e.g. two position
+  #   sensors, each one with its mask, covariance, rate and latency
+  meas_models = None
+
+  # Types of the additional sources of measurements: model of each type
+  # (config meas_sources)
+  meas_source_types = {
+    'meas_position': ArsMsfStateEstimatorMeasModelPosition,
+    'meas_attitude': ArsMsfStateEstimatorMeasModelAttitude,
+    'meas_velocity': ArsMsfStateEstimatorMeasModelVelRobot,
+  }
+
+  # Queues of measurements, drained by update()
+  # Key: mask of the measurement
+  meas_queues = None
+
+  # IMU: input of the prediction (if enabled)
+  # u = [lin_acc_x_robot, lin_acc_y_robot, lin_acc_z_robot,
+  #      ang_vel_z_robot]
+  imu = None
 
   #
   lock_meas = None
@@ -70,18 +84,74 @@ class ArsMsfStateEstimator:
   lock_state = None
 
 
+  # Snapshot of the estimated state, for the readers (double buffer)
+  # The filter works on the estim_* arrays (back buffer) and, after each
+  # step, replaces the snapshot (front buffer) by a new immutable one.
+  # Readers only use the snapshot and never take lock_state
+  estim_state_snapshot = None
+
+
   # Covariance of the process model
   cov_proc_mod = None
 
-  # Covariance meas position
-  cov_meas_posi = None
 
-  # Covariance meas attitude
-  cov_meas_atti = None
+  # Update mode
+  # - 'batch': stacked update of all the measurements
+  # - 'sequential_block': one measurement block after another
+  # - 'sequential_scalar': one measurement row after another
+  # With gating, 'sequential_scalar' uses the batch update
+  update_mode = None
+
+
+  # Lazy prediction: predict() only records the timestamp (prediction
+  # step pending). The state is propagated when needed: to fuse a
+  # measurement, or when the snapshot or a query is read. The pending
+  # steps are merged into a single propagation over the whole interval,
+  # with the process noise of all the steps: the result is the same as
+  # predicting at each step. With the history, an entry is recorded at each
+  # step: the ones merged into a propagation get an interpolated state, and
+  # are propagated one by one when a delayed measurement is replayed over
+  # them
+  flag_lazy_predict = None
+  # Timestamp of the last pending step [ns]
+  predict_pending_timestamp = None
+  # Number of pending steps, and sums of their times since the estimated
+  # state, and of their squares [s, s^2]
+  predict_pending_num = None
+  predict_pending_sum_delta_time = None
+  predict_pending_sum_delta_time_sq = None
+
+
+  # Chi-square gating of the measurement blocks
+  gating = None
+
+
+  # Workspace: preallocated arrays of predict and update
+  workspace = None
 
-  # Covariance meas velocity
-  cov_meas_velo_lin = None
-  cov_meas_velo_ang = None
+
+  # Steady-state Kalman gain: cached covariances and gains of the
+  # converged filter cycles, used instead of the full EKF at fixed rate
+  steady_state = None
+
+
+  # History of past states, covariances and measurements
+  # Used to fuse delayed measurements at their timestamp
+  flag_history_enabled = None
+  history = None
+  # Number of measurements too old to be fused
+  num_meas_dropped_too_old = None
+
+  # Mask of the measurements consumed by the last update()
+  meas_mask_last_update = None
+  # Times of reception of the samples consumed by the last update() [ns]
+  # (as given to setMeas())
+  # Key: mask of the measurement
+  meas_time_receive_last_update = None
+
+  # Queries of the state at a timestamp (getStateAtTimestamp)
+  # Max time past the estimated state to extrapolate [ns]
+  query_extrapolation_time_max = None
 
 
 
@@ -89,28 +159,26 @@ class ArsMsfStateEstimator:
 
   def __init__(self):
 
+    # Measurement models
+    self.meas_models = []
+    self.meas_queues = dict()
     # Meas Position
-    self.flag_set_meas_robot_posi = False
-    self.meas_robot_posi_timestamp = Time()
-    self.meas_robot_posi = np.zeros((3,), dtype=float)
+    self.registerMeasModel(ArsMsfStateEstimatorMeasModelPosition())
     # Meas Attitude
-    self.flag_set_meas_robot_atti = False
-    self.meas_robot_atti_timestamp = Time()
-    self.meas_robot_atti_quat_simp = ars_lib_helpers.Quaternion.zerosQuatSimp()
+    self.registerMeasModel(ArsMsfStateEstimatorMeasModelAttitude())
     # Meas Velocity
-    self.flag_set_meas_robot_vel_robot = False
-    self.meas_robot_velo_timestamp = Time()
-    self.meas_robot_velo_lin_robot = np.zeros((3,), dtype=float)
-    self.meas_robot_velo_ang_robot = np.zeros((1,), dtype=float)
+    self.registerMeasModel(ArsMsfStateEstimatorMeasModelVelRobot())
+    # IMU
+    self.imu = ArsMsfStateEstimatorImu()
 
     #
     self.lock_meas = threading.Lock()
 
     # Estimated State
-    self.estim_state_timestamp = Time()
+    self.estim_state_timestamp = 0
     # Estmated Pose
     self.estim_robot_posi = np.zeros((3,), dtype=float)
-    self.estim_robot_atti_quat_simp = ars_lib_helpers.Quaternion.zerosQuatSimp()
+    self.estim_robot_atti_quat_simp = QuatSimp.zerosQuatSimp()
     # Estimated Velocity
     self.estim_robot_velo_lin_world = np.zeros((3,), dtype=float)
     self.estim_robot_velo_ang_world = np.zeros((1,), dtype=float)
@@ -121,19 +189,49 @@ class ArsMsfStateEstimator:
     #
     self.lock_state = threading.Lock()
 
+    # Snapshot
+    self.estim_state_snapshot = None
+    self.publishStateSnapshot()
+
 
     # Covariance of the process model
     self.cov_proc_mod = np.zeros((4,4), dtype=float)
 
-    # Covariance meas position
-    self.cov_meas_posi = np.zeros((3,3), dtype=float)
 
-    # Covariance meas attitude
-    self.cov_meas_atti = np.zeros((1,1), dtype=float)
+    # Update mode
+    self.update_mode = 'batch'
+
+
+    # Lazy prediction
+    self.flag_lazy_predict = False
+    self.resetPredictPending()
+
+
+    # Gating
+    self.gating = ArsMsfStateEstimatorGating()
 
-    # Covariance meas velocity
-    self.cov_meas_velo_lin = np.zeros((3,3), dtype=float)
-    self.cov_meas_velo_ang = np.zeros((1,1), dtype=float)
+
+    # Workspace
+    self.workspace = ArsMsfStateEstimatorWorkspace()
+    self.setWorkspaceModels()
+
+
+    # Steady state
+    self.steady_state = ArsMsfStateEstimatorSteadyState()
+
+
+    # History
+    self.flag_history_enabled = True
+    self.history = ArsMsfStateEstimatorHistory(meas_fields_dims=self.getMeasFieldsDims())
+    #
+    self.num_meas_dropped_too_old = 0
+
+    #
+    self.meas_mask_last_update = 0
+    self.meas_time_receive_last_update = dict()
+
+    # Queries
+    self.query_extrapolation_time_max = 0
 
 
     # End
@@ -143,169 +241,720 @@ class ArsMsfStateEstimator:
   def setConfigParameters(self, config_param):
 
     # Estmated Pose
-    self.estim_robot_posi = np.array(config_param['estimated_state_init']['state']['robot_position'])
-    self.estim_robot_atti_quat_simp = ars_lib_helpers.Quaternion.setQuatSimp(config_param['estimated_state_init']['state']['robot_atti_quat_simp'])
+    self.estim_robot_posi = np.array(config_param['estimated_state_init']['state']['robot_position'], dtype=float)
+    self.estim_robot_atti_quat_simp = QuatSimp.setQuatSimp(config_param['estimated_state_init']['state']['robot_atti_quat_simp'])
     # Estimated Velocity
-    self.estim_robot_velo_lin_world = np.array(config_param['estimated_state_init']['state']['robot_vel_lin_world'])
-    self.estim_robot_velo_ang_world = np.array(config_param['estimated_state_init']['state']['robot_vel_ang_world'])
+    self.estim_robot_velo_lin_world = np.array(config_param['estimated_state_init']['state']['robot_vel_lin_world'], dtype=float)
+    self.estim_robot_velo_ang_world = np.array(config_param['estimated_state_init']['state']['robot_vel_ang_world'], dtype=float)
 
     # Cov estimated state
-    self.estim_state_cov = np.diag(config_param['estimated_state_init']['cov_diag'])
+    self.estim_state_cov = np.diag(np.array(config_param['estimated_state_init']['cov_diag'], dtype=float))
 
     # Covariance of the process model
     self.cov_proc_mod = np.diag(config_param['process_model']['cov_diag'])
 
-    # Covariance meas position
-    self.cov_meas_posi = np.diag(config_param['measurements']['meas_position']['cov_diag'])
+    # The other sections are optional: if missing, as constructed
+
+    # Additional sources of measurements
+    self.setMeasSources(config_param.get('meas_sources', {}))
+
+    # Measurement models: covariances
+    # Queues of measurements (by default, only the last sample is kept)
+    config_param_queues = config_param.get('meas_queues', {})
+    for meas_model in self.meas_models:
+      if(meas_model.meas_source_type is not None):
+        # Additional source: queue of its type
+        meas_model.setConfigParameters(meas_model.meas_source_config)
+        config_param_queue = config_param_queues.get(meas_model.meas_source_type, {})
+      elif(meas_model.meas_mask == self.meas_mask_robot_vel_robot):
+        # Meas velocity: linear and angular parts
+        meas_model.setConfigParameters({'cov_diag': list(config_param['measurements']['meas_velo_lin']['cov_diag']) + list(config_param['measurements']['meas_velo_ang']['cov_diag'])})
+        config_param_queue = config_param_queues.get(meas_model.meas_name, {})
+      else:
+        meas_model.setConfigParameters(config_param['measurements'][meas_model.meas_name])
+        config_param_queue = config_param_queues.get(meas_model.meas_name, {})
+      self.meas_queues[meas_model.meas_mask] = ArsMsfStateEstimatorMeasQueue(meas_model.meas_fields_dims, config_param_queue.get('depth', 1), config_param_queue.get('overflow_policy', 'drop_oldest'), meas_model.meas_period_min)
+
+    # IMU
+    self.imu.setConfigParameters(config_param.get('imu', {}))
+
+    # Update mode
+    self.update_mode = config_param.get('update_mode', 'batch')
+
+    # Lazy prediction
+    self.flag_lazy_predict = config_param.get('lazy_predict', {}).get('flag_enabled', False)
+    self.resetPredictPending()
+
+    # Gating
+    # Additional sources: confidence of their type
+    config_param_gating = config_param.get('gating', {})
+    self.gating.setConfigParameters(config_param_gating, {meas_model.meas_name: meas_model.meas_mask for meas_model in self.meas_models if meas_model.meas_source_type is None})
+    for meas_model in self.meas_models:
+      if(meas_model.meas_source_type is not None):
+        self.gating.setConfidence(meas_model.meas_mask, config_param_gating.get('confidence', {}).get(meas_model.meas_source_type, self.gating.confidence_default))
+
+    # Workspace
+    self.setWorkspaceModels()
+
+    # Steady state
+    # Measurements depending on the linearisation point
+    meas_mask_lin = 0
+    for meas_model in self.meas_models:
+      if(meas_model.flag_lin_point):
+        meas_mask_lin |= meas_model.meas_mask
+    self.steady_state.setConfigParameters(config_param.get('steady_state', {}), meas_mask_lin)
+
+    # History
+    config_param_history = config_param.get('history', {})
+    self.flag_history_enabled = config_param_history.get('flag_enabled', True)
+    self.history = ArsMsfStateEstimatorHistory(config_param_history.get('size', 200), self.getMeasFieldsDims())
+
+    # Queries
+    self.query_extrapolation_time_max = int(round(1e9*config_param.get('state_query', {}).get('extrapolation_time_max', 0.0)))
+
+    # Snapshot of the initial state
+    self.lock_state.acquire()
+    self.publishStateSnapshot()
+    self.lock_state.release()
+
 
-    # Covariance meas attitude
-    self.cov_meas_atti = np.diag(config_param['measurements']['meas_attitude']['cov_diag'])
+    return
 
-    # Covariance meas velocity
-    self.cov_meas_velo_lin = np.diag(config_param['measurements']['meas_velo_lin']['cov_diag'])
-    self.cov_meas_velo_ang = np.diag(config_param['measurements']['meas_velo_ang']['cov_diag'])
 
+  def registerMeasModel(self, meas_model):
+
+    # Adds a measurement model (ArsMsfStateEstimatorMeasModel), e.g.
+    # barometer, range finder or UWB, and returns its mask. Its config is
+    # read by setConfigParameters() under its name (measurements, and
+    # optionally meas_queues, gating): to be registered before.
+    # Samples are given with setMeas()
+
+    meas_model.meas_mask = 1 << len(self.meas_models)
+    self.meas_models.append(meas_model)
+
+    # Queue, until configured
+    self.meas_queues[meas_model.meas_mask] = ArsMsfStateEstimatorMeasQueue(meas_model.meas_fields_dims)
+
+    return meas_model.meas_mask
+
+
+  def setMeasSources(self, config_param):
+
+    # Additional sources of each type of measurement (meas_sources), each
+    # one registered as a model of the type with its own mask. A source
+    # keeps its mask when configured again
+    # config_param: list of sources of each type, each one with:
+    # - name: name of the source (unique)
+    # - topic: topic of the source (ROS node)
+    # - cov_diag: diagonal of the covariance (velocity: [lin_x, lin_y,
+    #   lin_z, ang_z])
+    # - rate [Hz] (optional): max rate of the samples fused (0.0: all)
+    # - latency [s] (optional): delay of the samples wrt their timestamp
+
+    meas_names = set()
+    for meas_source_type, meas_sources in config_param.items():
+      if(meas_source_type not in self.meas_source_types):
+        raise ValueError("Unknown type of measurement of the sources: "+str(meas_source_type))
+      for meas_source in meas_sources:
+        meas_name = meas_source['name']
+        if(meas_name in meas_names):
+          raise ValueError("Duplicated name of source of measurement: "+str(meas_name))
+        meas_names.add(meas_name)
+        meas_model = self.getMeasModelByName(meas_name)
+        if(meas_model is None):
+          meas_model = self.meas_source_types[meas_source_type](meas_name)
+          meas_model.meas_source_type = meas_source_type
+          self.registerMeasModel(meas_model)
+        elif(meas_model.meas_source_type != meas_source_type):
+          raise ValueError("Name of source of measurement already used: "+str(meas_name))
+        meas_model.meas_source_config = meas_source
 
     return
 
 
-  def setMeasRobotPosition(self, timestamp, robot_posi):
+  def getMeasModel(self, meas_mask):
 
-    self.lock_meas.acquire()
+    # Masks: one bit, in the order of registration
+    idx_model = meas_mask.bit_length()-1
+    if(meas_mask <= 0 or idx_model >= len(self.meas_models) or self.meas_models[idx_model].meas_mask != meas_mask):
+      return None
 
-    self.flag_set_meas_robot_posi = True
+    return self.meas_models[idx_model]
 
-    self.meas_robot_posi_timestamp = timestamp
 
-    self.meas_robot_posi = robot_posi
+  def getMeasModelByName(self, meas_name):
 
-    self.lock_meas.release()
+    for meas_model in self.meas_models:
+      if(meas_model.meas_name == meas_name):
+        return meas_model
+
+    return None
+
+
+  def getMeasSources(self):
+
+    # Additional sources of measurements (config meas_sources)
+
+    return [meas_model for meas_model in self.meas_models if meas_model.meas_source_type is not None]
+
+
+  def getMeasFieldsDims(self):
+
+    # Dimensions of the fields of the samples of each measurement
+    # Key: mask of the measurement
+
+    return {meas_model.meas_mask: meas_model.meas_fields_dims for meas_model in self.meas_models}
+
+
+  def setWorkspaceModels(self):
+
+    # Process model
+    self.workspace.setCovProcMod(self.cov_proc_mod)
+
+    # Measurement models: covariance and constant entries of the Jacobian
+    # Hx, stacked for each combination of measurements when first used
+    self.workspace.setMeasModels(self.meas_models)
+
+    # Thresholds of the gating of each combination of measurements
+    self.gating.resetThresholds()
 
     return
 
-  def setMeasRobotAttitude(self, timestamp, robot_atti_quat_simp):
 
-    self.lock_meas.acquire()
+  def setMeas(self, meas_mask, timestamp, *meas_fields, time_receive=0):
 
-    self.flag_set_meas_robot_atti = True
+    # Sample of the measurement meas_mask (fields as in its model), fused
+    # at its timestamp minus the latency of the source
+    # time_receive: time of reception [ns] (latency instrumentation)
+    # Returns False if a sample was dropped (queue full) or skipped (faster
+    # than the rate of the source)
 
-    self.meas_robot_atti_timestamp = timestamp
+    meas_model = self.meas_models[meas_mask.bit_length()-1]
+
+    self.lock_meas.acquire()
 
-    self.meas_robot_atti_quat_simp = robot_atti_quat_simp
+    flag_not_dropped = self.meas_queues[meas_mask].push(timestamp - meas_model.meas_latency, *meas_fields, time_receive=time_receive)
 
     self.lock_meas.release()
 
-    return
+    return flag_not_dropped
+
+
+  def setMeasRobotPosition(self, timestamp, robot_posi):
+
+    # Returns False if a sample was dropped (queue full)
+
+    return self.setMeas(self.meas_mask_robot_posi, timestamp, robot_posi)
+
+  def setMeasRobotAttitude(self, timestamp, robot_atti_quat_simp):
+
+    # Returns False if a sample was dropped (queue full)
+
+    return self.setMeas(self.meas_mask_robot_atti, timestamp, robot_atti_quat_simp)
 
   def setMeasRobotVelRobot(self, timestamp, lin_vel_world, ang_vel_world):
 
-    self.lock_meas.acquire()
+    # Returns False if a sample was dropped (queue full)
+
+    return self.setMeas(self.meas_mask_robot_vel_robot, timestamp, lin_vel_world, ang_vel_world)
+
 
-    self.flag_set_meas_robot_vel_robot = True
+  def setMeasImu(self, timestamp, lin_acc_robot, ang_vel_robot):
 
-    self.meas_robot_velo_timestamp = timestamp
+    # Returns False if the sample was dropped (not newer than the last one)
+
+    self.lock_meas.acquire()
 
-    self.meas_robot_velo_lin_robot = lin_vel_world
-    self.meas_robot_velo_ang_robot = ang_vel_world
+    flag_not_dropped = self.imu.push(timestamp, lin_acc_robot, ang_vel_robot)
 
     self.lock_meas.release()
 
-    return
+    return flag_not_dropped
+
+
+  def getNumMeasDropped(self):
+
+    # Number of samples dropped on overflow of the queues
+    # Key: mask of the measurement
+
+    return {meas_mask: meas_queue.num_dropped for meas_mask, meas_queue in self.meas_queues.items()}
+
+
+  def getNumMeasSkipped(self):
+
+    # Number of samples skipped by the rate of the sources
+    # Key: mask of the measurement
+
+    return {meas_mask: meas_queue.num_skipped for meas_mask, meas_queue in self.meas_queues.items()}
+
+
+  def getNumMeasRejected(self):
+
+    # Number of measurements rejected by the gating
+    # Key: mask of the measurement
+
+    return dict(self.gating.num_rejected)
 
   
+  def publishStateSnapshot(self):
+
+    # Requires lock_state (except in __init__)
+
+    if(self.estim_state_snapshot is None):
+      version = 0
+    else:
+      version = self.estim_state_snapshot.version + 1
+
+    # Built aside, then swapped: readers get either the old or the new one
+    self.estim_state_snapshot = ArsMsfStateEstimatorSnapshot(version, self.estim_state_timestamp, self.estim_robot_posi, self.estim_robot_atti_quat_simp, self.estim_robot_velo_lin_world, self.estim_robot_velo_ang_world, self.estim_state_cov)
+
+    return
+
+
+  def getStateSnapshot(self):
+
+    # Lock-free: the snapshot is immutable and replaced atomically.
+    # Lazy prediction: the pending steps are propagated first (lock_state)
+
+    if(self.predict_pending_num):
+      self.lock_state.acquire()
+      if(self.predict_pending_num):
+        self.predictPending()
+        self.publishStateSnapshot()
+      self.lock_state.release()
+
+    return self.estim_state_snapshot
+
+
+  def getStateTimestamp(self):
+
+    # Timestamp of the estimated state [ns], including the pending steps
+    # (lazy prediction)
+
+    if(self.predict_pending_num):
+      return self.predict_pending_timestamp
+
+    return self.estim_state_timestamp
+
+
   def predict(self, timestamp):
 
     #
     self.lock_state.acquire()
 
+    # Lazy prediction: only recorded (once there is an estimated state)
+    if(self.flag_lazy_predict and self.estim_state_timestamp):
+      self.addPredictPending(timestamp)
+      self.lock_state.release()
+      return
+
+    # Predict
+    self.predictStateHistory(timestamp)
+
+    # Snapshot
+    self.publishStateSnapshot()
+
+    #
+    self.lock_state.release()
+
+    #
+    return
+
+
+  def predictStateHistory(self, timestamp):
+
+    # Requires lock_state
+
+    # Predict
+    self.predictState(timestamp)
+
+    # Record the step in the history
+    # Lazy prediction: already recorded, not propagated yet
+    if(self.flag_history_enabled):
+      if(self.history.isEmpty() or self.estim_state_timestamp > self.history.getTimestampLast()):
+        idx_entry = self.history.appendEntry(self.estim_state_timestamp)
+        self.setHistoryEntryState(idx_entry)
+      elif(self.estim_state_timestamp == self.history.getTimestampLast() and self.history.getEntryStateStatus(self.history.getNumEntries()-1) == self.history.state_status_none):
+        self.setHistoryEntryState(self.history.getNumEntries()-1)
+
+    return
+
+
+  def resetPredictPending(self):
+
+    self.predict_pending_timestamp = 0
+    self.predict_pending_num = 0
+    self.predict_pending_sum_delta_time = 0.0
+    self.predict_pending_sum_delta_time_sq = 0.0
+
+    return
+
+
+  def addPredictPending(self, timestamp):
+
+    # Requires lock_state
+    # Same as predict(): nothing for a timestamp not newer than the state
+
+    if(timestamp <= self.getStateTimestamp()):
+      return
+
+    delta_time = (timestamp - self.estim_state_timestamp)/1e9
+
+    self.predict_pending_timestamp = int(timestamp)
+    self.predict_pending_num += 1
+    self.predict_pending_sum_delta_time += delta_time
+    self.predict_pending_sum_delta_time_sq += delta_time*delta_time
+
+    # Recorded in the history, without a state until propagated
+    if(self.flag_history_enabled):
+      self.history.appendEntry(self.predict_pending_timestamp)
+
+    return
+
+
+  def predictPending(self):
+
+    # Requires lock_state
+    # Propagates the pending steps (lazy prediction), as predict()
+
+    if(not self.predict_pending_num):
+      return
+
+    self.predictStateHistory(self.predict_pending_timestamp)
+
+    return
+
+
+  def getCovProcModPending(self, timestamp):
+
+    # Requires lock_state
+    # Process noise of the pending steps and of the step to the timestamp
+    # [ns] (if after the last one), propagated to the timestamp, and resets
+    # them. With tau_k the time from step k to the timestamp and F(tau) = I + tau * E,
+    # where E couples each of [posi_x, posi_y, posi_z, atti_yaw] (rows 0:4) to
+    # its derivative [vel_lin_x, vel_lin_y, vel_lin_z, vel_ang_z] (cols 4:8):
+    #   sum_k F(tau_k) * Fn * Q * Fn^T * F(tau_k)^T
+    #     = [[S2 * Qv, S1 * Qv], [S1 * Qv, S0 * Qv]]
+    # with S0 = sum_k 1, S1 = sum_k tau_k, S2 = sum_k tau_k^2, and Qv the
+    # block of Fn * Q * Fn^T on the velocities
+
+    delta_time = (timestamp - self.estim_state_timestamp)/1e9
+
+    num_steps = self.predict_pending_num
+    sum_delta_time = self.predict_pending_sum_delta_time
+    sum_delta_time_sq = self.predict_pending_sum_delta_time_sq
+    if(timestamp > self.predict_pending_timestamp):
+      num_steps += 1
+      sum_delta_time += delta_time
+      sum_delta_time_sq += delta_time*delta_time
+    self.resetPredictPending()
+
+    sum_tau = num_steps*delta_time - sum_delta_time
+    sum_tau_sq = num_steps*delta_time*delta_time - 2.0*delta_time*sum_delta_time + sum_delta_time_sq
+
+    cov_proc_mod_block = self.workspace.cov_proc_mod_block
+    cov_proc_mod = np.empty((8, 8), dtype=float)
+    np.multiply(cov_proc_mod_block, sum_tau_sq, out=cov_proc_mod[0:4, 0:4])
+    np.multiply(cov_proc_mod_block, sum_tau, out=cov_proc_mod[0:4, 4:8])
+    np.multiply(cov_proc_mod_block, sum_tau, out=cov_proc_mod[4:8, 0:4])
+    np.multiply(cov_proc_mod_block, float(num_steps), out=cov_proc_mod[4:8, 4:8])
+
+    return cov_proc_mod
+
+
+  def predictState(self, timestamp):
+
+    # Requires lock_state
 
     # Delta time
     delta_time = 0.0
-    estim_state_timestamp = self.estim_state_timestamp.to_msg()
-    if(estim_state_timestamp.sec == 0 and estim_state_timestamp.nanosec == 0):
+    if(self.estim_state_timestamp == 0):
       delta_time = 0.0
     else:
-      delta_time = (timestamp - self.estim_state_timestamp).nanoseconds/1e9
-
-    # State
-    estim_x_kk_robot_posi = self.estim_robot_posi
-    estim_x_kk_robot_atti_quat_simp = self.estim_robot_atti_quat_simp
-    estim_x_kk_robot_velo_lin_world = self.estim_robot_velo_lin_world
-    estim_x_kk_robot_velo_ang_world = self.estim_robot_velo_ang_world
-    # Cov
-    estim_P_kk = self.estim_state_cov
-
+      delta_time = (timestamp - self.estim_state_timestamp)/1e9
+      # Nothing to propagate (same timestamp, or older than the state)
+      if(delta_time <= 0.0):
+        return
+
+    # IMU-driven prediction. Constant velocity model until the first IMU
+    # sample
+    # The noise of the preintegration does not depend on the steps: the
+    # pending ones (lazy prediction) are just dropped
+    if(self.imu.flag_enabled and delta_time > 0.0):
+      if(self.predictStateImu(timestamp)):
+        self.resetPredictPending()
+        self.estim_state_timestamp = int(timestamp)
+        return
+
+    # Lazy prediction: process noise of the merged steps
+    cov_proc_mod_pending = None
+    if(self.predict_pending_num and delta_time > 0.0):
+      cov_proc_mod_pending = self.getCovProcModPending(timestamp)
+
+    # Workspace
+    workspace = self.workspace
+
+    # State and Cov
+    # Propagated in place
 
     # Process model
 
     # Position
-    # TODO BY STUDENT
-    # estim_x_k1k_robot_posi = 
+    np.multiply(self.estim_robot_velo_lin_world, delta_time, out=workspace.delta_robot_posi)
+    self.estim_robot_posi += workspace.delta_robot_posi
 
     # Attitude
-    delta_robot_atti_ang = delta_time * estim_x_kk_robot_velo_ang_world
-    delta_robot_atti_quat_sim = ars_lib_helpers.Quaternion.quatSimpFromAngle(delta_robot_atti_ang)
-    estim_x_k1k_robot_atti_quat_simp = ars_lib_helpers.Quaternion.quatSimpProd(estim_x_kk_robot_atti_quat_simp, delta_robot_atti_quat_sim)
+    delta_robot_atti_ang = delta_time * self.estim_robot_velo_ang_world[0]
+    delta_robot_atti_quat_sim = QuatSimp.quatSimpFromAngle(delta_robot_atti_ang)
+    self.estim_robot_atti_quat_simp = QuatSimp.quatSimpProd(self.estim_robot_atti_quat_simp, delta_robot_atti_quat_sim)
 
     # Velocity Linear
     # Constant
-    # TODO BY STUDENT
-    # estim_x_k1k_robot_velo_lin_world = 
 
     # Velocity Angular
     # Constant
-    estim_x_k1k_robot_velo_ang_world = estim_x_kk_robot_velo_ang_world
 
 
     # Jacobian - Fx
-    jac_Fx = np.zeros((8,8), dtype=float)
-    # Position k+1 - Position k
-    # TODO BY STUDENT
-    # jac_Fx[0:3, 0:3] = 
+    # Only the entries depending on delta_time are written
     # Position k+1 - Velocity k
-    # jac_Fx[0:3, 4:7] = 
-    # Attitude k+1 - Attitude k
-    jac_Fx[3, 3] = 1.0
-    jac_Fx[3, 7] = delta_time
-    # Velocity linear k+1 - Velocity linear k
-    # TODO BY STUDENT
-    # jac_Fx[4:7, 4:7] = 
-    # Velocity angular k+1 - Velocity angular k
-    jac_Fx[7, 7] = 1.0
-
+    # Attitude k+1 - Velocity angular k
+    workspace.jac_Fx[workspace.jac_Fx_delta_time_idx] = delta_time
 
     # Jacobian - Fn
-    jac_Fn = np.zeros((8,4), dtype=float)
-    # Velocity linear k+1 - Noise Velocity linear
-    # TODO BY STUDENT
-    # jac_Fn[4:7, 0:3] = 
-    # Velocity angular k+1 - Noise Velocity angular
-    jac_Fn[7,3] = 1.0
+    # Constant: Fn * Q * Fn^T precomputed
 
 
     # Covariance
-    # TODO BY STUDENT
-    # estim_P_k1k = 
-    
+    # Steady state: the covariance only depends on delta_time and on the
+    # covariance of the previous cycle, which is the cached one
+    # Merged steps: not the cycle of the steady state
+    steady_state_entry = None
+    if(self.steady_state.flag_enabled and cov_proc_mod_pending is None):
+      steady_state_entry = self.steady_state.getPredictEntry(delta_time)
+
+    if(steady_state_entry is not None):
+      np.copyto(self.estim_state_cov, steady_state_entry.cov_prior)
+    elif(cov_proc_mod_pending is not None):
+      np.matmul(workspace.jac_Fx, self.estim_state_cov, out=workspace.jac_Fx_cov)
+      np.matmul(workspace.jac_Fx_cov, workspace.jac_Fx.T, out=self.estim_state_cov)
+      self.estim_state_cov += cov_proc_mod_pending
+    else:
+      np.matmul(workspace.jac_Fx, self.estim_state_cov, out=workspace.jac_Fx_cov)
+      np.matmul(workspace.jac_Fx_cov, workspace.jac_Fx.T, out=self.estim_state_cov)
+      self.estim_state_cov += workspace.cov_proc_mod_jac_Fn
+
+    if(self.steady_state.flag_enabled):
+      if(cov_proc_mod_pending is None):
+        self.steady_state.setPredicted(delta_time, self.estim_state_cov, steady_state_entry)
+      else:
+        self.steady_state.resetPhase()
 
 
     # Prepare for next iteration
     #
-    self.estim_state_timestamp = timestamp
-    #
-    self.estim_robot_posi = estim_x_k1k_robot_posi
-    self.estim_robot_atti_quat_simp = estim_x_k1k_robot_atti_quat_simp
-    self.estim_robot_velo_lin_world = estim_x_k1k_robot_velo_lin_world
-    self.estim_robot_velo_ang_world = estim_x_k1k_robot_velo_ang_world
+    self.estim_state_timestamp = int(timestamp)
+
     #
-    self.estim_state_cov = estim_P_k1k
+    return
 
 
-    #
+  def predictStateImu(self, timestamp):
+
+    # Requires lock_state
+    # Returns False if there is no IMU sample to predict with.
+    # With the preintegration over the interval, in the frame of the robot
+    # at the start (R = R(yaw)):
+    #   posi += vel_lin * T + R * dp + 0.5 * g * T^2
+    #   atti_yaw += dth
+    #   vel_lin += R * dv + g * T
+    #   vel_ang_z = w of the last sample
+    # The covariance is propagated once for the whole interval:
+    #   P = Fx * P * Fx^T + Fn * cov_preint * Fn^T
+    # with vel_ang_z uncorrelated, of the variance of the last sample
+
+    self.lock_meas.acquire()
+    imu_samples = self.imu.getSamples(self.estim_state_timestamp, timestamp)
+    self.lock_meas.release()
+
+    if(imu_samples is None):
+      return False
+
+    imu_delta_time, imu_lin_acc, imu_ang_vel = imu_samples
+    preint = self.imu.preintegrate(imu_delta_time, imu_lin_acc, imu_ang_vel)
+
+    # Rotation of the attitude at the start
+    workspace = self.workspace
+    workspace.setRobotAttiAngle(QuatSimp.angleFromQuatSimp(self.estim_robot_atti_quat_simp))
+    robot_atti_rot_mat = workspace.robot_atti_rot_mat
+    delta_velo_lin_world = np.matmul(robot_atti_rot_mat, preint.delta_velo_lin)
+    delta_posi_world = np.matmul(robot_atti_rot_mat, preint.delta_posi)
+
+    # Jacobian - Fx
+    jac_Fx = workspace.jac_Fx_imu
+    jac_Fx[workspace.jac_Fx_imu_delta_time_idx] = preint.delta_time
+    # d (R * d) / d yaw = J * R * d = [-d_y, d_x, 0]
+    jac_Fx[0, 3] = -delta_posi_world[1]
+    jac_Fx[1, 3] = delta_posi_world[0]
+    jac_Fx[4, 3] = -delta_velo_lin_world[1]
+    jac_Fx[5, 3] = delta_velo_lin_world[0]
+
+    # Jacobian - Fn
+    jac_Fn = workspace.jac_Fn_imu
+    jac_Fn[0:3, 0:3] = robot_atti_rot_mat
+    jac_Fn[4:7, 4:7] = robot_atti_rot_mat
+
+    # State
+    gravity = self.imu.gravity
+    self.estim_robot_posi += self.estim_robot_velo_lin_world*preint.delta_time + delta_posi_world
+    self.estim_robot_posi[2] -= 0.5*gravity*preint.delta_time*preint.delta_time
+    self.estim_robot_atti_quat_simp = QuatSimp.quatSimpProd(self.estim_robot_atti_quat_simp, QuatSimp.quatSimpFromAngle(preint.delta_atti_ang))
+    self.estim_robot_velo_lin_world += delta_velo_lin_world
+    self.estim_robot_velo_lin_world[2] -= gravity*preint.delta_time
+    self.estim_robot_velo_ang_world[0] = preint.ang_vel_last
+
+    # Covariance
+    np.matmul(jac_Fx, self.estim_state_cov, out=workspace.jac_Fx_cov)
+    np.matmul(workspace.jac_Fx_cov, jac_Fx.T, out=self.estim_state_cov)
+    self.estim_state_cov += np.matmul(np.matmul(jac_Fn, preint.cov), jac_Fn.T)
+    self.estim_state_cov[7, 7] = self.imu.cov_ang_vel/imu_delta_time[-1]
+
+    # Not the cycle of the steady state
+    if(self.steady_state.flag_enabled):
+      self.steady_state.resetPhase()
+
+    return True
+
+
+  def getStateSnapshotImu(self):
+
+    # Snapshot of the estimated state propagated with the IMU samples
+    # received since, up to the last one: high-rate state, e.g. for control.
+    # Only the mean is propagated: the covariance is the one of the
+    # estimated state. The filter is not modified (lock-free wrt the
+    # filter, like getStateSnapshot)
+
+    estim_state_snapshot = self.estim_state_snapshot
+
+    self.lock_meas.acquire()
+    imu_samples = None
+    if(self.imu.num_samples):
+      timestamp_imu = self.imu.getTimestampLast()
+      imu_ang_vel_last = self.imu.getAngVelLast()
+      if(estim_state_snapshot.timestamp and timestamp_imu > estim_state_snapshot.timestamp):
+        imu_samples = self.imu.getSamples(estim_state_snapshot.timestamp, timestamp_imu)
+    self.lock_meas.release()
+
+    if(imu_samples is None):
+      return estim_state_snapshot
+
+    preint = self.imu.preintegrate(*imu_samples, flag_cov=False)
+
+    # Same as predictStateImu(), mean only
+    cos_robot_atti_ang = estim_state_snapshot.cos_robot_atti_ang
+    sin_robot_atti_ang = estim_state_snapshot.sin_robot_atti_ang
+    delta_time = preint.delta_time
+    gravity = self.imu.gravity
+
+    robot_posi = estim_state_snapshot.robot_posi + estim_state_snapshot.robot_velo_lin_world*delta_time
+    robot_posi[0] += cos_robot_atti_ang*preint.delta_posi[0] - sin_robot_atti_ang*preint.delta_posi[1]
+    robot_posi[1] += sin_robot_atti_ang*preint.delta_posi[0] + cos_robot_atti_ang*preint.delta_posi[1]
+    robot_posi[2] += preint.delta_posi[2] - 0.5*gravity*delta_time*delta_time
+    robot_atti_quat_simp = QuatSimp.quatSimpProd(estim_state_snapshot.robot_atti_quat_simp, QuatSimp.quatSimpFromAngle(preint.delta_atti_ang))
+    robot_velo_lin_world = estim_state_snapshot.robot_velo_lin_world.copy()
+    robot_velo_lin_world[0] += cos_robot_atti_ang*preint.delta_velo_lin[0] - sin_robot_atti_ang*preint.delta_velo_lin[1]
+    robot_velo_lin_world[1] += sin_robot_atti_ang*preint.delta_velo_lin[0] + cos_robot_atti_ang*preint.delta_velo_lin[1]
+    robot_velo_lin_world[2] += preint.delta_velo_lin[2] - gravity*delta_time
+    robot_velo_ang_world = np.array([imu_ang_vel_last])
+
+    return ArsMsfStateEstimatorSnapshot(estim_state_snapshot.version, timestamp_imu, robot_posi, robot_atti_quat_simp, robot_velo_lin_world, robot_velo_ang_world, estim_state_snapshot.state_cov)
+
+
+  def getStateAtTimestamp(self, timestamp):
+
+    # State and covariance at the timestamp [ns], scalar or vector:
+    # - Within the history: interpolated between the entries around it
+    # - From the estimated state up to query_extrapolation_time_max past
+    #   it: extrapolated with the process model (constant velocity, one
+    #   prediction step: the same as predict())
+    # Returns (state [..., 9], covariance [..., 8, 8], valid [...]), the
+    # state as in the snapshot. Not valid (NaN): older than the history,
+    # or too far in the future
+
+    timestamp_shape = np.shape(timestamp)
+    timestamp = np.asarray(timestamp, dtype=np.int64).reshape(-1)
+
+    state = np.full((timestamp.shape[0], 9), np.nan, dtype=float)
+    state_cov = np.full((timestamp.shape[0], 8, 8), np.nan, dtype=float)
+
+    self.lock_state.acquire()
+
+    # Lazy prediction: from the state at the last step
+    if(self.predict_pending_num):
+      self.predictPending()
+      self.publishStateSnapshot()
+
+    estim_state_snapshot = self.estim_state_snapshot
+
+    flag_extrap = np.logical_and(timestamp >= estim_state_snapshot.timestamp, timestamp - estim_state_snapshot.timestamp <= self.query_extrapolation_time_max)
+    if(self.flag_history_enabled and not self.history.isEmpty()):
+      flag_interp = np.logical_and(timestamp >= self.history.getTimestamp(0), timestamp < estim_state_snapshot.timestamp)
+    else:
+      flag_interp = np.zeros(timestamp.shape, dtype=bool)
+    if(not estim_state_snapshot.timestamp):
+      flag_extrap[:] = False
+
+    # Interpolation
+    if(flag_interp.any()):
+      state[flag_interp], state_cov[flag_interp] = self.history.interpolateState(timestamp[flag_interp])
+
     self.lock_state.release()
 
-    #
-    return
+    # Extrapolation
+    if(flag_extrap.any()):
+      state[flag_extrap], state_cov[flag_extrap] = self.extrapolateState(estim_state_snapshot, timestamp[flag_extrap])
+
+    flag_valid = np.logical_or(flag_interp, flag_extrap)
+
+    return state.reshape(timestamp_shape+(9,)), state_cov.reshape(timestamp_shape+(8, 8)), flag_valid.reshape(timestamp_shape)
+
+
+  def extrapolateState(self, estim_state_snapshot, timestamp):
+
+    # Constant velocity model from the snapshot to each timestamp [ns]
+    # (vector, not older than the snapshot), vectorised.
+    # Fx = I + dt * E (see getCovProcModPending):
+    #   P' = P + dt * (E * P + P * E^T) + dt^2 * E * P * E^T + Fn * Q * Fn^T
+    # The noise is the one of one prediction step, as in predict()
+
+    delta_time = (timestamp - estim_state_snapshot.timestamp)*1e-9
+
+    # State
+    state = np.empty((timestamp.shape[0], 9), dtype=float)
+    state[:] = estim_state_snapshot.state
+    state[:, 0:3] += delta_time[:, None]*estim_state_snapshot.robot_velo_lin_world
+    # Attitude: q * q(w * dt), with the increment of w >= 0 (as
+    # QuatSimp.quatSimpFromAngle)
+    delta_atti_ang_half = 0.5*delta_time*estim_state_snapshot.robot_velo_ang_world[0]
+    cos_delta = np.cos(delta_atti_ang_half)
+    sin_delta = np.sin(delta_atti_ang_half)
+    sign_delta = np.where(cos_delta < 0.0, -1.0, 1.0)
+    cos_delta *= sign_delta
+    sin_delta *= sign_delta
+    robot_atti_quat_simp_w, robot_atti_quat_simp_z = estim_state_snapshot.robot_atti_quat_simp.tolist()
+    state[:, 3] = robot_atti_quat_simp_w*cos_delta - robot_atti_quat_simp_z*sin_delta
+    state[:, 4] = robot_atti_quat_simp_w*sin_delta + robot_atti_quat_simp_z*cos_delta
+
+    # Covariance
+    estim_P = estim_state_snapshot.state_cov
+    estim_EP = np.zeros((8, 8), dtype=float)
+    estim_EP[0:4] = estim_P[4:8]
+    estim_EPE = np.zeros((8, 8), dtype=float)
+    estim_EPE[0:4, 0:4] = estim_P[4:8, 4:8]
+    state_cov = estim_P + delta_time[:, None, None]*(estim_EP + estim_EP.T) + (delta_time*delta_time)[:, None, None]*estim_EPE
+    state_cov[delta_time > 0.0] += self.workspace.cov_proc_mod_jac_Fn
+
+    return state, state_cov
 
 
   def update(self):
@@ -314,208 +963,427 @@ class ArsMsfStateEstimator:
     self.lock_meas.acquire()
 
     # Measurements readings - To avoid races
+    # The queues are drained: each sample is used once
+    # Fields of the samples of each measurement
+    # Key: mask of the measurement
+    meas_samples = []
+    meas_values = dict()
+    meas_time_receive = dict()
+    meas_mask = 0
     #
-    flag_set_meas_robot_posi = self.flag_set_meas_robot_posi
-    if(flag_set_meas_robot_posi):
-      meas_z_robot_posi = self.meas_robot_posi
-    #
-    flag_set_meas_robot_atti = self.flag_set_meas_robot_atti
-    if(flag_set_meas_robot_atti):
-      meas_z_robot_atti_quat_simp = self.meas_robot_atti_quat_simp
-    #
-    flag_set_meas_robot_vel_robot = self.flag_set_meas_robot_vel_robot
-    if(flag_set_meas_robot_vel_robot):
-      meas_z_robot_velo_lin_robot = self.meas_robot_velo_lin_robot
-      meas_z_robot_velo_ang_robot = self.meas_robot_velo_ang_robot
+    for meas_mask_i, meas_queue in self.meas_queues.items():
+      if(meas_queue.num_samples):
+        meas_timestamps, meas_fields, meas_time_receive[meas_mask_i] = meas_queue.popAll()
+        meas_values[meas_mask_i] = list(zip(*meas_fields))
+        meas_samples += [(meas_timestamp, meas_mask_i, idx_sample) for idx_sample, meas_timestamp in enumerate(meas_timestamps)]
+        meas_mask |= meas_mask_i
 
-    # Put flags measurements down once used
-    if(self.flag_set_meas_robot_posi == True):
-      self.flag_set_meas_robot_posi = False
+    # Release
+    self.lock_meas.release()
 
-    if(self.flag_set_meas_robot_atti == True):
-      self.flag_set_meas_robot_atti = False
 
-    if(self.flag_set_meas_robot_vel_robot == True):
-      self.flag_set_meas_robot_vel_robot = False
+    # Mask of the measurements for update
+    self.meas_mask_last_update = meas_mask
+    self.meas_time_receive_last_update = meas_time_receive
 
-    # Release
-    self.lock_meas.release()
+    # Check that there is at least one measurement
+    if(meas_mask == 0):
+      return
 
 
-    # Dimension of the measurement for update
-    # Init
-    dim_meas = 0
     #
-    if(flag_set_meas_robot_posi == True):
-      dim_meas += 3
+    self.lock_state.acquire()
+
+    # Samples in timestamp order. Each group of samples is predicted to
+    # its timestamp and fused. A group is made of samples sharing the
+    # timestamp, one per measurement at most
+    # The samples of the group: only the ones of its mask are used
+    meas_samples.sort()
+    meas_z = dict()
+    meas_group_timestamp = meas_samples[0][0]
+    meas_group_mask = 0
+    for meas_timestamp, meas_sample_mask, idx_sample in meas_samples:
+      if(meas_timestamp != meas_group_timestamp or (meas_sample_mask & meas_group_mask)):
+        self.fuseMeasGroup(meas_group_timestamp, meas_group_mask, meas_z)
+        meas_group_timestamp = meas_timestamp
+        meas_group_mask = 0
+      meas_group_mask |= meas_sample_mask
+      meas_z[meas_sample_mask] = meas_values[meas_sample_mask][idx_sample]
+    self.fuseMeasGroup(meas_group_timestamp, meas_group_mask, meas_z)
+
+    # Snapshot
+    self.publishStateSnapshot()
+
     #
-    if(flag_set_meas_robot_atti == True):
-      dim_meas += 1
+    self.lock_state.release()
+    
     #
-    if(flag_set_meas_robot_vel_robot == True):
-      dim_meas += 4
+    return
+
+
+  def fuseMeasGroup(self, meas_timestamp, meas_mask, meas_z):
+
+    # Requires lock_state
+    # meas_z: fields of the sample of each measurement of the mask
+    # Key: mask of the measurement
+
+    # Lazy prediction: older than the last step, the pending steps are
+    # propagated first (as predict() would have done)
+    if(self.predict_pending_num and meas_timestamp < self.predict_pending_timestamp):
+      self.predictPending()
+
+    if(self.flag_history_enabled):
+      # Fused at its timestamp, also if delayed
+      self.fuseMeasAtTimestamp(meas_timestamp, meas_mask, meas_z)
+    else:
+      # Predicted to its timestamp, or fused at the current state if older
+      self.predictState(meas_timestamp)
+      self.updateState(meas_mask, meas_z)
+
+    return
+
+
+  def updateState(self, meas_mask, meas_z):
 
+    # Requires lock_state
+    # meas_z: fields of the sample of each measurement of the mask
+    # Key: mask of the measurement
+
+
+    # Workspace of the combination of measurements
+    workspace = self.workspace
+    workspace_update = workspace.getUpdate(meas_mask)
 
     # Check that there is at least one measurement
-    if(dim_meas == 0):
+    if(workspace_update is None):
       return
 
 
-    # State readings - To avoid races
-
-    #
-    self.lock_state.acquire()
+    # State readings
+    # Updated in place
 
-    # Robot
-    estim_x_k1k_robot_posi = self.estim_robot_posi
-    estim_x_k1k_robot_atti_quat_simp = self.estim_robot_atti_quat_simp
-    estim_x_k1k_robot_velo_lin_world = self.estim_robot_velo_lin_world
-    estim_x_k1k_robot_velo_ang_world = self.estim_robot_velo_ang_world
     # Cov
     estim_P_k1k = self.estim_state_cov
 
 
     # robot atti - angle
-    estim_x_k1k_robot_atti_ang = ars_lib_helpers.Quaternion.angleFromQuatSimp(estim_x_k1k_robot_atti_quat_simp)
-
-    # robot atti - Rotation matrix 3d
-    estim_x_k1k_robot_atti_rot_mat = np.zeros((3,3), dtype=float)
-    estim_x_k1k_robot_atti_rot_mat = ars_lib_helpers.Quaternion.rotMat3dFromQuatSimp(estim_x_k1k_robot_atti_quat_simp)
+    estim_x_k1k_robot_atti_ang = QuatSimp.angleFromQuatSimp(self.estim_robot_atti_quat_simp)
 
+    # robot atti - Rotation matrix 3d and its derivative (used by the
+    # measurement models)
+    workspace.setRobotAttiAngle(estim_x_k1k_robot_atti_ang)
 
 
     # Innovation of the measurement
-    innov_meas = np.zeros((dim_meas,), dtype=float)
-    innov_meas_idx = 0
-    if(flag_set_meas_robot_posi == True):
-      # Predicted measurement
-      # TODO BY STUDENT
-      # pred_z_robot_posi = 
-      # Innovation of the measurement
-      # TODO BY STUDENT
-      # innov_meas_robot_posi = 
-      # To the innovation vector
-      innov_meas[innov_meas_idx:innov_meas_idx+3] = innov_meas_robot_posi
-      innov_meas_idx += 3
-
-    if(flag_set_meas_robot_atti == True):
-      # Predicted measurement
-      pred_z_robot_atti_quat_simp = estim_x_k1k_robot_atti_quat_simp
-      # Innovation of the measurement
-      innov_meas_robot_atti_quat_simp = ars_lib_helpers.Quaternion.computeDiffQuatSimp(pred_z_robot_atti_quat_simp, meas_z_robot_atti_quat_simp)
-      # Converting to angle
-      innov_meas_robot_atti_angle = ars_lib_helpers.Quaternion.angleFromQuatSimp(innov_meas_robot_atti_quat_simp)
-      # To the innovation vector
-      innov_meas[innov_meas_idx:innov_meas_idx+1] = innov_meas_robot_atti_angle
-      innov_meas_idx += 1
-
-    if(flag_set_meas_robot_vel_robot == True):
-      # Predicted measurement
-      # TODO BY STUDENT
-      # pred_z_robot_velo_lin_robot = 
-      pred_z_robot_velo_ang_robot = 1.0 * estim_x_k1k_robot_velo_ang_world
-      # Innovation of the measurement
-      # TODO BY STUDENT
-      # innov_meas_robot_velo_lin_robot = 
-      innov_meas_robot_velo_ang_robot = pred_z_robot_velo_ang_robot - meas_z_robot_velo_ang_robot
-      # To the innovation vector
-      innov_meas[innov_meas_idx:innov_meas_idx+3] = innov_meas_robot_velo_lin_robot
-      innov_meas_idx += 3
-      innov_meas[innov_meas_idx:innov_meas_idx+1] = innov_meas_robot_velo_ang_robot
-      innov_meas_idx += 1
-
-
-    # Covariance of the measurement
-    cov_meas = np.zeros((dim_meas,dim_meas), dtype=float)
-    cov_meas_idx = 0
-    if(flag_set_meas_robot_posi == True):
-      cov_meas[cov_meas_idx:cov_meas_idx+3, cov_meas_idx:cov_meas_idx+3] = self.cov_meas_posi
-      cov_meas_idx += 3
-
-    if(flag_set_meas_robot_atti == True):
-      cov_meas[cov_meas_idx:cov_meas_idx+1, cov_meas_idx:cov_meas_idx+1] = self.cov_meas_atti 
-      cov_meas_idx += 1
-
-    if(flag_set_meas_robot_vel_robot == True):
-      cov_meas[cov_meas_idx:cov_meas_idx+3, cov_meas_idx:cov_meas_idx+3] = self.cov_meas_velo_lin
-      cov_meas_idx += 3
-      cov_meas[cov_meas_idx:cov_meas_idx+1, cov_meas_idx:cov_meas_idx+1] = self.cov_meas_velo_ang
-      cov_meas_idx += 1
-
-
-    # Jacobian Hx
-    jac_Hx = np.zeros((dim_meas,8), dtype=float)
-    jac_Hx_meas_idx = 0
-    if(flag_set_meas_robot_posi == True):
-      # Meas robot posi - robot posi
-      # TODO BY STUDENT
-      # jac_Hx[jac_Hx_meas_idx:jac_Hx_meas_idx+3, 0:3] = 
-      jac_Hx_meas_idx += 3
-
-    if(flag_set_meas_robot_atti == True):
-      # Meas robot atti - robot atti
-      jac_Hx[jac_Hx_meas_idx:jac_Hx_meas_idx+1, 3] = 1.0
-      jac_Hx_meas_idx += 1
-
-    if(flag_set_meas_robot_vel_robot == True):
-      # Meas velo lin - robot atti
-      mat_R = ars_lib_helpers.Quaternion.diffRotMat3dWrtAngleFromAngle(estim_x_k1k_robot_atti_ang)
-      jac_Hx[jac_Hx_meas_idx:jac_Hx_meas_idx+3, 3] = np.matmul(mat_R.T, estim_x_k1k_robot_velo_lin_world)
-      # Meas velo lin - robot velo lin
-      # TODO BY STUDENT
-      # jac_Hx[jac_Hx_meas_idx:jac_Hx_meas_idx+3, 4:7] = 
-      jac_Hx_meas_idx += 3
-      # Meas velo ang - robot velo ang
-      jac_Hx[jac_Hx_meas_idx:jac_Hx_meas_idx+1, 7] = 1.0
-      jac_Hx_meas_idx += 1
-
-
-    # Covariance of the innovation of the measurement
-    # TODO BY STUDENT
-    # cov_innov_meas = 
-
-
-    # Kalman Gain
-    # TODO BY STUDENT
-    # kalman_gain = 
+    # Jacobian Hx (non-constant entries)
+    # The covariance of the measurement and the constant entries of
+    # the Jacobian Hx are already in the workspace. Each model writes its
+    # rows
+    innov_meas = workspace_update.innov_meas
+    cov_meas = workspace_update.cov_meas
+    jac_Hx = workspace_update.jac_Hx
 
+    for meas_model, innov_meas_model, jac_Hx_model in workspace_update.meas_models_rows:
+      meas_model.setInnovJacobian(self, workspace, meas_z[meas_model.meas_mask], innov_meas_model, jac_Hx_model)
 
-    # Updated state
-    delta_x = np.matmul(kalman_gain, innov_meas)
 
+    # Steady state: cached gain and updated covariance of the cycle
+    steady_state_entry = None
+    if(self.steady_state.flag_enabled):
+      steady_state_entry = self.steady_state.getUpdateEntry(meas_mask, estim_x_k1k_robot_atti_ang, self.estim_robot_velo_lin_world)
+      # Gating: a cycle with a rejected block is not the cached one
+      if(steady_state_entry is not None and self.gating.flag_enabled):
+        innov_meas_norm = np.matmul(steady_state_entry.cov_innov_meas_chol_inv, innov_meas)
+        if(self.gating.getRejectedBlocks(workspace_update, innov_meas_norm).any()):
+          steady_state_entry = None
+
+
+    # Gating: by measurement blocks
+    update_mode = self.update_mode
+    if(self.gating.flag_enabled and update_mode == 'sequential_scalar'):
+      update_mode = 'batch'
+
+
+    # Correction of the state and updated covariance of state
+    self.gating.meas_mask_rejected = 0
+    if(steady_state_entry is not None):
+
+      # Correction of the state
+      delta_x = np.matmul(steady_state_entry.kalman_gain, innov_meas, out=workspace_update.delta_x)
+
+      # Updated covariance of state
+      np.copyto(estim_P_k1k, steady_state_entry.cov_post)
+
+    elif(update_mode == 'batch'):
+
+      delta_x = self.computeBatchUpdate(innov_meas, estim_P_k1k, workspace_update)
+
+    else:
+
+      if(update_mode == 'sequential_scalar'):
+        # One row at a time (R is diagonal)
+        meas_blocks = workspace_update.meas_blocks_scalar
+      else:
+        meas_blocks = workspace_update.meas_blocks
+
+      delta_x, self.estim_state_cov = self.computeSequentialUpdate(innov_meas, cov_meas, jac_Hx, estim_P_k1k, meas_blocks, workspace_update)
+
+    if(self.steady_state.flag_enabled):
+      if(self.gating.meas_mask_rejected):
+        # Not the cycle of the combination of measurements
+        self.steady_state.resetPhase()
+      else:
+        self.steady_state.setUpdated(meas_mask, self.estim_state_cov, steady_state_entry, jac_Hx, cov_meas, estim_x_k1k_robot_atti_ang, self.estim_robot_velo_lin_world)
+
+
+    # Updated state
     # Robot posi
-    delta_x_robot_posi = delta_x[0:3]
-    estim_x_k1k1_robot_posi = estim_x_k1k_robot_posi - delta_x_robot_posi
+    self.estim_robot_posi -= delta_x[0:3]
     # Robot attitude
     delta_x_robot_atti_ang = delta_x[3]
-    delta_x_robot_atti_quat_sim = ars_lib_helpers.Quaternion.quatSimpFromAngle(delta_x_robot_atti_ang)
-    estim_x_k1k1_robot_atti_quat_simp = ars_lib_helpers.Quaternion.computeDiffQuatSimp(estim_x_k1k_robot_atti_quat_simp, delta_x_robot_atti_quat_sim) 
+    delta_x_robot_atti_quat_sim = QuatSimp.quatSimpFromAngle(delta_x_robot_atti_ang)
+    self.estim_robot_atti_quat_simp = QuatSimp.computeDiffQuatSimp(self.estim_robot_atti_quat_simp, delta_x_robot_atti_quat_sim) 
     # Velocity linear 
-    delta_x_robot_velo_lin_world = delta_x[4:7]
-    estim_x_k1k1_robot_velo_lin_world = estim_x_k1k_robot_velo_lin_world - delta_x_robot_velo_lin_world
+    self.estim_robot_velo_lin_world -= delta_x[4:7]
     # Velocity angular
-    delta_x_robot_velo_ang_world = delta_x[7]
-    estim_x_k1k1_robot_velo_ang_world = estim_x_k1k_robot_velo_ang_world - delta_x_robot_velo_ang_world
+    self.estim_robot_velo_ang_world -= delta_x[7]
+
+    #
+    return
+
+
+  def computeBatchUpdate(self, innov_meas, estim_P_k1k, workspace_update):
+
+    # Batch update by one Cholesky factorisation of the joint matrix
+    #   M = [ S         .      .
+    #         innov^T   alpha  .
+    #         P * Hx^T  0      P ]
+    # whose factor is, with S = L * L^T, u = L^-1 * innov and
+    # W = L^-1 * Hx * P:
+    #   [ L       .      .
+    #     u^T     l      .
+    #     W^T     -dx/l  L' ]
+    # - Correction of the state: dx = K * innov = W^T * u
+    # - Updated covariance: P - K * S * K^T = P - W^T * W
+    #   = [-dx/l, L'] * [-dx/l, L']^T, symmetric and positive
+    #   semi-definite by construction
+    # The solves by L are done within the factorisation: no inverse.
+    # M is positive definite if P is and alpha > innov^T * R^-1 * innov
+    # (Schur complement of P). Updates P in place
+
+    dim_meas = workspace_update.dim_meas
+    cov_joint = workspace_update.cov_joint
+
+    # M = G * P * G^T + R_joint
+    np.matmul(workspace_update.jac_Hx_joint, estim_P_k1k, out=workspace_update.jac_Hx_joint_cov)
+    np.matmul(workspace_update.jac_Hx_joint_cov, workspace_update.jac_Hx_joint.T, out=cov_joint)
+    cov_joint += workspace_update.cov_meas_joint
 
+    # Innovation, and alpha (bound of innov^T * R^-1 * innov)
+    cov_joint[dim_meas, 0:dim_meas] = innov_meas
+    cov_joint[dim_meas, dim_meas] = 1.0 + np.dot(innov_meas, innov_meas) * workspace_update.var_meas_min_inv
+
+    # Factorisation
+    cov_joint_chol = np.linalg.cholesky(cov_joint)
+
+    # Gating
+    if(self.gating.flag_enabled):
+      cov_joint_chol = self.gateBatchUpdate(cov_joint, cov_joint_chol, workspace_update)
+
+    # Correction of the state
+    delta_x = np.matmul(cov_joint_chol[dim_meas+1:, 0:dim_meas], cov_joint_chol[dim_meas, 0:dim_meas], out=workspace_update.delta_x)
 
     # Updated covariance of state
-    # TODO BY STUDENT
-    # estim_P_k1k1 = 
+    cov_joint_chol_cov = cov_joint_chol[dim_meas+1:, dim_meas:]
+    np.matmul(cov_joint_chol_cov, cov_joint_chol_cov.T, out=estim_P_k1k)
 
+    return delta_x
 
-    
-    # Prepare for next iteration
-    #
-    self.estim_robot_posi = estim_x_k1k1_robot_posi
-    self.estim_robot_atti_quat_simp = estim_x_k1k1_robot_atti_quat_simp
-    self.estim_robot_velo_lin_world = estim_x_k1k1_robot_velo_lin_world
-    self.estim_robot_velo_ang_world = estim_x_k1k1_robot_velo_ang_world
-    #
-    self.estim_state_cov = estim_P_k1k1
 
+  def gateBatchUpdate(self, cov_joint, cov_joint_chol, workspace_update):
+
+    # Drops the rejected blocks from the batch update, and returns the
+    # factor of the joint matrix of the accepted ones.
+    # The row u^T of the factor is the innovation normalised block after
+    # block: the distance of a block is the one wrt the blocks before it.
+    # The first rejected block is dropped by clearing its rows and columns
+    # of M (unit diagonal): it is then uncorrelated with the rest and its
+    # innovation is zero, so it has no effect on the update. M is factorised
+    # again and the blocks after it are tested wrt the accepted ones only,
+    # as in the sequential update. No layout is built for the remaining
+    # combination of measurements
+
+    dim_meas = workspace_update.dim_meas
+
+    while(True):
+
+      flag_rejected = self.gating.getRejectedBlocks(workspace_update, cov_joint_chol[dim_meas, 0:dim_meas])
+      if(not flag_rejected.any()):
+        return cov_joint_chol
+
+      # First rejected block
+      idx_block = int(flag_rejected.argmax())
+      meas_block = workspace_update.meas_blocks[idx_block]
+      self.gating.addRejected(workspace_update.meas_blocks_mask[idx_block])
+
+      # Dropped
+      cov_joint[meas_block[0]:meas_block[1]] = 0.0
+      cov_joint[:, meas_block[0]:meas_block[1]] = 0.0
+      for row in range(meas_block[0], meas_block[1]):
+        cov_joint[row, row] = 1.0
+
+      # Factorisation
+      cov_joint_chol = np.linalg.cholesky(cov_joint)
+
+
+  def computeSequentialUpdate(self, innov_meas, cov_meas, jac_Hx, estim_P_k1k, meas_blocks, workspace_update=None):
+
+    # Processes the blocks of the measurement one after another.
+    # The blocks must be uncorrelated (cov_meas block-diagonal).
+    # All the blocks are linearized at the same state as the batch update,
+    # so the result is the same as the batch update, but only the small
+    # innovation covariance of each block is solved.
+    # With gating (meas_blocks: one per measurement), a rejected block is
+    # skipped
+
+    # Correction of the state
+    delta_x = np.zeros((8,), dtype=float)
+    # Covariance of state
+    estim_P = estim_P_k1k
+
+    for idx_block, meas_block in enumerate(meas_blocks):
+
+      #
+      jac_Hx_block = jac_Hx[meas_block[0]:meas_block[1]]
+      cov_meas_block = cov_meas[meas_block[0]:meas_block[1], meas_block[0]:meas_block[1]]
+
+      # Innovation wrt the state already corrected by the previous blocks
+      innov_meas_block = innov_meas[meas_block[0]:meas_block[1]] - np.matmul(jac_Hx_block, delta_x)
+
+      # P * Hx^T
+      estim_P_jac_Hx_t = np.matmul(estim_P, jac_Hx_block.T)
+
+      # Covariance of the innovation of the measurement block
+      cov_innov_meas_block = np.matmul(jac_Hx_block, estim_P_jac_Hx_t) + cov_meas_block
+
+      # Gating
+      if(self.gating.flag_enabled):
+        dist_meas_block = np.dot(innov_meas_block, np.linalg.solve(cov_innov_meas_block, innov_meas_block))
+        if(dist_meas_block > self.gating.getThresholds(workspace_update)[idx_block]):
+          self.gating.addRejected(workspace_update.meas_blocks_mask[idx_block])
+          continue
+
+      # Kalman Gain
+      if(meas_block[1] - meas_block[0] == 1):
+        kalman_gain_block = estim_P_jac_Hx_t / cov_innov_meas_block[0, 0]
+      else:
+        kalman_gain_block = np.linalg.solve(cov_innov_meas_block, estim_P_jac_Hx_t.T).T
+
+      # Correction of the state
+      delta_x = delta_x + np.matmul(kalman_gain_block, innov_meas_block)
+
+      # Updated covariance of state
+      estim_P = estim_P - np.matmul(kalman_gain_block, estim_P_jac_Hx_t.T)
+
+    return delta_x, estim_P
+
+
+  def fuseMeasAtTimestamp(self, timestamp, meas_mask, meas_z):
+
+    # Requires lock_state
+    # Returns False if the measurement was too old to be fused
 
     #
-    self.lock_state.release()
-    
-    #
+    timestamp_ns = int(timestamp)
+
+    # Number of entries older than or at the timestamp of the measurement.
+    # In-order measurements (the common case) skip the binary search
+    num_entries = self.history.getNumEntries()
+    if(num_entries == 0 or timestamp_ns >= self.history.getTimestampLast()):
+      idx_meas = num_entries
+    else:
+      idx_meas = int(self.history.searchTimestamp(timestamp_ns))
+
+
+    # Measurement not delayed: fused at the newest entry
+    if(idx_meas == num_entries):
+
+      # Lazy prediction: the newest entry can be a step not propagated yet
+      self.predictState(timestamp_ns)
+      if(num_entries == 0 or timestamp_ns > self.history.getTimestampLast() or (self.history.getEntryMeasMask(num_entries-1) & meas_mask)):
+        idx_meas = self.history.appendEntry(timestamp_ns)
+      else:
+        idx_meas = num_entries-1
+
+      self.history.setEntryMeas(idx_meas, meas_mask, meas_z)
+      self.updateState(meas_mask, meas_z)
+      self.setHistoryEntryState(idx_meas)
+
+      return True
+
+
+    # Delayed measurement: roll back to its timestamp and replay forward
+    flag_merge_entry = False
+    if(idx_meas > 0 and self.history.getTimestamp(idx_meas-1) == timestamp_ns and not (self.history.getEntryMeasMask(idx_meas-1) & meas_mask)):
+      flag_merge_entry = True
+      idx_entry = idx_meas-1
+    elif(self.history.isFull()):
+      idx_entry = idx_meas-1
+    else:
+      idx_entry = idx_meas
+
+    # The posterior of a previous entry is needed to roll back
+    if(idx_entry < 1 or self.history.getIdxEntryPosterior(idx_entry-1) < 0):
+      self.num_meas_dropped_too_old += 1
+      return False
+
+    if(not flag_merge_entry):
+      if(self.history.isFull()):
+        self.history.removeOldestEntry()
+      self.history.insertEntry(idx_entry, timestamp_ns)
+
+    self.history.setEntryMeas(idx_entry, meas_mask, meas_z)
+
+    # Replay
+    self.replayHistory(idx_entry, meas_mask)
+
+    return True
+
+
+  def replayHistory(self, idx_start, meas_mask_new=0):
+
+    # Requires lock_state
+    # Cost O(num_entries - idx_start)
+    # meas_mask_new: measurements added to the entry idx_start
+
+    # Roll back to the posterior of the previous entry. Lazy prediction: the
+    # interpolated entries before are propagated again, one by one
+    idx_posterior = self.history.getIdxEntryPosterior(idx_start-1)
+    self.estim_robot_posi, self.estim_robot_atti_quat_simp, self.estim_robot_velo_lin_world, self.estim_robot_velo_ang_world, self.estim_state_cov = self.history.getEntryState(idx_posterior)
+    self.estim_state_timestamp = self.history.getTimestamp(idx_posterior)
+    # The covariance is no longer the one of the steady state
+    self.steady_state.resetPhase()
+
+    # Replay forward
+    # The other measurements were already gated when fused first: only the
+    # rejections of the new ones are counted
+    for idx_entry in range(idx_posterior+1, self.history.getNumEntries()):
+      #
+      self.predictState(self.history.getTimestamp(idx_entry))
+      #
+      meas_mask = self.history.getEntryMeasMask(idx_entry)
+      if(meas_mask):
+        self.gating.meas_mask_count = meas_mask_new if idx_entry == idx_start else 0
+        self.updateState(meas_mask, self.history.getEntryMeas(idx_entry))
+      #
+      self.setHistoryEntryState(idx_entry)
+    self.gating.meas_mask_count = -1
+
+    return
+
+
+  def setHistoryEntryState(self, idx_entry):
+
+    self.history.setEntryState(idx_entry, self.estim_robot_posi, self.estim_robot_atti_quat_simp, self.estim_robot_velo_lin_world, self.estim_robot_velo_ang_world, self.estim_state_cov)
+
     return
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import threading
+
+
+
+
+class ArsMsfStateEstimatorBank:
+
+  #######
+
+  # Bank of N independent MSF state estimators (one per robot) with the
+  # same model as ArsMsfStateEstimator, stored in stacked arrays.
+  # predict() propagates all the robots in one batched call.
+  # update() fuses, for each combination of measurements, all the robots
+  # with fresh measurements in one batched call.
+  # Timestamps are integer nanoseconds.
+  #
+  # Limitations wrt ArsMsfStateEstimator: one slot per measurement and
+  # robot (the last sample wins, no queues), and the samples are fused at
+  # the current state of the robot, whatever their timestamp: no history,
+  # so out-of-order or late samples are not fused at their timestamp.
+  # Built-in measurements only (no measurement models nor additional
+  # sources), batch update only, no gating.
+
+  # Masks of the measurements
+  meas_mask_robot_posi = 1
+  meas_mask_robot_atti = 2
+  meas_mask_robot_vel_robot = 4
+
+  # Number of robots
+  num_robots = None
+
+  # Meas position
+  # z_t = [m_posi_x, m_posi_y, m_posi_z]
+  flag_set_meas_robot_posi = None
+  meas_robot_posi_timestamp = None
+  meas_robot_posi = None
+  # Meas attitude
+  # z_a = [m_atti_yaw]
+  flag_set_meas_robot_atti = None
+  meas_robot_atti_timestamp = None
+  meas_robot_atti_quat_simp = None
+  # Meas velocity
+  # z_v = [m_vel_lin_x_robot, m_vel_lin_y_robot, m_vel_lin_z_robot,
+  #       m_vel_ang_z_robot]
+  flag_set_meas_robot_vel_robot = None
+  meas_robot_velo_timestamp = None
+  meas_robot_velo_lin_robot = None
+  meas_robot_velo_ang_robot = None
+
+  #
+  lock_meas = None
+
+
+  # Estimated State (one row per robot)
+  # x = [ posi_x, posi_y, posi_z,
+  #       atti_yaw,
+  #       vel_lin_x_world, vel_lin_y_world, vel_lin_z_world,
+  #       vel_ang_z_world ]
+  estim_state_timestamp = None
+  # Estimated Pose
+  estim_robot_posi = None
+  estim_robot_atti_quat_simp = None
+  # Estimated Velocity
+  estim_robot_velo_lin_world = None
+  estim_robot_velo_ang_world = None
+  # Cov estimated state
+  estim_state_cov = None
+
+  #
+  lock_state = None
+
+
+  # Covariance of the process model
+  cov_proc_mod = None
+
+  # Covariance of the measurements
+  cov_meas_posi = None
+  cov_meas_atti = None
+  cov_meas_velo_lin = None
+  cov_meas_velo_ang = None
+
+
+
+  #########
+
+  def __init__(self, num_robots=1):
+
+    #
+    self.num_robots = int(num_robots)
+    num_robots = self.num_robots
+
+    # Meas Position
+    self.flag_set_meas_robot_posi = np.zeros((num_robots,), dtype=bool)
+    self.meas_robot_posi_timestamp = np.zeros((num_robots,), dtype=np.int64)
+    self.meas_robot_posi = np.zeros((num_robots, 3), dtype=float)
+    # Meas Attitude
+    self.flag_set_meas_robot_atti = np.zeros((num_robots,), dtype=bool)
+    self.meas_robot_atti_timestamp = np.zeros((num_robots,), dtype=np.int64)
+    self.meas_robot_atti_quat_simp = np.zeros((num_robots, 2), dtype=float)
+    self.meas_robot_atti_quat_simp[:, 0] = 1.0
+    # Meas Velocity
+    self.flag_set_meas_robot_vel_robot = np.zeros((num_robots,), dtype=bool)
+    self.meas_robot_velo_timestamp = np.zeros((num_robots,), dtype=np.int64)
+    self.meas_robot_velo_lin_robot = np.zeros((num_robots, 3), dtype=float)
+    self.meas_robot_velo_ang_robot = np.zeros((num_robots, 1), dtype=float)
+
+    #
+    self.lock_meas = threading.Lock()
+
+    # Estimated State
+    self.estim_state_timestamp = np.zeros((num_robots,), dtype=np.int64)
+    # Estimated Pose
+    self.estim_robot_posi = np.zeros((num_robots, 3), dtype=float)
+    self.estim_robot_atti_quat_simp = np.zeros((num_robots, 2), dtype=float)
+    self.estim_robot_atti_quat_simp[:, 0] = 1.0
+    # Estimated Velocity
+    self.estim_robot_velo_lin_world = np.zeros((num_robots, 3), dtype=float)
+    self.estim_robot_velo_ang_world = np.zeros((num_robots, 1), dtype=float)
+    # Cov estimated state
+    self.estim_state_cov = np.zeros((num_robots, 8, 8), dtype=float)
+
+    #
+    self.lock_state = threading.Lock()
+
+    # Covariance of the process model
+    self.cov_proc_mod = np.zeros((4,4), dtype=float)
+
+    # Covariance of the measurements
+    self.cov_meas_posi = np.zeros((3,3), dtype=float)
+    self.cov_meas_atti = np.zeros((1,1), dtype=float)
+    self.cov_meas_velo_lin = np.zeros((3,3), dtype=float)
+    self.cov_meas_velo_ang = np.zeros((1,1), dtype=float)
+
+    # End
+    return
+
+
+  def setConfigParameters(self, config_param):
+
+    # Same 'ekf' config as ArsMsfStateEstimator, applied to all the robots
+
+    # Estimated Pose
+    self.estim_robot_posi[:] = np.array(config_param['estimated_state_init']['state']['robot_position'], dtype=float)
+    self.estim_robot_atti_quat_simp[:] = np.array(config_param['estimated_state_init']['state']['robot_atti_quat_simp'], dtype=float)
+    # Estimated Velocity
+    self.estim_robot_velo_lin_world[:] = np.array(config_param['estimated_state_init']['state']['robot_vel_lin_world'], dtype=float)
+    self.estim_robot_velo_ang_world[:] = np.array(config_param['estimated_state_init']['state']['robot_vel_ang_world'], dtype=float)
+
+    # Cov estimated state
+    self.estim_state_cov[:] = np.diag(np.array(config_param['estimated_state_init']['cov_diag'], dtype=float))
+
+    # Covariance of the process model
+    self.cov_proc_mod = np.diag(config_param['process_model']['cov_diag'])
+
+    # Covariance of the measurements
+    self.cov_meas_posi = np.diag(config_param['measurements']['meas_position']['cov_diag'])
+    self.cov_meas_atti = np.diag(config_param['measurements']['meas_attitude']['cov_diag'])
+    self.cov_meas_velo_lin = np.diag(config_param['measurements']['meas_velo_lin']['cov_diag'])
+    self.cov_meas_velo_ang = np.diag(config_param['measurements']['meas_velo_ang']['cov_diag'])
+
+    return
+
+
+  def setMeasRobotPosition(self, idx_robot, timestamp, robot_posi):
+
+    self.lock_meas.acquire()
+
+    self.flag_set_meas_robot_posi[idx_robot] = True
+    self.meas_robot_posi_timestamp[idx_robot] = timestamp
+    self.meas_robot_posi[idx_robot] = robot_posi
+
+    self.lock_meas.release()
+
+    return
+
+
+  def setMeasRobotAttitude(self, idx_robot, timestamp, robot_atti_quat_simp):
+
+    self.lock_meas.acquire()
+
+    self.flag_set_meas_robot_atti[idx_robot] = True
+    self.meas_robot_atti_timestamp[idx_robot] = timestamp
+    self.meas_robot_atti_quat_simp[idx_robot] = robot_atti_quat_simp
+
+    self.lock_meas.release()
+
+    return
+
+
+  def setMeasRobotVelRobot(self, idx_robot, timestamp, lin_vel_robot, ang_vel_robot):
+
+    self.lock_meas.acquire()
+
+    self.flag_set_meas_robot_vel_robot[idx_robot] = True
+    self.meas_robot_velo_timestamp[idx_robot] = timestamp
+    self.meas_robot_velo_lin_robot[idx_robot] = lin_vel_robot
+    self.meas_robot_velo_ang_robot[idx_robot] = ang_vel_robot
+
+    self.lock_meas.release()
+
+    return
+
+
+  def predict(self, timestamp):
+
+    # Propagates all the robots to timestamp [ns]
+
+    #
+    self.lock_state.acquire()
+
+    # Delta time
+    # Zero for robots never propagated, and never negative
+    flag_init = (self.estim_state_timestamp == 0)
+    delta_time = (timestamp - self.estim_state_timestamp)/1e9
+    delta_time[flag_init] = 0.0
+    np.maximum(delta_time, 0.0, out=delta_time)
+    # Robots to propagate
+    flag_propagate = flag_init | (delta_time > 0.0)
+
+
+    # Process model
+
+    # Position
+    self.estim_robot_posi += delta_time[:, None] * self.estim_robot_velo_lin_world
+
+    # Attitude
+    delta_robot_atti_half_ang = 0.5 * delta_time * self.estim_robot_velo_ang_world[:, 0]
+    self.estim_robot_atti_quat_simp = self.quatSimpProd(self.estim_robot_atti_quat_simp, np.cos(delta_robot_atti_half_ang), np.sin(delta_robot_atti_half_ang))
+
+    # Velocity Linear
+    # Constant
+
+    # Velocity Angular
+    # Constant
+
+
+    # Covariance
+    # Fx * P * Fx^T, with Fx = I + dt * E (see
+    # ArsMsfStateEstimator.getCovProcModPending), by blocks
+    # Fx * P: rows 0:4 += dt * rows 4:8
+    self.estim_state_cov[:, 0:4, :] += delta_time[:, None, None] * self.estim_state_cov[:, 4:8, :]
+    # (Fx * P) * Fx^T: cols 0:4 += dt * cols 4:8
+    self.estim_state_cov[:, :, 0:4] += delta_time[:, None, None] * self.estim_state_cov[:, :, 4:8]
+    # + Fn * Q * Fn^T
+    self.estim_state_cov[flag_propagate, 4:8, 4:8] += self.cov_proc_mod
+
+
+    # Prepare for next iteration
+    self.estim_state_timestamp[flag_propagate] = timestamp
+
+    #
+    self.lock_state.release()
+
+    #
+    return
+
+
+  def update(self):
+
+    # Fuses the last sample of each measurement at the current state of
+    # each robot (the timestamps of the samples are not used)
+
+    # Lock
+    self.lock_meas.acquire()
+
+    # Measurements readings - To avoid races
+    # Mask of the measurements of each robot
+    meas_mask = self.meas_mask_robot_posi * self.flag_set_meas_robot_posi + self.meas_mask_robot_atti * self.flag_set_meas_robot_atti + self.meas_mask_robot_vel_robot * self.flag_set_meas_robot_vel_robot
+    #
+    meas_z_robot_posi = self.meas_robot_posi.copy()
+    meas_z_robot_atti_quat_simp = self.meas_robot_atti_quat_simp.copy()
+    meas_z_robot_velo_lin_robot = self.meas_robot_velo_lin_robot.copy()
+    meas_z_robot_velo_ang_robot = self.meas_robot_velo_ang_robot.copy()
+
+    # Put flags measurements down once used
+    self.flag_set_meas_robot_posi[:] = False
+    self.flag_set_meas_robot_atti[:] = False
+    self.flag_set_meas_robot_vel_robot[:] = False
+
+    # Release
+    self.lock_meas.release()
+
+
+    #
+    self.lock_state.acquire()
+
+    # One batched update for each combination of measurements
+    for meas_mask_comb in np.unique(meas_mask):
+      if(meas_mask_comb == 0):
+        continue
+      idx_robots = np.flatnonzero(meas_mask == meas_mask_comb)
+      self.updateRobots(idx_robots, int(meas_mask_comb), meas_z_robot_posi[idx_robots], meas_z_robot_atti_quat_simp[idx_robots], meas_z_robot_velo_lin_robot[idx_robots], meas_z_robot_velo_ang_robot[idx_robots])
+
+    #
+    self.lock_state.release()
+
+    #
+    return
+
+
+  def updateRobots(self, idx_robots, meas_mask, meas_z_robot_posi, meas_z_robot_atti_quat_simp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot):
+
+    # Requires lock_state
+    # Same combination of measurements for all the robots in idx_robots
+
+    #
+    num_robots = idx_robots.shape[0]
+
+    #
+    flag_set_meas_robot_posi = bool(meas_mask & self.meas_mask_robot_posi)
+    flag_set_meas_robot_atti = bool(meas_mask & self.meas_mask_robot_atti)
+    flag_set_meas_robot_vel_robot = bool(meas_mask & self.meas_mask_robot_vel_robot)
+
+    # Dimension of the measurement for update
+    dim_meas = 3*flag_set_meas_robot_posi + 1*flag_set_meas_robot_atti + 4*flag_set_meas_robot_vel_robot
+
+
+    # State readings
+    estim_x_k1k_robot_posi = self.estim_robot_posi[idx_robots]
+    estim_x_k1k_robot_atti_quat_simp = self.estim_robot_atti_quat_simp[idx_robots]
+    estim_x_k1k_robot_velo_lin_world = self.estim_robot_velo_lin_world[idx_robots]
+    estim_x_k1k_robot_velo_ang_world = self.estim_robot_velo_ang_world[idx_robots]
+    estim_P_k1k = self.estim_state_cov[idx_robots]
+
+    # robot atti - angle
+    estim_x_k1k_robot_atti_ang = 2.0 * np.arctan2(estim_x_k1k_robot_atti_quat_simp[:, 1], estim_x_k1k_robot_atti_quat_simp[:, 0])
+    cos_robot_atti_ang = np.cos(estim_x_k1k_robot_atti_ang)
+    sin_robot_atti_ang = np.sin(estim_x_k1k_robot_atti_ang)
+
+
+    # Innovation, covariance and Jacobian Hx of the measurement
+    innov_meas = np.zeros((num_robots, dim_meas), dtype=float)
+    cov_meas = np.zeros((dim_meas, dim_meas), dtype=float)
+    jac_Hx = np.zeros((num_robots, dim_meas, 8), dtype=float)
+    meas_idx = 0
+
+    if(flag_set_meas_robot_posi == True):
+      # Innovation of the measurement
+      innov_meas[:, meas_idx:meas_idx+3] = estim_x_k1k_robot_posi - meas_z_robot_posi
+      # Covariance of the measurement
+      cov_meas[meas_idx:meas_idx+3, meas_idx:meas_idx+3] = self.cov_meas_posi
+      # Meas robot posi - robot posi
+      jac_Hx[:, meas_idx:meas_idx+3, 0:3] = np.eye(3)
+      meas_idx += 3
+
+    if(flag_set_meas_robot_atti == True):
+      # Innovation of the measurement
+      innov_meas_robot_atti_quat_simp = self.quatSimpProd(estim_x_k1k_robot_atti_quat_simp, meas_z_robot_atti_quat_simp[:, 0], -meas_z_robot_atti_quat_simp[:, 1])
+      innov_meas[:, meas_idx] = self.angleFromQuatSimp(innov_meas_robot_atti_quat_simp)
+      # Covariance of the measurement
+      cov_meas[meas_idx:meas_idx+1, meas_idx:meas_idx+1] = self.cov_meas_atti
+      # Meas robot atti - robot atti
+      jac_Hx[:, meas_idx, 3] = 1.0
+      meas_idx += 1
+
+    if(flag_set_meas_robot_vel_robot == True):
+      # Predicted measurement: R^T * v
+      pred_z_robot_velo_lin_robot = np.empty((num_robots, 3), dtype=float)
+      pred_z_robot_velo_lin_robot[:, 0] = cos_robot_atti_ang * estim_x_k1k_robot_velo_lin_world[:, 0] + sin_robot_atti_ang * estim_x_k1k_robot_velo_lin_world[:, 1]
+      pred_z_robot_velo_lin_robot[:, 1] = - sin_robot_atti_ang * estim_x_k1k_robot_velo_lin_world[:, 0] + cos_robot_atti_ang * estim_x_k1k_robot_velo_lin_world[:, 1]
+      pred_z_robot_velo_lin_robot[:, 2] = estim_x_k1k_robot_velo_lin_world[:, 2]
+      # Innovation of the measurement
+      innov_meas[:, meas_idx:meas_idx+3] = pred_z_robot_velo_lin_robot - meas_z_robot_velo_lin_robot
+      innov_meas[:, meas_idx+3] = estim_x_k1k_robot_velo_ang_world[:, 0] - meas_z_robot_velo_ang_robot[:, 0]
+      # Covariance of the measurement
+      cov_meas[meas_idx:meas_idx+3, meas_idx:meas_idx+3] = self.cov_meas_velo_lin
+      cov_meas[meas_idx+3:meas_idx+4, meas_idx+3:meas_idx+4] = self.cov_meas_velo_ang
+      # Meas velo lin - robot atti: dR^T/dyaw * v
+      jac_Hx[:, meas_idx, 3] = pred_z_robot_velo_lin_robot[:, 1]
+      jac_Hx[:, meas_idx+1, 3] = - pred_z_robot_velo_lin_robot[:, 0]
+      # Meas velo lin - robot velo lin: R^T
+      jac_Hx[:, meas_idx, 4] = cos_robot_atti_ang
+      jac_Hx[:, meas_idx, 5] = sin_robot_atti_ang
+      jac_Hx[:, meas_idx+1, 4] = - sin_robot_atti_ang
+      jac_Hx[:, meas_idx+1, 5] = cos_robot_atti_ang
+      jac_Hx[:, meas_idx+2, 6] = 1.0
+      # Meas velo ang - robot velo ang
+      jac_Hx[:, meas_idx+3, 7] = 1.0
+      meas_idx += 4
+
+
+    # Hx * P
+    jac_Hx_cov = np.matmul(jac_Hx, estim_P_k1k)
+
+    # Covariance of the innovation of the measurement
+    cov_innov_meas = np.matmul(jac_Hx_cov, jac_Hx.transpose(0, 2, 1)) + cov_meas
+
+    # Kalman Gain: K^T = S^-1 * Hx * P
+    kalman_gain_t = np.linalg.solve(cov_innov_meas, jac_Hx_cov)
+
+    # Correction of the state
+    delta_x = np.matmul(innov_meas[:, None, :], kalman_gain_t)[:, 0, :]
+
+    # Updated covariance of state
+    estim_P_k1k1 = estim_P_k1k - np.matmul(kalman_gain_t.transpose(0, 2, 1), jac_Hx_cov)
+
+
+    # Updated state
+    self.estim_robot_posi[idx_robots] = estim_x_k1k_robot_posi - delta_x[:, 0:3]
+    delta_x_robot_atti_half_ang = 0.5 * delta_x[:, 3]
+    self.estim_robot_atti_quat_simp[idx_robots] = self.quatSimpProd(estim_x_k1k_robot_atti_quat_simp, np.cos(delta_x_robot_atti_half_ang), -np.sin(delta_x_robot_atti_half_ang))
+    self.estim_robot_velo_lin_world[idx_robots] = estim_x_k1k_robot_velo_lin_world - delta_x[:, 4:7]
+    self.estim_robot_velo_ang_world[idx_robots] = estim_x_k1k_robot_velo_ang_world - delta_x[:, 7:8]
+    #
+    self.estim_state_cov[idx_robots] = estim_P_k1k1
+
+    #
+    return
+
+
+  def quatSimpProd(self, quat_simp, quat_simp_w, quat_simp_z):
+
+    # Product of N simplified quaternions [w, z] by N simplified quaternions
+    # given by their components, with w >= 0
+
+    quat_simp_prod = np.empty((quat_simp.shape[0], 2), dtype=float)
+    quat_simp_prod[:, 0] = quat_simp[:, 0] * quat_simp_w - quat_simp[:, 1] * quat_simp_z
+    quat_simp_prod[:, 1] = quat_simp[:, 0] * quat_simp_z + quat_simp[:, 1] * quat_simp_w
+
+    quat_simp_prod[quat_simp_prod[:, 0] < 0.0] *= -1.0
+
+    return quat_simp_prod
+
+
+  def angleFromQuatSimp(self, quat_simp):
+
+    return 2.0 * np.arctan2(quat_simp[:, 1], quat_simp[:, 0])
+
+
+  def getRobotState(self, idx_robot):
+
+    # State of one robot, in the same form as ArsMsfStateEstimator
+
+    self.lock_state.acquire()
+
+    estim_state_timestamp = int(self.estim_state_timestamp[idx_robot])
+    estim_robot_posi = self.estim_robot_posi[idx_robot].copy()
+    estim_robot_atti_quat_simp = self.estim_robot_atti_quat_simp[idx_robot].copy()
+    estim_robot_velo_lin_world = self.estim_robot_velo_lin_world[idx_robot].copy()
+    estim_robot_velo_ang_world = self.estim_robot_velo_ang_world[idx_robot].copy()
+    estim_state_cov = self.estim_state_cov[idx_robot].copy()
+
+    self.lock_state.release()
+
+    return estim_state_timestamp, estim_robot_posi, estim_robot_atti_quat_simp, estim_robot_velo_lin_world, estim_robot_velo_ang_world, estim_state_cov
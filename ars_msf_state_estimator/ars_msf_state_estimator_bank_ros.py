@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from numpy import *
+
+import os
+
+# pyyaml - https://pyyaml.org/wiki/PyYAMLDocumentation
+import yaml
+from yaml.loader import SafeLoader
+
+
+# ROS
+import rclpy
+from rclpy.node import Node
+from rclpy.time import Time
+
+from ament_index_python.packages import get_package_share_directory
+
+import std_msgs.msg
+from std_msgs.msg import Header
+
+import geometry_msgs.msg
+from geometry_msgs.msg import PointStamped
+from geometry_msgs.msg import QuaternionStamped
+from geometry_msgs.msg import PoseStamped
+from geometry_msgs.msg import PoseWithCovarianceStamped
+from geometry_msgs.msg import TwistStamped
+
+
+import tf2_ros
+
+
+#
+from ars_msf_state_estimator.ars_msf_state_estimator_bank import *
+
+#
+import ars_lib_helpers.ars_lib_helpers as ars_lib_helpers
+
+
+
+
+class ArsMsfStateEstimatorBankRos(Node):
+
+  #######
+
+  # Robot namespaces
+  robot_namespaces = None
+
+  # Robot frame
+  robot_frame = None
+
+  # World frame
+  world_frame = None
+
+
+  # State Estim loop freq
+  state_estim_loop_freq = None
+  # Timer
+  state_estim_loop_timer = None
+
+
+  # Meas subscribers (one per robot)
+  meas_robot_posi_subs = None
+  meas_robot_atti_subs = None
+  meas_robot_vel_robot_subs = None
+
+
+  # Estim pubs (one per robot)
+  estim_robot_pose_pubs = None
+  estim_robot_pose_cov_pubs = None
+  estim_robot_vel_world_pubs = None
+
+
+  # tf2 broadcaster
+  tf2_broadcaster = None
+
+
+  #
+  config_param = None
+
+
+  # MSF state estimator bank
+  msf_state_estimator_bank = None
+
+
+
+  #########
+
+  def __init__(self, node_name='ars_msf_state_estimator_bank_node'):
+
+    # Init ROS
+    super().__init__(node_name)
+
+    #
+    self.robot_namespaces = []
+    # Robot frame
+    self.robot_frame = 'robot_estim_base_link'
+    # World frame
+    self.world_frame = 'world'
+
+    # State Estim loop freq
+    self.state_estim_loop_freq = 50.0
+
+    #
+    self.__init(node_name)
+
+    # MSF state estimator bank
+    self.msf_state_estimator_bank = ArsMsfStateEstimatorBank(len(self.robot_namespaces))
+    self.msf_state_estimator_bank.setConfigParameters(self.config_param['ekf'])
+
+    # end
+    return
+
+
+  def __init(self, node_name='ars_msf_state_estimator_bank_node'):
+
+    # Package path
+    try:
+      pkg_path = get_package_share_directory('ars_msf_state_estimator')
+      self.get_logger().info(f"The path to the package is: {pkg_path}")
+    except ModuleNotFoundError:
+      self.get_logger().info("Package not found")
+
+
+    #### READING PARAMETERS ###
+
+    # Config param
+    default_config_param_yaml_file_name = os.path.join(pkg_path,'config','config_msf_state_estimator_bank.yaml')
+    # Declare the parameter with a default value
+    self.declare_parameter('config_param_msf_state_estimator_bank_yaml_file', default_config_param_yaml_file_name)
+    # Get the parameter value
+    config_param_yaml_file_name_str = self.get_parameter('config_param_msf_state_estimator_bank_yaml_file').get_parameter_value().string_value
+    self.get_logger().info(config_param_yaml_file_name_str)
+    self.config_param_yaml_file_name = os.path.abspath(config_param_yaml_file_name_str)
+
+    ###
+
+    # Load config param
+    with open(self.config_param_yaml_file_name,'r') as file:
+        self.config_param = yaml.load(file, Loader=SafeLoader)['msf_state_estimator_bank']
+
+    if(self.config_param is None):
+      self.get_logger().info("Error loading config param msf state estimator bank")
+    else:
+      self.get_logger().info("Config param msf state estimator bank:")
+      self.get_logger().info(str(self.config_param))
+
+
+    # Parameters
+    #
+    self.robot_namespaces = self.config_param['robot_namespaces']
+    #
+    self.robot_frame = self.config_param['robot_frame']
+    self.world_frame = self.config_param['world_frame']
+    #
+    self.state_estim_loop_freq = self.config_param['state_estim_loop_freq']
+
+
+    # End
+    return
+
+
+  def open(self):
+
+    #
+    self.meas_robot_posi_subs = []
+    self.meas_robot_atti_subs = []
+    self.meas_robot_vel_robot_subs = []
+    #
+    self.estim_robot_pose_pubs = []
+    self.estim_robot_pose_cov_pubs = []
+    self.estim_robot_vel_world_pubs = []
+
+    for idx_robot, robot_namespace in enumerate(self.robot_namespaces):
+
+      # Subscribers
+      #
+      self.meas_robot_posi_subs.append(self.create_subscription(PointStamped, robot_namespace+'/meas_robot_position', lambda msg, idx_robot=idx_robot: self.measRobotPositionCallback(idx_robot, msg), qos_profile=10))
+      #
+      self.meas_robot_atti_subs.append(self.create_subscription(QuaternionStamped, robot_namespace+'/meas_robot_attitude', lambda msg, idx_robot=idx_robot: self.measRobotAttitudeCallback(idx_robot, msg), qos_profile=10))
+      #
+      self.meas_robot_vel_robot_subs.append(self.create_subscription(TwistStamped, robot_namespace+'/meas_robot_velocity_robot', lambda msg, idx_robot=idx_robot: self.measRobotVelRobotCallback(idx_robot, msg), qos_profile=10))
+
+      # Publishers
+      #
+      self.estim_robot_pose_pubs.append(self.create_publisher(PoseStamped, robot_namespace+'/estim_robot_pose', qos_profile=10))
+      #
+      self.estim_robot_pose_cov_pubs.append(self.create_publisher(PoseWithCovarianceStamped, robot_namespace+'/estim_robot_pose_cov', qos_profile=10))
+      #
+      self.estim_robot_vel_world_pubs.append(self.create_publisher(TwistStamped, robot_namespace+'/estim_robot_velocity_world', qos_profile=10))
+
+
+    # Tf2 broadcasters
+    self.tf2_broadcaster = tf2_ros.TransformBroadcaster(self)
+
+
+    # Timers
+    #
+    self.state_estim_loop_timer = self.create_timer(1.0/self.state_estim_loop_freq, self.stateEstimLoopTimerCallback)
+
+
+    # End
+    return
+
+
+  def run(self):
+
+    rclpy.spin(self)
+
+    return
+
+
+  def measRobotPositionCallback(self, idx_robot, robot_position_msg):
+
+    # Timestamp
+    timestamp = Time.from_msg(robot_position_msg.header.stamp).nanoseconds
+
+    # Position
+    robot_posi = np.zeros((3,), dtype=float)
+    robot_posi[0] = robot_position_msg.point.x
+    robot_posi[1] = robot_position_msg.point.y
+    robot_posi[2] = robot_position_msg.point.z
+
+    #
+    self.msf_state_estimator_bank.setMeasRobotPosition(idx_robot, timestamp, robot_posi)
+
+    #
+    return
+
+
+  def measRobotAttitudeCallback(self, idx_robot, robot_attitude_msg):
+
+    # Timestamp
+    timestamp = Time.from_msg(robot_attitude_msg.header.stamp).nanoseconds
+
+    # Attitude quat simp
+    robot_atti_quat = ars_lib_helpers.Quaternion.zerosQuat()
+    robot_atti_quat[0] = robot_attitude_msg.quaternion.w
+    robot_atti_quat[1] = robot_attitude_msg.quaternion.x
+    robot_atti_quat[2] = robot_attitude_msg.quaternion.y
+    robot_atti_quat[3] = robot_attitude_msg.quaternion.z
+
+    robot_atti_quat_simp = ars_lib_helpers.Quaternion.getSimplifiedQuatRobotAtti(robot_atti_quat)
+
+    #
+    self.msf_state_estimator_bank.setMeasRobotAttitude(idx_robot, timestamp, robot_atti_quat_simp)
+
+    #
+    return
+
+
+  def measRobotVelRobotCallback(self, idx_robot, robot_vel_msg):
+
+    # Timestamp
+    timestamp = Time.from_msg(robot_vel_msg.header.stamp).nanoseconds
+
+    # Linear
+    lin_vel_robot = np.zeros((3,), dtype=float)
+    lin_vel_robot[0] = robot_vel_msg.twist.linear.x
+    lin_vel_robot[1] = robot_vel_msg.twist.linear.y
+    lin_vel_robot[2] = robot_vel_msg.twist.linear.z
+
+    # Angular
+    ang_vel_robot = np.zeros((1,), dtype=float)
+    ang_vel_robot[0] = robot_vel_msg.twist.angular.z
+
+    #
+    self.msf_state_estimator_bank.setMeasRobotVelRobot(idx_robot, timestamp, lin_vel_robot, ang_vel_robot)
+
+    #
+    return
+
+
+  def estimRobotsPublish(self, time_stamp):
+
+    #
+    msf_state_estimator_bank = self.msf_state_estimator_bank
+
+    # Header stamp (same for all the robots)
+    header_stamp = time_stamp.to_msg()
+
+    # Tf2 of all the robots, sent at once
+    estim_robot_pose_tf2_msgs = []
+
+    for idx_robot, robot_namespace in enumerate(self.robot_namespaces):
+
+      #
+      estim_robot_posi = msf_state_estimator_bank.estim_robot_posi[idx_robot]
+      estim_robot_atti_quat_simp = msf_state_estimator_bank.estim_robot_atti_quat_simp[idx_robot]
+      estim_robot_velo_lin_world = msf_state_estimator_bank.estim_robot_velo_lin_world[idx_robot]
+      estim_robot_velo_ang_world = msf_state_estimator_bank.estim_robot_velo_ang_world[idx_robot]
+      estim_state_cov = msf_state_estimator_bank.estim_state_cov[idx_robot]
+
+      #
+      header_msg = Header()
+      header_msg.stamp = header_stamp
+      header_msg.frame_id = self.world_frame
+
+      # Pose
+      robot_pose_stamped_msg = PoseStamped()
+      robot_pose_stamped_msg.header = header_msg
+      robot_pose_stamped_msg.pose.position.x = estim_robot_posi[0]
+      robot_pose_stamped_msg.pose.position.y = estim_robot_posi[1]
+      robot_pose_stamped_msg.pose.position.z = estim_robot_posi[2]
+      robot_pose_stamped_msg.pose.orientation.w = estim_robot_atti_quat_simp[0]
+      robot_pose_stamped_msg.pose.orientation.x = 0.0
+      robot_pose_stamped_msg.pose.orientation.y = 0.0
+      robot_pose_stamped_msg.pose.orientation.z = estim_robot_atti_quat_simp[1]
+
+      # Pose with covariance
+      covariance_pose = np.zeros((6,6), dtype=float)
+      covariance_pose[0:3, 0:3] = estim_state_cov[0:3, 0:3]
+      covariance_pose[0:3, 5] = estim_state_cov[0:3, 3]
+      covariance_pose[5, 5] = estim_state_cov[3, 3]
+      covariance_pose[5, 0:3] = estim_state_cov[3, 0:3]
+      #
+      robot_pose_cov_stamped_msg = PoseWithCovarianceStamped()
+      robot_pose_cov_stamped_msg.header = header_msg
+      robot_pose_cov_stamped_msg.pose.pose = robot_pose_stamped_msg.pose
+      robot_pose_cov_stamped_msg.pose.covariance = covariance_pose.reshape((36,))
+
+      # Velocity wrt world
+      robot_velocity_world_stamp_msg = TwistStamped()
+      robot_velocity_world_stamp_msg.header = header_msg
+      robot_velocity_world_stamp_msg.twist.linear.x = estim_robot_velo_lin_world[0]
+      robot_velocity_world_stamp_msg.twist.linear.y = estim_robot_velo_lin_world[1]
+      robot_velocity_world_stamp_msg.twist.linear.z = estim_robot_velo_lin_world[2]
+      robot_velocity_world_stamp_msg.twist.angular.x = 0.0
+      robot_velocity_world_stamp_msg.twist.angular.y = 0.0
+      robot_velocity_world_stamp_msg.twist.angular.z = estim_robot_velo_ang_world[0]
+
+      # Publish
+      self.estim_robot_pose_pubs[idx_robot].publish(robot_pose_stamped_msg)
+      self.estim_robot_pose_cov_pubs[idx_robot].publish(robot_pose_cov_stamped_msg)
+      self.estim_robot_vel_world_pubs[idx_robot].publish(robot_velocity_world_stamp_msg)
+
+      # Tf2
+      estim_robot_pose_tf2_msg = geometry_msgs.msg.TransformStamped()
+      estim_robot_pose_tf2_msg.header = header_msg
+      estim_robot_pose_tf2_msg.child_frame_id = robot_namespace.strip('/')+'/'+self.robot_frame
+      estim_robot_pose_tf2_msg.transform.translation.x = estim_robot_posi[0]
+      estim_robot_pose_tf2_msg.transform.translation.y = estim_robot_posi[1]
+      estim_robot_pose_tf2_msg.transform.translation.z = estim_robot_posi[2]
+      estim_robot_pose_tf2_msg.transform.rotation = robot_pose_stamped_msg.pose.orientation
+      estim_robot_pose_tf2_msgs.append(estim_robot_pose_tf2_msg)
+
+    # Broadcast
+    self.tf2_broadcaster.sendTransform(estim_robot_pose_tf2_msgs)
+
+    # End
+    return
+
+
+  def stateEstimLoopTimerCallback(self):
+
+    # Get time
+    time_stamp_current = self.get_clock().now()
+
+    # Predict all the robots
+    self.msf_state_estimator_bank.predict(time_stamp_current.nanoseconds)
+
+    # Update the robots with fresh measurements
+    self.msf_state_estimator_bank.update()
+
+    # Publish
+    self.estimRobotsPublish(time_stamp_current)
+
+    # End
+    return
+
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import rclpy
+
+from ars_msf_state_estimator.ars_msf_state_estimator_bank_ros import ArsMsfStateEstimatorBankRos
+
+
+def main(args=None):
+
+  rclpy.init(args=args)
+
+  ars_msf_state_estimator_bank_ros = ArsMsfStateEstimatorBankRos()
+
+  ars_msf_state_estimator_bank_ros.open()
+
+  try:
+      ars_msf_state_estimator_bank_ros.run()
+  except (KeyboardInterrupt, rclpy.executors.ExternalShutdownException):
+      # Graceful shutdown on interruption
+      pass
+  finally:
+    ars_msf_state_estimator_bank_ros.destroy_node()
+    rclpy.try_shutdown()
+
+  return 0
+
+
+''' MAIN '''
+if __name__ == '__main__':
+
+  main()
\ No newline at end of file
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+
+
+class ArsMsfStateEstimatorGating:
+
+  #######
+
+  # Chi-square gating of the measurements.
+  # Each block of the stacked measurement (one per measurement) is
+  # rejected if its squared Mahalanobis distance exceeds the chi-square
+  # quantile of its dimension at the confidence level of the measurement.
+  # The distance of a block is the one of its innovation wrt the state
+  # corrected by the blocks before it that were accepted: with the
+  # innovation normalised by the Cholesky factor of its covariance
+  # (u = L^-1 * innov), the sum of u^2 over the rows of the block.
+  # The thresholds are taken from a table: no quantile is computed
+
+  # Quantiles of the chi-square distribution
+  # Key: confidence level. Index: dimension - 1
+  chi2_table = {
+    0.9: [2.705543, 4.605170, 6.251389, 7.779440, 9.236357, 10.644641],
+    0.95: [3.841459, 5.991465, 7.814728, 9.487729, 11.070498, 12.591587],
+    0.99: [6.634897, 9.210340, 11.344867, 13.276704, 15.086272, 16.811894],
+    0.999: [10.827566, 13.815511, 16.266236, 18.466827, 20.515006, 22.457744],
+  }
+
+  # Enabled
+  flag_enabled = None
+
+  # Confidence level of each measurement
+  # Key: mask of the measurement
+  confidence = None
+  # Confidence level of the measurements not in the config
+  confidence_default = 0.99
+
+  # Thresholds of the blocks of each combination of measurements, computed
+  # at the first update with the combination (cache)
+  # Key: mask of the combination of measurements
+  thresholds = None
+
+  # Mask of the measurements whose rejections are counted (-1: all).
+  # Measurements replayed from the history are not counted twice
+  meas_mask_count = None
+  # Number of rejected measurements
+  # Key: mask of the measurement
+  num_rejected = None
+  # Mask of the measurements rejected by the current update
+  meas_mask_rejected = None
+
+
+
+  #########
+
+  def __init__(self):
+
+    self.flag_enabled = False
+
+    self.confidence = dict()
+    self.thresholds = dict()
+
+    self.meas_mask_count = -1
+    self.num_rejected = dict()
+    self.meas_mask_rejected = 0
+
+    # End
+    return
+
+
+  def setConfigParameters(self, config_param, meas_masks):
+
+    # meas_masks: mask of each measurement
+    # Key: name of the measurement in the config
+    # Optional entries: disabled, default confidence level
+
+    self.flag_enabled = config_param.get('flag_enabled', False)
+
+    self.confidence = dict()
+    self.num_rejected = dict()
+    for meas_name, meas_mask in meas_masks.items():
+      self.setConfidence(meas_mask, config_param.get('confidence', {}).get(meas_name, self.confidence_default))
+
+    return
+
+
+  def setConfidence(self, meas_mask, confidence):
+
+    # Confidence level of the measurement meas_mask
+
+    if(confidence not in self.chi2_table):
+      raise ValueError("Confidence level not in the chi-square table: "+str(confidence))
+
+    self.confidence[meas_mask] = confidence
+    self.num_rejected[meas_mask] = 0
+
+    self.resetThresholds()
+
+    return
+
+
+  def getThreshold(self, dim_meas, confidence):
+
+    if(dim_meas > len(self.chi2_table[confidence])):
+      raise ValueError("Dimension of the measurement not in the chi-square table: "+str(dim_meas))
+
+    return self.chi2_table[confidence][dim_meas-1]
+
+
+  def resetThresholds(self):
+
+    # Clears the cache, e.g. when the models change
+
+    self.thresholds = dict()
+
+    return
+
+
+  def getThresholds(self, workspace_update):
+
+    # Thresholds of the blocks of the combination of measurements
+    # Requires setConfigParameters() first
+
+    thresholds = self.thresholds.get(workspace_update.meas_mask)
+    if(thresholds is None):
+      thresholds = np.array([self.getThreshold(meas_block[1]-meas_block[0], self.confidence[meas_block_mask]) for meas_block, meas_block_mask in zip(workspace_update.meas_blocks, workspace_update.meas_blocks_mask)])
+      self.thresholds[workspace_update.meas_mask] = thresholds
+
+    return thresholds
+
+
+  def getRejectedBlocks(self, workspace_update, innov_meas_norm):
+
+    # Blocks whose distance exceeds their threshold (boolean per block)
+    # innov_meas_norm: normalised innovation u
+
+    dist_meas = np.add.reduceat(innov_meas_norm*innov_meas_norm, workspace_update.meas_blocks_start)
+
+    return dist_meas > self.getThresholds(workspace_update)
+
+
+  def addRejected(self, meas_mask):
+
+    self.meas_mask_rejected |= meas_mask
+
+    if(meas_mask & self.meas_mask_count):
+      self.num_rejected[meas_mask] += 1
+
+    return
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+
+
+class ArsMsfStateEstimatorHistory:
+
+  #######
+
+  # Bounded ring buffer of past filter steps, ordered by timestamp.
+  # Each entry holds:
+  # - The timestamp of the step [ns]
+  # - The measurements fused at that step (mask + values)
+  # - The posterior state and covariance after the step
+  # All the arrays are preallocated with a fixed capacity.
+
+  # Status of the state of the entries
+  # - none: not propagated yet (step of the lazy prediction)
+  # - interp: interpolated between its neighbours (step of the lazy
+  #   prediction, merged into the propagation of a later entry). Used by
+  #   the queries, but not a posterior to roll back to
+  # - posterior: posterior after the step
+  state_status_none = 0
+  state_status_interp = 1
+  state_status_posterior = 2
+
+  # Capacity (max number of entries)
+  size = None
+
+  # Physical index of the oldest entry
+  idx_start = None
+  # Number of entries stored
+  num_entries = None
+
+  # Timestamps [ns]
+  timestamp = None
+
+  # Posterior state
+  # [ posi_x, posi_y, posi_z,
+  #   atti_quat_simp_w, atti_quat_simp_z,
+  #   vel_lin_x_world, vel_lin_y_world, vel_lin_z_world,
+  #   vel_ang_z_world ]
+  state = None
+  # Posterior covariance
+  state_cov = None
+  # Status of the state
+  state_status = None
+
+  # Measurements
+  # Mask of the measurements of each entry
+  meas_mask = None
+  # Fields of the samples of each measurement (size, dim)
+  # Key: mask of the measurement
+  meas = None
+
+
+
+  #########
+
+  def __init__(self, size=200, meas_fields_dims=None):
+
+    # meas_fields_dims: dimensions of the fields of the samples of each
+    # measurement. Key: mask of the measurement
+
+    #
+    self.size = int(size)
+
+    #
+    self.timestamp = np.zeros((self.size,), dtype=np.int64)
+    #
+    self.state = np.zeros((self.size, 9), dtype=float)
+    self.state_cov = np.zeros((self.size, 8, 8), dtype=float)
+    self.state_status = np.zeros((self.size,), dtype=np.int8)
+    #
+    self.meas_mask = np.zeros((self.size,), dtype=int)
+    self.meas = dict()
+    if(meas_fields_dims is not None):
+      for meas_mask, meas_dims in meas_fields_dims.items():
+        self.meas[meas_mask] = [np.zeros((self.size, meas_dim), dtype=float) for meas_dim in meas_dims]
+
+    #
+    self.reset()
+
+    # End
+    return
+
+
+  def reset(self):
+
+    self.idx_start = 0
+    self.num_entries = 0
+
+    return
+
+
+  def getNumEntries(self):
+
+    return self.num_entries
+
+
+  def isEmpty(self):
+
+    return self.num_entries == 0
+
+
+  def isFull(self):
+
+    return self.num_entries == self.size
+
+
+  def getPhysIdx(self, idx):
+
+    return (self.idx_start + idx) % self.size
+
+
+  def getTimestamp(self, idx):
+
+    return int(self.timestamp[self.getPhysIdx(idx)])
+
+
+  def getTimestampLast(self):
+
+    return self.getTimestamp(self.num_entries-1)
+
+
+  def searchTimestamp(self, timestamp):
+
+    # Number of entries with a timestamp <= timestamp.
+    # Binary search over the (at most) two contiguous segments of the ring
+    # Works both with a scalar and with a vector of timestamps
+
+    # Segment 1: from the oldest entry to the end of the arrays
+    num_entries_seg_1 = min(self.num_entries, self.size - self.idx_start)
+    idx_seg_1 = np.searchsorted(self.timestamp[self.idx_start:self.idx_start+num_entries_seg_1], timestamp, side='right')
+
+    # Segment 2: wrapped around to the beginning of the arrays
+    num_entries_seg_2 = self.num_entries - num_entries_seg_1
+    if(num_entries_seg_2 == 0):
+      return idx_seg_1
+    idx_seg_2 = np.searchsorted(self.timestamp[0:num_entries_seg_2], timestamp, side='right')
+
+    return np.where(idx_seg_1 < num_entries_seg_1, idx_seg_1, num_entries_seg_1 + idx_seg_2)
+
+
+  def removeOldestEntry(self):
+
+    if(self.num_entries == 0):
+      return
+
+    self.idx_start = (self.idx_start + 1) % self.size
+    self.num_entries -= 1
+
+    return
+
+
+  def appendEntry(self, timestamp):
+
+    # Fixed memory: the oldest entry is overwritten when full
+    if(self.isFull()):
+      self.removeOldestEntry()
+
+    idx = self.num_entries
+    self.num_entries += 1
+
+    phys_idx = self.getPhysIdx(idx)
+    self.timestamp[phys_idx] = timestamp
+    self.state_status[phys_idx] = self.state_status_none
+    self.meas_mask[phys_idx] = 0
+
+    return idx
+
+
+  def insertEntry(self, idx, timestamp):
+
+    # Inserts an entry at logical index idx, shifting the newer entries.
+    # Cost O(num_entries - idx). The caller must make room if full
+    if(self.isFull()):
+      return -1
+
+    if(idx < self.num_entries):
+      phys_idx_src = self.getPhysIdx(np.arange(idx, self.num_entries))
+      phys_idx_dst = self.getPhysIdx(np.arange(idx+1, self.num_entries+1))
+      #
+      self.timestamp[phys_idx_dst] = self.timestamp[phys_idx_src]
+      self.state[phys_idx_dst] = self.state[phys_idx_src]
+      self.state_cov[phys_idx_dst] = self.state_cov[phys_idx_src]
+      self.state_status[phys_idx_dst] = self.state_status[phys_idx_src]
+      self.meas_mask[phys_idx_dst] = self.meas_mask[phys_idx_src]
+      for meas_fields in self.meas.values():
+        for meas_field in meas_fields:
+          meas_field[phys_idx_dst] = meas_field[phys_idx_src]
+
+    self.num_entries += 1
+
+    phys_idx = self.getPhysIdx(idx)
+    self.timestamp[phys_idx] = timestamp
+    self.state_status[phys_idx] = self.state_status_none
+    self.meas_mask[phys_idx] = 0
+
+    return idx
+
+
+  def setEntryState(self, idx, robot_posi, robot_atti_quat_simp, robot_velo_lin_world, robot_velo_ang_world, state_cov):
+
+    phys_idx = self.getPhysIdx(idx)
+
+    self.state[phys_idx, 0:3] = robot_posi
+    self.state[phys_idx, 3:5] = robot_atti_quat_simp
+    self.state[phys_idx, 5:8] = robot_velo_lin_world
+    self.state[phys_idx, 8] = robot_velo_ang_world[0]
+    self.state_cov[phys_idx] = state_cov
+    self.state_status[phys_idx] = self.state_status_posterior
+
+    # Entries just before, not propagated: interpolated
+    idx_lo = idx-1
+    while(idx_lo >= 0 and self.state_status[self.getPhysIdx(idx_lo)] == self.state_status_none):
+      idx_lo -= 1
+    if(idx_lo < idx-1):
+      idx_interp = np.arange(idx_lo+1, idx)
+      phys_idx_interp = self.getPhysIdx(idx_interp)
+      # No older entry with a state: the one of the entry
+      if(idx_lo < 0):
+        idx_lo = idx
+      self.state[phys_idx_interp], self.state_cov[phys_idx_interp] = self.interpolateStateEntries(self.timestamp[phys_idx_interp], np.full(idx_interp.shape, idx_lo), np.full(idx_interp.shape, idx))
+      self.state_status[phys_idx_interp] = self.state_status_interp
+
+    return
+
+
+  def getEntryStateStatus(self, idx):
+
+    return int(self.state_status[self.getPhysIdx(idx)])
+
+
+  def getIdxEntryPosterior(self, idx):
+
+    # Logical index of the newest entry with a posterior state, at or before
+    # idx. -1 if none
+
+    while(idx >= 0 and self.state_status[self.getPhysIdx(idx)] != self.state_status_posterior):
+      idx -= 1
+
+    return idx
+
+
+  def getEntryState(self, idx):
+
+    phys_idx = self.getPhysIdx(idx)
+
+    robot_posi = self.state[phys_idx, 0:3].copy()
+    robot_atti_quat_simp = self.state[phys_idx, 3:5].copy()
+    robot_velo_lin_world = self.state[phys_idx, 5:8].copy()
+    robot_velo_ang_world = self.state[phys_idx, 8:9].copy()
+    state_cov = self.state_cov[phys_idx].copy()
+
+    return robot_posi, robot_atti_quat_simp, robot_velo_lin_world, robot_velo_ang_world, state_cov
+
+
+  def interpolateState(self, timestamp):
+
+    # State and covariance at each timestamp [ns] (vector), interpolated
+    # between the entries before and after it. Requires the timestamps
+    # within [oldest entry, newest entry].
+    # Position, velocities and covariance: linear. Attitude: along the
+    # shortest rotation between both entries
+
+    # Bracketing entries (logical indices)
+    idx_hi = np.minimum(self.searchTimestamp(timestamp), self.num_entries-1)
+    idx_lo = np.maximum(idx_hi-1, 0)
+
+    return self.interpolateStateEntries(timestamp, idx_lo, idx_hi)
+
+
+  def interpolateStateEntries(self, timestamp, idx_lo, idx_hi):
+
+    # State and covariance at each timestamp [ns] (vector), interpolated
+    # between the entries idx_lo and idx_hi (logical indices, vectors)
+
+    phys_idx_lo = self.getPhysIdx(idx_lo)
+    phys_idx_hi = self.getPhysIdx(idx_hi)
+
+    timestamp_lo = self.timestamp[phys_idx_lo]
+    delta_timestamp = self.timestamp[phys_idx_hi] - timestamp_lo
+    alpha = np.divide(timestamp - timestamp_lo, delta_timestamp, out=np.zeros(idx_hi.shape, dtype=float), where=delta_timestamp > 0)
+    alpha = np.clip(alpha, 0.0, 1.0)
+
+    state_lo = self.state[phys_idx_lo]
+    state_hi = self.state[phys_idx_hi]
+
+    state = state_lo + alpha[:, None]*(state_hi - state_lo)
+    state_cov = self.state_cov[phys_idx_lo] + alpha[:, None, None]*(self.state_cov[phys_idx_hi] - self.state_cov[phys_idx_lo])
+
+    # Attitude: q = q_lo * q(alpha * angle(q_hi * conj(q_lo)))
+    quat_simp_lo_w = state_lo[:, 3]
+    quat_simp_lo_z = state_lo[:, 4]
+    delta_quat_simp_w = state_hi[:, 3]*quat_simp_lo_w + state_hi[:, 4]*quat_simp_lo_z
+    delta_quat_simp_z = state_hi[:, 4]*quat_simp_lo_w - state_hi[:, 3]*quat_simp_lo_z
+    # Half angle, of the shortest rotation (w >= 0): in [-pi/2, pi/2]
+    delta_atti_ang_half = np.arctan2(delta_quat_simp_z, delta_quat_simp_w)
+    delta_atti_ang_half -= np.pi*np.round(delta_atti_ang_half/np.pi)
+    delta_atti_ang_half *= alpha
+    cos_delta = np.cos(delta_atti_ang_half)
+    sin_delta = np.sin(delta_atti_ang_half)
+    state[:, 3] = quat_simp_lo_w*cos_delta - quat_simp_lo_z*sin_delta
+    state[:, 4] = quat_simp_lo_w*sin_delta + quat_simp_lo_z*cos_delta
+
+    return state, state_cov
+
+
+  def getEntryMeasMask(self, idx):
+
+    return int(self.meas_mask[self.getPhysIdx(idx)])
+
+
+  def setEntryMeas(self, idx, meas_mask, meas_z):
+
+    # meas_z: fields of the sample of each measurement of the mask
+    # Key: mask of the measurement
+
+    phys_idx = self.getPhysIdx(idx)
+
+    self.meas_mask[phys_idx] |= meas_mask
+    for meas_mask_i, meas_fields in self.meas.items():
+      if(meas_mask & meas_mask_i):
+        for meas_field, meas_field_value in zip(meas_fields, meas_z[meas_mask_i]):
+          meas_field[phys_idx] = meas_field_value
+
+    return
+
+
+  def getEntryMeas(self, idx):
+
+    # Fields of the sample of each measurement of the entry (views)
+    # Key: mask of the measurement
+
+    phys_idx = self.getPhysIdx(idx)
+    meas_mask = int(self.meas_mask[phys_idx])
+
+    return {meas_mask_i: [meas_field[phys_idx] for meas_field in meas_fields] for meas_mask_i, meas_fields in self.meas.items() if meas_mask & meas_mask_i}
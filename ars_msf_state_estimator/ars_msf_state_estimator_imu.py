@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+
+
+class ArsMsfStateEstimatorImuPreint:
+
+  #######
+
+  # Preintegration of the IMU samples over an interval, in the frame of
+  # the robot at the start of the interval (yaw only: the robot is assumed
+  # level, the accelerometer measures the specific force f = a - g).
+  # Errors ordered as the state: [posi(3), atti_yaw, vel_lin(3)]
+
+  # Duration of the interval [s]
+  delta_time = None
+  # Increment of the attitude angle [rad]
+  delta_atti_ang = None
+  # Increments of the velocity and of the position due to the specific
+  # force, in the frame at the start
+  delta_velo_lin = None
+  delta_posi = None
+  # Angular velocity of the last sample
+  ang_vel_last = None
+  # Covariance of the errors of the increments (None: not computed)
+  cov = None
+
+
+
+  #########
+
+  def __init__(self, delta_time, delta_atti_ang, delta_velo_lin, delta_posi, ang_vel_last, cov=None):
+
+    self.delta_time = delta_time
+    self.delta_atti_ang = delta_atti_ang
+    self.delta_velo_lin = delta_velo_lin
+    self.delta_posi = delta_posi
+    self.ang_vel_last = ang_vel_last
+    self.cov = cov
+
+    # End
+    return
+
+
+
+
+class ArsMsfStateEstimatorImu:
+
+  #######
+
+  # IMU input of the prediction.
+  # The samples are kept in a ring buffer, mirrored (each sample written
+  # twice, N apart): any window of the last N samples is a contiguous
+  # slice. A sample holds from its timestamp to the next one (zero-order
+  # hold); the last one holds until a new sample arrives.
+  # The samples over a prediction interval are preintegrated at once,
+  # vectorised over the samples, and the covariance of the state is
+  # propagated once per interval.
+  # No bias is estimated
+
+  # Enabled
+  flag_enabled = None
+
+  # Capacity (number of samples). Must cover the history
+  buffer_size = None
+
+  # Noise densities
+  # Linear acceleration [(m/s^2)^2/Hz]
+  cov_lin_acc = None
+  # Angular velocity [(rad/s)^2/Hz]
+  cov_ang_vel = None
+
+  # Gravity [m/s^2]
+  gravity = None
+
+  # Mirrored buffer (2*buffer_size)
+  # Timestamps [ns]
+  timestamp = None
+  # Linear acceleration (specific force) in robot frame
+  lin_acc = None
+  # Angular velocity z
+  ang_vel = None
+  # Physical index of the next sample
+  idx_next = None
+  # Number of samples stored
+  num_samples = None
+
+  # Number of samples dropped (not newer than the last one)
+  num_dropped = None
+
+
+
+  #########
+
+  def __init__(self, buffer_size=1000):
+
+    self.flag_enabled = False
+
+    self.cov_lin_acc = np.zeros((3,), dtype=float)
+    self.cov_ang_vel = 0.0
+
+    self.gravity = 9.81
+
+    self.setBufferSize(buffer_size)
+
+    # End
+    return
+
+
+  def setConfigParameters(self, config_param):
+
+    # Optional entries: as constructed (disabled)
+
+    self.flag_enabled = config_param.get('flag_enabled', False)
+
+    self.cov_lin_acc = np.array(config_param.get('cov_diag_lin_acc', [0.0, 0.0, 0.0]), dtype=float)
+    self.cov_ang_vel = float(config_param.get('cov_diag_ang_vel', [0.0])[0])
+
+    self.gravity = float(config_param.get('gravity', 9.81))
+
+    self.setBufferSize(config_param.get('buffer_size', 1000))
+
+    return
+
+
+  def setBufferSize(self, buffer_size):
+
+    self.buffer_size = int(buffer_size)
+    if(self.buffer_size < 1):
+      raise ValueError("Size of the IMU buffer must be >= 1")
+
+    self.timestamp = np.zeros((2*self.buffer_size,), dtype=np.int64)
+    self.lin_acc = np.zeros((2*self.buffer_size, 3), dtype=float)
+    self.ang_vel = np.zeros((2*self.buffer_size,), dtype=float)
+
+    self.idx_next = 0
+    self.num_samples = 0
+
+    self.num_dropped = 0
+
+    return
+
+
+  def push(self, timestamp, lin_acc, ang_vel):
+
+    # Returns False if the sample was dropped (not newer than the last one)
+
+    if(self.num_samples and timestamp <= self.getTimestampLast()):
+      self.num_dropped += 1
+      return False
+
+    idx = self.idx_next
+    for idx_mirror in (idx, idx+self.buffer_size):
+      self.timestamp[idx_mirror] = timestamp
+      self.lin_acc[idx_mirror] = lin_acc
+      self.ang_vel[idx_mirror] = ang_vel
+
+    self.idx_next = (idx+1) % self.buffer_size
+    if(self.num_samples < self.buffer_size):
+      self.num_samples += 1
+
+    return True
+
+
+  def getTimestampLast(self):
+
+    # Requires at least one sample
+
+    return int(self.timestamp[self.idx_next-1+self.buffer_size])
+
+
+  def getAngVelLast(self):
+
+    # Requires at least one sample
+
+    return float(self.ang_vel[self.idx_next-1+self.buffer_size])
+
+
+  def getSamples(self, timestamp_start, timestamp_end):
+
+    # Samples holding over [timestamp_start, timestamp_end) [ns], copied:
+    # (time step of each sample [s], linear acceleration, angular velocity).
+    # The first sample also holds before its timestamp.
+    # None if no sample is older than timestamp_end
+
+    idx_end = self.idx_next + self.buffer_size
+    timestamp = self.timestamp[idx_end-self.num_samples:idx_end]
+
+    idx_sample_end = int(np.searchsorted(timestamp, timestamp_end, side='left'))
+    if(idx_sample_end == 0):
+      return None
+    idx_sample_start = max(int(np.searchsorted(timestamp, timestamp_start, side='right'))-1, 0)
+
+    # Time steps
+    timestamp_steps = np.empty((idx_sample_end-idx_sample_start+1,), dtype=np.int64)
+    timestamp_steps[0] = timestamp_start
+    timestamp_steps[1:-1] = timestamp[idx_sample_start+1:idx_sample_end]
+    timestamp_steps[-1] = timestamp_end
+    delta_time = np.diff(timestamp_steps)*1e-9
+
+    idx_start = idx_end-self.num_samples
+    lin_acc = self.lin_acc[idx_start+idx_sample_start:idx_start+idx_sample_end].copy()
+    ang_vel = self.ang_vel[idx_start+idx_sample_start:idx_start+idx_sample_end].copy()
+
+    return delta_time, lin_acc, ang_vel
+
+
+  def preintegrate(self, delta_time, lin_acc, ang_vel, flag_cov=True):
+
+    # Vectorised over the samples k (discrete, rotation at mid-step):
+    #   th_k = sum_{m<k} w_m * dt_m + 0.5 * w_k * dt_k
+    #   a_k = R(th_k) * f_k
+    #   dv = sum_k a_k * dt_k
+    #   dp = sum_k dv_{<k} * dt_k + 0.5 * a_k * dt_k^2
+    # Covariance: first order, wrt the noise of each sample, with density
+    # sigma^2 (variance sigma^2 / dt_k of a sample):
+    # - gyro noise n_k rotates the accelerations of the samples after k:
+    #   d dth = dt_k * n_k
+    #   d dv = J * (dv - dv_{<=k}) * dt_k * n_k
+    #   d dp = J * ((dp - dp_{<=k}) - dv_{<=k} * (T - t_{<=k})) * dt_k * n_k
+    #   with J = dR/dth * R^T
+    # - accelerometer noise e_k:
+    #   d dv = R(th_k) * dt_k * e_k
+    #   d dp = R(th_k) * (0.5 * dt_k^2 + dt_k * (T - t_{<=k})) * e_k
+
+    num_samples = delta_time.shape[0]
+
+    # Attitude
+    delta_atti_ang_step = ang_vel*delta_time
+    atti_ang_incl = np.cumsum(delta_atti_ang_step)
+    atti_ang_mid = atti_ang_incl - 0.5*delta_atti_ang_step
+    cos_atti_ang = np.cos(atti_ang_mid)
+    sin_atti_ang = np.sin(atti_ang_mid)
+
+    # Acceleration in the frame at the start
+    acc = np.empty((num_samples, 3), dtype=float)
+    acc[:, 0] = cos_atti_ang*lin_acc[:, 0] - sin_atti_ang*lin_acc[:, 1]
+    acc[:, 1] = sin_atti_ang*lin_acc[:, 0] + cos_atti_ang*lin_acc[:, 1]
+    acc[:, 2] = lin_acc[:, 2]
+
+    # Velocity and position
+    delta_velo_lin_step = acc*delta_time[:, None]
+    delta_velo_lin_incl = np.cumsum(delta_velo_lin_step, axis=0)
+    delta_posi_step = (delta_velo_lin_incl - 0.5*delta_velo_lin_step)*delta_time[:, None]
+    delta_posi_incl = np.cumsum(delta_posi_step, axis=0)
+
+    preint = ArsMsfStateEstimatorImuPreint(float(delta_time.sum()), float(atti_ang_incl[-1]), delta_velo_lin_incl[-1].copy(), delta_posi_incl[-1].copy(), float(ang_vel[-1]))
+
+    if(not flag_cov):
+      return preint
+
+    # Remaining time after each sample
+    delta_time_rem = preint.delta_time - np.cumsum(delta_time)
+
+    # Sensitivity of the errors [posi(3), atti_yaw, vel_lin(3)] to the
+    # noise [gyro, acc_x, acc_y, acc_z] of each sample
+    jac_noise = np.zeros((num_samples, 7, 4), dtype=float)
+    # Gyro
+    delta_velo_lin_rem = preint.delta_velo_lin - delta_velo_lin_incl
+    delta_posi_rem = (preint.delta_posi - delta_posi_incl) - delta_velo_lin_incl*delta_time_rem[:, None]
+    # J * v = [-v_y, v_x, 0]
+    jac_noise[:, 0, 0] = -delta_posi_rem[:, 1]*delta_time
+    jac_noise[:, 1, 0] = delta_posi_rem[:, 0]*delta_time
+    jac_noise[:, 3, 0] = delta_time
+    jac_noise[:, 4, 0] = -delta_velo_lin_rem[:, 1]*delta_time
+    jac_noise[:, 5, 0] = delta_velo_lin_rem[:, 0]*delta_time
+    # Accelerometer
+    coef_posi = 0.5*delta_time*delta_time + delta_time*delta_time_rem
+    for idx_row, coef in ((0, coef_posi), (4, delta_time)):
+      jac_noise[:, idx_row, 1] = cos_atti_ang*coef
+      jac_noise[:, idx_row, 2] = -sin_atti_ang*coef
+      jac_noise[:, idx_row+1, 1] = sin_atti_ang*coef
+      jac_noise[:, idx_row+1, 2] = cos_atti_ang*coef
+      jac_noise[:, idx_row+2, 3] = coef
+
+    # Variances of the noise of the samples
+    var_noise = np.empty((num_samples, 4), dtype=float)
+    var_noise[:, 0] = self.cov_ang_vel
+    var_noise[:, 1:4] = self.cov_lin_acc
+    var_noise /= delta_time[:, None]
+
+    preint.cov = np.einsum('kic,kc,kjc->ij', jac_noise, var_noise, jac_noise)
+
+    return preint
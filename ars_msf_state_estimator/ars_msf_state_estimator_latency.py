@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import bisect
+
+import threading
+
+
+
+
+class ArsMsfStateEstimatorLatencyHistogram:
+
+  #######
+
+  # Fixed-size histogram of latencies [ns].
+  # Log-spaced bins: 10 per decade from 1 us to 10 s, plus an underflow
+  # and an overflow bin. Adding a sample is O(log(num_bins)), no allocation
+
+  # Upper edges of the bins [ns]
+  bin_edges = [int(round(1000.0 * 10.0**(idx_edge/10.0))) for idx_edge in range(71)]
+
+  # Number of samples per bin
+  bin_counts = None
+
+  # Number of samples
+  num_samples = None
+  # Sum of the samples [ns]
+  sum_samples = None
+  # Max of the samples [ns]
+  max_sample = None
+
+
+
+  #########
+
+  def __init__(self):
+
+    self.bin_counts = np.zeros((len(self.bin_edges)+1,), dtype=np.int64)
+
+    self.reset()
+
+    # End
+    return
+
+
+  def reset(self):
+
+    self.bin_counts[:] = 0
+    self.num_samples = 0
+    self.sum_samples = 0
+    self.max_sample = 0
+
+    return
+
+
+  def addSample(self, sample):
+
+    self.bin_counts[bisect.bisect_left(self.bin_edges, sample)] += 1
+    self.num_samples += 1
+    self.sum_samples += sample
+    if(sample > self.max_sample):
+      self.max_sample = sample
+
+    return
+
+
+  def getPercentile(self, percentile):
+
+    # Upper edge of the bin of the percentile [ns]
+    if(self.num_samples == 0):
+      return 0
+
+    idx_bin = int(np.searchsorted(np.cumsum(self.bin_counts), percentile/100.0*self.num_samples, side='left'))
+    if(idx_bin >= len(self.bin_edges)):
+      return self.max_sample
+
+    return min(self.bin_edges[idx_bin], self.max_sample)
+
+
+  def getSummary(self):
+
+    # Latencies [us]
+    if(self.num_samples == 0):
+      return {'count': 0}
+
+    return {
+      'count': self.num_samples,
+      'mean_us': self.sum_samples/self.num_samples/1e3,
+      'p50_us': self.getPercentile(50.0)/1e3,
+      'p90_us': self.getPercentile(90.0)/1e3,
+      'p99_us': self.getPercentile(99.0)/1e3,
+      'max_us': self.max_sample/1e3,
+    }
+
+
+
+
+class ArsMsfStateEstimatorLatency:
+
+  #######
+
+  # Latency instrumentation of the state estimator, from the header stamp
+  # of a measurement to the published estimate:
+  # - receive_delay_<meas>: callback time - header stamp
+  # - queue_delay_<meas>: update() time - callback time
+  # - compute_predict, compute_update, compute_publish: compute times
+  # - timer_jitter: |interval between two ticks of the loop timer - period|
+  # One histogram per quantity, plus the number of missed deadlines of the
+  # loop timer. Thread-safe
+
+  # Names of the measurements (<meas> of the histograms)
+  meas_names = None
+
+  # Histograms
+  # Key: name of the quantity
+  histograms = None
+
+  # Loop timer
+  # Time of the last tick [ns] (0: none)
+  timer_tick_time_last = None
+  # Number of missed deadlines: ticks more than half a period late
+  num_timer_deadlines_missed = None
+
+  #
+  lock = None
+
+
+
+  #########
+
+  def __init__(self, meas_names=()):
+
+    # meas_names: names of the measurements, e.g. of the registered
+    # measurement models
+    self.meas_names = list(meas_names)
+
+    self.histograms = dict()
+    for meas_name in self.meas_names:
+      self.histograms['receive_delay_'+meas_name] = ArsMsfStateEstimatorLatencyHistogram()
+    for meas_name in self.meas_names:
+      self.histograms['queue_delay_'+meas_name] = ArsMsfStateEstimatorLatencyHistogram()
+    for compute_name in ['predict', 'update', 'publish']:
+      self.histograms['compute_'+compute_name] = ArsMsfStateEstimatorLatencyHistogram()
+    self.histograms['timer_jitter'] = ArsMsfStateEstimatorLatencyHistogram()
+
+    self.timer_tick_time_last = 0
+    self.num_timer_deadlines_missed = 0
+
+    self.lock = threading.Lock()
+
+    # End
+    return
+
+
+  def addSample(self, name, sample):
+
+    # Negative latencies (clock offsets) are counted as 0
+    # Raises KeyError for an unknown quantity
+    self.lock.acquire()
+    try:
+      self.histograms[name].addSample(max(int(sample), 0))
+    finally:
+      self.lock.release()
+
+    return
+
+
+  def addTimerTick(self, time_tick, timer_period):
+
+    # Tick of the loop timer at time_tick [ns] (monotonic clock), with a
+    # nominal period timer_period [ns]
+    self.lock.acquire()
+    if(self.timer_tick_time_last):
+      timer_interval = time_tick - self.timer_tick_time_last
+      self.histograms['timer_jitter'].addSample(abs(timer_interval - timer_period))
+      if(2*timer_interval > 3*timer_period):
+        self.num_timer_deadlines_missed += 1
+    self.timer_tick_time_last = time_tick
+    self.lock.release()
+
+    return
+
+
+  def getSummary(self, flag_reset=False):
+
+    # Summaries of all the histograms. Optionally resets them, to report
+    # the latencies of the last period only
+    self.lock.acquire()
+    summary = {name: histogram.getSummary() for name, histogram in self.histograms.items()}
+    summary['timer_deadlines_missed'] = {'count': self.num_timer_deadlines_missed}
+    if(flag_reset):
+      for histogram in self.histograms.values():
+        histogram.reset()
+      self.num_timer_deadlines_missed = 0
+    self.lock.release()
+
+    return summary
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+#
+from ars_msf_state_estimator.ars_msf_state_estimator_quat_simp import *
+
+
+
+
+class ArsMsfStateEstimatorMeasModel:
+
+  #######
+
+  # Measurement model: plugin of the update (registered with
+  # ArsMsfStateEstimator.registerMeasModel()).
+  # A model defines the dimension of the measurement, the predicted
+  # measurement h(x), its Jacobian Hx wrt the error state and the
+  # covariance of the noise. The constant part (covariance, constant
+  # entries of Hx) is stacked once per combination of measurements; at
+  # each update the model only writes its rows of the innovation
+  # (h(x) - z) and the non-constant entries of its rows of Hx.
+  # By default the measurement is linear in the state: h(x) = Hx x, with
+  # Hx the constant entries
+  # Error state: [posi(3), atti_yaw, vel_lin_world(3), vel_ang_z]
+
+  # Name of the measurement (key of the config)
+  meas_name = None
+
+  # Mask of the measurement (one bit, assigned when registered)
+  meas_mask = None
+
+  # Source of the measurement, from the list of sources of the config:
+  # type of the measurement (None: not from the list) and its entry of the
+  # list
+  meas_source_type = None
+  meas_source_config = None
+
+  # Latency of the source [ns]: the samples are fused at their timestamp
+  # minus the latency
+  meas_latency = None
+  # Min time between two samples of the source [ns] (0: all the samples):
+  # the samples coming faster are dropped
+  meas_period_min = None
+
+  # Dimension of the measurement
+  dim_meas = None
+
+  # Dimensions of the fields of a sample, as pushed to the queue
+  meas_fields_dims = None
+
+  # Covariance of the noise of the measurement
+  cov_meas = None
+
+  # Jacobian Hx: constant entries (dim_meas x 8)
+  jac_Hx_const = None
+
+  # The non-constant entries of Hx depend on the linearisation point
+  # (attitude, linear velocity): steady state
+  flag_lin_point = None
+
+
+
+  #########
+
+  def __init__(self, meas_name, dim_meas, meas_fields_dims=None):
+
+    self.meas_name = meas_name
+    self.meas_mask = 0
+
+    self.meas_source_type = None
+    self.meas_source_config = None
+    self.meas_latency = 0
+    self.meas_period_min = 0
+
+    self.dim_meas = dim_meas
+    if(meas_fields_dims is None):
+      self.meas_fields_dims = [dim_meas]
+    else:
+      self.meas_fields_dims = meas_fields_dims
+
+    self.cov_meas = np.zeros((dim_meas, dim_meas), dtype=float)
+    self.jac_Hx_const = np.zeros((dim_meas, 8), dtype=float)
+    self.flag_lin_point = False
+
+    # End
+    return
+
+
+  def setConfigParameters(self, config_param):
+
+    # config_param: section of the measurement in the config
+    # - cov_diag: diagonal of the covariance
+    # - rate [Hz] (optional): max rate of the samples (0.0: all)
+    # - latency [s] (optional)
+
+    self.setCovMeas(np.diag(np.array(config_param['cov_diag'], dtype=float)))
+
+    rate = float(config_param.get('rate', 0.0))
+    if(rate < 0.0):
+      raise ValueError("Rate of the measurement "+str(self.meas_name)+" must be >= 0")
+    self.meas_period_min = int(round(1e9/rate)) if rate > 0.0 else 0
+
+    self.meas_latency = int(round(1e9*float(config_param.get('latency', 0.0))))
+
+    return
+
+
+  def setCovMeas(self, cov_meas):
+
+    cov_meas = np.array(cov_meas, dtype=float)
+    if(cov_meas.shape != (self.dim_meas, self.dim_meas)):
+      raise ValueError("Covariance of the measurement "+str(self.meas_name)+" must be "+str(self.dim_meas)+"x"+str(self.dim_meas))
+
+    self.cov_meas = cov_meas
+
+    return
+
+
+  def predictMeas(self, msf_state_estimator, workspace, meas_pred):
+
+    # Predicted measurement h(x), written in meas_pred (dim_meas).
+    # The rotation of the attitude of the state is in the workspace
+    # Default: linear in the state, h(x) = Hx x, with
+    # x = [posi(3), atti_yaw, vel_lin_world(3), vel_ang_z]
+
+    jac_Hx_const = self.jac_Hx_const
+
+    np.matmul(jac_Hx_const[:, 0:3], msf_state_estimator.estim_robot_posi, out=meas_pred)
+    meas_pred += jac_Hx_const[:, 3] * QuatSimp.angleFromQuatSimp(msf_state_estimator.estim_robot_atti_quat_simp)
+    meas_pred += np.matmul(jac_Hx_const[:, 4:7], msf_state_estimator.estim_robot_velo_lin_world)
+    meas_pred += jac_Hx_const[:, 7] * msf_state_estimator.estim_robot_velo_ang_world[0]
+
+    return
+
+
+  def setJacobian(self, msf_state_estimator, workspace, jac_Hx):
+
+    # Non-constant entries of the rows of Hx of the measurement
+    # (dim_meas x 8). Nothing if Hx is constant
+
+    return
+
+
+  def setInnovJacobian(self, msf_state_estimator, workspace, meas_z, innov_meas, jac_Hx):
+
+    # Rows of the measurement of the innovation, h(x) - z, and of Hx
+    # meas_z: fields of the sample
+
+    self.predictMeas(msf_state_estimator, workspace, innov_meas)
+    innov_meas -= meas_z[0]
+
+    self.setJacobian(msf_state_estimator, workspace, jac_Hx)
+
+    return
+
+
+
+
+class ArsMsfStateEstimatorMeasModelPosition(ArsMsfStateEstimatorMeasModel):
+
+  #######
+
+  # Meas position
+  # z_t = [m_posi_x, m_posi_y, m_posi_z]
+  # Dim (z_t) = 3
+
+
+
+  #########
+
+  def __init__(self, meas_name='meas_position'):
+
+    super().__init__(meas_name, 3)
+
+    self.jac_Hx_const[0:3, 0:3] = np.eye(3)
+
+    # End
+    return
+
+
+  def predictMeas(self, msf_state_estimator, workspace, meas_pred):
+
+    np.copyto(meas_pred, msf_state_estimator.estim_robot_posi)
+
+    return
+
+
+  def setInnovJacobian(self, msf_state_estimator, workspace, meas_z, innov_meas, jac_Hx):
+
+    np.subtract(msf_state_estimator.estim_robot_posi, meas_z[0], out=innov_meas)
+
+    return
+
+
+
+
+class ArsMsfStateEstimatorMeasModelAttitude(ArsMsfStateEstimatorMeasModel):
+
+  #######
+
+  # Meas attitude
+  # z_a = [m_atti_yaw]
+  # Dim (z_a) = 1
+  # The sample is the quaternion (simplified) [w, z]
+
+
+
+  #########
+
+  def __init__(self, meas_name='meas_attitude'):
+
+    super().__init__(meas_name, 1, [2])
+
+    self.jac_Hx_const[0, 3] = 1.0
+
+    # End
+    return
+
+
+  def predictMeas(self, msf_state_estimator, workspace, meas_pred):
+
+    meas_pred[0] = QuatSimp.angleFromQuatSimp(msf_state_estimator.estim_robot_atti_quat_simp)
+
+    return
+
+
+  def setInnovJacobian(self, msf_state_estimator, workspace, meas_z, innov_meas, jac_Hx):
+
+    # Difference of the attitudes, converted to angle
+    innov_meas_robot_atti_quat_simp = QuatSimp.computeDiffQuatSimp(msf_state_estimator.estim_robot_atti_quat_simp, meas_z[0])
+    innov_meas[0] = QuatSimp.angleFromQuatSimp(innov_meas_robot_atti_quat_simp)
+
+    return
+
+
+
+
+class ArsMsfStateEstimatorMeasModelVelRobot(ArsMsfStateEstimatorMeasModel):
+
+  #######
+
+  # Meas velocity
+  # z_v = [m_vel_lin_x_robot, m_vel_lin_y_robot, m_vel_lin_z_robot,
+  #       m_vel_ang_z_robot]
+  # Dim (z_v) = 4
+  # The sample has two fields: linear and angular velocity. Diagonal of the
+  # covariance: [lin_x, lin_y, lin_z, ang_z]
+  # The entries of Hx wrt the attitude and the linear velocity depend on
+  # the state. The yaw rotation leaves the linear velocity z equal to
+  # vel_lin_z_world (vertical channel)
+
+
+
+  #########
+
+  def __init__(self, meas_name='meas_velocity'):
+
+    super().__init__(meas_name, 4, [3, 1])
+
+    self.jac_Hx_const[3, 7] = 1.0
+    self.flag_lin_point = True
+
+    # End
+    return
+
+
+  def predictMeas(self, msf_state_estimator, workspace, meas_pred):
+
+    # Robot velo lin in robot frame
+    np.matmul(workspace.robot_atti_rot_mat.T, msf_state_estimator.estim_robot_velo_lin_world, out=meas_pred[0:3])
+    # Robot velo ang
+    meas_pred[3] = msf_state_estimator.estim_robot_velo_ang_world[0]
+
+    return
+
+
+  def setJacobian(self, msf_state_estimator, workspace, jac_Hx):
+
+    # Meas velo lin - robot atti
+    np.matmul(workspace.robot_atti_diff_rot_mat.T, msf_state_estimator.estim_robot_velo_lin_world, out=jac_Hx[0:3, 3])
+    # Meas velo lin - robot velo lin
+    jac_Hx[0:3, 4:7] = workspace.robot_atti_rot_mat.T
+
+    return
+
+
+  def setInnovJacobian(self, msf_state_estimator, workspace, meas_z, innov_meas, jac_Hx):
+
+    self.predictMeas(msf_state_estimator, workspace, innov_meas)
+    innov_meas[0:3] -= meas_z[0]
+    innov_meas[3] -= meas_z[1][0]
+
+    self.setJacobian(msf_state_estimator, workspace, jac_Hx)
+
+    return
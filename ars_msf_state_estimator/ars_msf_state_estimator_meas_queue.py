@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+
+
+class ArsMsfStateEstimatorMeasQueue:
+
+  #######
+
+  # Bounded FIFO of timestamped samples of one measurement, preallocated.
+  # A sample is made of one or more fields (e.g. linear and angular
+  # velocity), each a 1d array of fixed dimension.
+  # When full, the overflow policy decides which sample is dropped:
+  # - 'drop_oldest': the oldest sample in the queue (keeps the freshest)
+  # - 'drop_newest': the incoming sample
+  # With depth 1 and 'drop_oldest', only the last sample is kept.
+  # With a min period, the samples newer than the newest one accepted by
+  # less than it are skipped (rate of the source). The older samples (out
+  # of order) are kept, to be fused at their timestamp
+
+  # Overflow policies
+  overflow_policies = ['drop_oldest', 'drop_newest']
+
+  # Capacity (max number of samples)
+  depth = None
+  # Overflow policy
+  overflow_policy = None
+  # Min time between two samples [ns] (0: all the samples)
+  period_min = None
+  # Timestamp of the newest sample accepted [ns] (None: none)
+  timestamp_last = None
+
+  # Physical index of the oldest sample
+  idx_start = None
+  # Number of samples stored
+  num_samples = None
+
+  # Timestamps [ns]
+  timestamp = None
+  # Fields of the samples
+  meas = None
+  # Times of reception [ns] (latency instrumentation, 0: not given)
+  time_receive = None
+
+  # Number of samples dropped on overflow
+  num_dropped = None
+  # Number of samples skipped by the min period
+  num_skipped = None
+
+
+
+  #########
+
+  def __init__(self, meas_dims, depth=1, overflow_policy='drop_oldest', period_min=0):
+
+    #
+    if(overflow_policy not in self.overflow_policies):
+      raise ValueError("Unknown overflow policy: "+str(overflow_policy))
+
+    self.depth = int(depth)
+    if(self.depth < 1):
+      raise ValueError("Depth of the queue must be >= 1")
+    self.overflow_policy = overflow_policy
+    self.period_min = int(period_min)
+    self.timestamp_last = None
+
+    #
+    self.timestamp = np.zeros((self.depth,), dtype=np.int64)
+    self.meas = [np.zeros((self.depth, meas_dim), dtype=float) for meas_dim in meas_dims]
+    self.time_receive = np.zeros((self.depth,), dtype=np.int64)
+
+    #
+    self.num_dropped = 0
+    self.num_skipped = 0
+
+    #
+    self.reset()
+
+    # End
+    return
+
+
+  def reset(self):
+
+    self.idx_start = 0
+    self.num_samples = 0
+
+    return
+
+
+  def getNumSamples(self):
+
+    return self.num_samples
+
+
+  def push(self, timestamp, *meas, time_receive=0):
+
+    # Returns False if a sample was dropped or skipped
+
+    # Faster than the min period. Only the samples newer than the newest
+    # one accepted
+    if(self.period_min):
+      if(self.timestamp_last is None or timestamp > self.timestamp_last):
+        if(self.timestamp_last is not None and timestamp - self.timestamp_last < self.period_min):
+          self.num_skipped += 1
+          return False
+        self.timestamp_last = timestamp
+
+    flag_dropped = False
+
+    if(self.num_samples == self.depth):
+      self.num_dropped += 1
+      flag_dropped = True
+      if(self.overflow_policy == 'drop_newest'):
+        return False
+      # Drop the oldest
+      self.idx_start = (self.idx_start + 1) % self.depth
+      self.num_samples -= 1
+
+    phys_idx = (self.idx_start + self.num_samples) % self.depth
+    self.timestamp[phys_idx] = timestamp
+    self.time_receive[phys_idx] = time_receive
+    for meas_field, meas_field_value in zip(self.meas, meas):
+      meas_field[phys_idx] = meas_field_value
+    self.num_samples += 1
+
+    return not flag_dropped
+
+
+  def popAll(self):
+
+    # Removes all the samples. Returns copies, in FIFO order:
+    # list of timestamps, list of fields (num_samples, dim), and list of
+    # times of reception
+
+    idx_start = self.idx_start
+    idx_end = idx_start + self.num_samples
+
+    if(idx_end <= self.depth):
+      # Contiguous
+      timestamp = self.timestamp[idx_start:idx_end].tolist()
+      meas = [meas_field[idx_start:idx_end].copy() for meas_field in self.meas]
+      time_receive = self.time_receive[idx_start:idx_end].tolist()
+    else:
+      # Wrapped around
+      phys_idx = np.arange(idx_start, idx_end) % self.depth
+      timestamp = self.timestamp[phys_idx].tolist()
+      meas = [meas_field[phys_idx] for meas_field in self.meas]
+      time_receive = self.time_receive[phys_idx].tolist()
+
+    # Empty
+    self.idx_start = 0
+    self.num_samples = 0
+
+    return timestamp, meas, time_receive
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import math
+
+
+
+
+class QuatSimp:
+
+  #######
+
+  # Simplified quaternion [w, z] of a rotation around the z axis.
+  # Same conventions as ars_lib_helpers.Quaternion, with no ROS dependency,
+  # so that the core estimator can be used without ROS installed
+
+  #########
+
+  def zerosQuatSimp():
+
+    quat_simp = np.zeros((2,), dtype=float)
+    quat_simp[0] = 1.0
+
+    return quat_simp
+
+
+  def setQuatSimp(v):
+
+    return np.array(v, dtype=float)
+
+
+  def quatSimpFromAngle(angle):
+
+    quat_simp = np.zeros((2,), dtype=float)
+    quat_simp[0] = math.cos(0.5*angle)
+    quat_simp[1] = math.sin(0.5*angle)
+
+    if(quat_simp[0] < 0.0):
+      quat_simp *= -1.0
+
+    return quat_simp
+
+
+  def angleFromQuatSimp(quat_simp):
+
+    return 2.0 * math.atan2(quat_simp[1], quat_simp[0])
+
+
+  def quatSimpProd(quat_simp_1, quat_simp_2):
+
+    quat_simp = np.zeros((2,), dtype=float)
+    quat_simp[0] = quat_simp_1[0]*quat_simp_2[0] - quat_simp_1[1]*quat_simp_2[1]
+    quat_simp[1] = quat_simp_1[0]*quat_simp_2[1] + quat_simp_1[1]*quat_simp_2[0]
+
+    return quat_simp
+
+
+  def computeDiffQuatSimp(quat_simp_1, quat_simp_2):
+
+    # quat_simp_1 * conj(quat_simp_2), with w >= 0
+    quat_simp = np.zeros((2,), dtype=float)
+    quat_simp[0] = quat_simp_1[0]*quat_simp_2[0] + quat_simp_1[1]*quat_simp_2[1]
+    quat_simp[1] = quat_simp_1[1]*quat_simp_2[0] - quat_simp_1[0]*quat_simp_2[1]
+
+    if(quat_simp[0] < 0.0):
+      quat_simp *= -1.0
+
+    return quat_simp
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import os
+
+#
+from ars_msf_state_estimator.ars_msf_state_estimator import *
+
+
+
+
+class ArsMsfStateEstimatorReplay:
+
+  #######
+
+  # Offline replay of a log of timestamped measurements through
+  # ArsMsfStateEstimator, in time order and as fast as possible.
+  # No ROS dependency, except to read rosbag2 logs.
+  #
+  # Log of measurements: stacked arrays, sorted by timestamp
+  # - timestamp [ns] (N,) int64
+  # - meas_type (N,) int: mask of the measurement
+  #   (ArsMsfStateEstimator.meas_mask_robot_*, or of an additional source,
+  #   in the order of the config)
+  # - meas_value (N, 4) float, the fields of the sample one after the
+  #   other:
+  #   - posi: [posi_x, posi_y, posi_z, -]
+  #   - atti: [atti_quat_simp_w, atti_quat_simp_z, -, -]
+  #   - velo: [vel_lin_x_robot, vel_lin_y_robot, vel_lin_z_robot, vel_ang_z_robot]
+  #
+  # CSV log: one measurement per row
+  #   timestamp,meas_type,v0,v1,v2,v3
+  # NPZ log: arrays 'timestamp', 'meas_type' and 'meas_value'
+  #
+  # Trajectory (output): one row per step of the estimator
+  # - timestamp [ns] (M,) int64
+  # - state (M, 9) float:
+  #   [ posi_x, posi_y, posi_z,
+  #     atti_quat_simp_w, atti_quat_simp_z,
+  #     vel_lin_x_world, vel_lin_y_world, vel_lin_z_world,
+  #     vel_ang_z_world ]
+  # - state_cov_triu (M, 36) float: upper triangle (row-major) of the
+  #   covariance of the state
+
+  # Replay mode
+  # - 'timer': predict and update at the rate of the state estim loop,
+  #   as the ROS node does in 'timer' mode. One output per tick
+  # - 'event': predict and update at each timestamp of the log.
+  #   One output per timestamp
+  replay_mode = None
+
+  # State estim loop freq
+  state_estim_loop_freq = None
+
+  # Estimator
+  msf_state_estimator = None
+  # History of the estimator enabled in the config
+  flag_history_enabled = None
+
+  # Indices of the upper triangle of the covariance of the state
+  state_cov_triu_idx = None
+
+  # Default names of the topics of the measurements in a rosbag2 log
+  rosbag_topic_meas_robot_posi = 'meas_robot_position'
+  rosbag_topic_meas_robot_atti = 'meas_robot_attitude'
+  rosbag_topic_meas_robot_vel_robot = 'meas_robot_velocity_robot'
+
+
+
+  #########
+
+  def __init__(self):
+
+    #
+    self.replay_mode = 'timer'
+    self.state_estim_loop_freq = 50.0
+
+    #
+    self.msf_state_estimator = None
+    self.flag_history_enabled = False
+
+    #
+    self.state_cov_triu_idx = np.triu_indices(8)
+
+    # End
+    return
+
+
+  def setConfigParameters(self, config_param):
+
+    # config_param: content of 'msf_state_estimator' of the config of the
+    # ROS node
+
+    #
+    self.state_estim_loop_freq = config_param['state_estim_loop_freq']
+
+    #
+    self.msf_state_estimator = ArsMsfStateEstimator()
+    self.msf_state_estimator.setConfigParameters(config_param['ekf'])
+    self.flag_history_enabled = self.msf_state_estimator.flag_history_enabled
+
+    # Prediction-only outputs are not needed offline
+    replay_mode = config_param.get('state_estim_mode', 'timer')
+    if(replay_mode == 'hybrid'):
+      replay_mode = 'event'
+    self.setReplayMode(replay_mode)
+
+    return
+
+
+  def setReplayMode(self, replay_mode):
+
+    if(replay_mode not in ['timer', 'event']):
+      raise ValueError("Unknown replay mode: "+str(replay_mode))
+
+    self.replay_mode = replay_mode
+
+    # In 'event' mode the estimator is always at the timestamp of the
+    # measurements: none is fused late, and the history is not needed
+    self.msf_state_estimator.flag_history_enabled = self.flag_history_enabled and self.replay_mode != 'event'
+
+    return
+
+
+  def loadMeasLog(self, file_path, rosbag_topics=None):
+
+    # Returns timestamp, meas_type, meas_value, sorted by timestamp
+
+    if(file_path.endswith('.csv')):
+      timestamp, meas_type, meas_value = self.loadMeasLogCsv(file_path)
+    elif(file_path.endswith('.npz')):
+      timestamp, meas_type, meas_value = self.loadMeasLogNpz(file_path)
+    else:
+      timestamp, meas_type, meas_value = self.loadMeasLogRosbag(file_path, rosbag_topics)
+
+    # Stable: measurements with the same timestamp keep the order of the log
+    idx_sort = np.argsort(timestamp, kind='stable')
+
+    return timestamp[idx_sort], meas_type[idx_sort], meas_value[idx_sort]
+
+
+  def loadMeasLogCsv(self, file_path):
+
+    # Structured dtype: the timestamps [ns] do not fit in a float64
+    meas_log = np.loadtxt(file_path, delimiter=',', skiprows=1, ndmin=1,
+      dtype=[('timestamp', np.int64), ('meas_type', int), ('v0', float), ('v1', float), ('v2', float), ('v3', float)])
+
+    timestamp = meas_log['timestamp']
+    meas_type = meas_log['meas_type']
+    meas_value = np.stack([meas_log['v0'], meas_log['v1'], meas_log['v2'], meas_log['v3']], axis=1)
+
+    return timestamp, meas_type, meas_value
+
+
+  def loadMeasLogNpz(self, file_path):
+
+    with np.load(file_path) as meas_log:
+      timestamp = meas_log['timestamp'].astype(np.int64)
+      meas_type = meas_log['meas_type'].astype(int)
+      meas_value = meas_log['meas_value'].astype(float)
+
+    return timestamp, meas_type, meas_value
+
+
+  def loadMeasLogRosbag(self, file_path, rosbag_topics=None):
+
+    # rosbag2 log (sqlite3 or mcap). Requires ROS
+    # rosbag_topics: dict mask of the measurement -> topic.
+    # By default, the topics ending with the names of the ROS node, and
+    # those of the additional sources
+
+    import rosbag2_py
+    from rclpy.serialization import deserialize_message
+    from geometry_msgs.msg import PointStamped
+    from geometry_msgs.msg import QuaternionStamped
+    from geometry_msgs.msg import TwistStamped
+    import ars_lib_helpers.ars_lib_helpers as ars_lib_helpers
+
+    #
+    storage_id = 'sqlite3'
+    if(file_path.endswith('.mcap') or (os.path.isdir(file_path) and any(file_name.endswith('.mcap') for file_name in os.listdir(file_path)))):
+      storage_id = 'mcap'
+
+    reader = rosbag2_py.SequentialReader()
+    reader.open(rosbag2_py.StorageOptions(uri=file_path, storage_id=storage_id), rosbag2_py.ConverterOptions('cdr', 'cdr'))
+
+    #
+    if(rosbag_topics is None):
+      rosbag_topics = dict()
+      for topic_metadata in reader.get_all_topics_and_types():
+        if(topic_metadata.name.endswith(self.rosbag_topic_meas_robot_posi)):
+          rosbag_topics[ArsMsfStateEstimator.meas_mask_robot_posi] = topic_metadata.name
+        elif(topic_metadata.name.endswith(self.rosbag_topic_meas_robot_atti)):
+          rosbag_topics[ArsMsfStateEstimator.meas_mask_robot_atti] = topic_metadata.name
+        elif(topic_metadata.name.endswith(self.rosbag_topic_meas_robot_vel_robot)):
+          rosbag_topics[ArsMsfStateEstimator.meas_mask_robot_vel_robot] = topic_metadata.name
+        else:
+          for meas_model in self.msf_state_estimator.getMeasSources():
+            if(topic_metadata.name.endswith(meas_model.meas_source_config['topic'])):
+              rosbag_topics[meas_model.meas_mask] = topic_metadata.name
+
+    topic_meas_type = {topic: meas_type for meas_type, topic in rosbag_topics.items()}
+    # Type of the measurement of each mask: the additional sources as the
+    # measurement of their type
+    meas_source_type = {
+      ArsMsfStateEstimator.meas_mask_robot_posi: 'meas_position',
+      ArsMsfStateEstimator.meas_mask_robot_atti: 'meas_attitude',
+      ArsMsfStateEstimator.meas_mask_robot_vel_robot: 'meas_velocity',
+    }
+    for meas_model in self.msf_state_estimator.getMeasSources():
+      meas_source_type[meas_model.meas_mask] = meas_model.meas_source_type
+    meas_msg_type = {
+      'meas_position': PointStamped,
+      'meas_attitude': QuaternionStamped,
+      'meas_velocity': TwistStamped,
+    }
+
+    #
+    timestamp = []
+    meas_type = []
+    meas_value = []
+
+    robot_atti_quat = ars_lib_helpers.Quaternion.zerosQuat()
+
+    while(reader.has_next()):
+
+      topic, data, _ = reader.read_next()
+      if(topic not in topic_meas_type):
+        continue
+
+      meas_type_msg = topic_meas_type[topic]
+      meas_source_type_msg = meas_source_type[meas_type_msg]
+      meas_msg = deserialize_message(data, meas_msg_type[meas_source_type_msg])
+
+      # Timestamp of the header, as in the ROS node
+      timestamp.append(meas_msg.header.stamp.sec*1000000000 + meas_msg.header.stamp.nanosec)
+      meas_type.append(meas_type_msg)
+
+      if(meas_source_type_msg == 'meas_position'):
+        meas_value.append([meas_msg.point.x, meas_msg.point.y, meas_msg.point.z, 0.0])
+      elif(meas_source_type_msg == 'meas_attitude'):
+        robot_atti_quat[0] = meas_msg.quaternion.w
+        robot_atti_quat[1] = meas_msg.quaternion.x
+        robot_atti_quat[2] = meas_msg.quaternion.y
+        robot_atti_quat[3] = meas_msg.quaternion.z
+        robot_atti_quat_simp = ars_lib_helpers.Quaternion.getSimplifiedQuatRobotAtti(robot_atti_quat)
+        meas_value.append([robot_atti_quat_simp[0], robot_atti_quat_simp[1], 0.0, 0.0])
+      else:
+        meas_value.append([meas_msg.twist.linear.x, meas_msg.twist.linear.y, meas_msg.twist.linear.z, meas_msg.twist.angular.z])
+
+    return np.array(timestamp, dtype=np.int64), np.array(meas_type, dtype=int), np.array(meas_value, dtype=float).reshape(-1, 4)
+
+
+  def setMeas(self, meas_type, meas_value, timestamp):
+
+    # Fields of the sample, one after the other in meas_value
+    meas_model = self.msf_state_estimator.getMeasModel(int(meas_type))
+    if(meas_model is None):
+      return
+
+    meas_fields = []
+    idx_value = 0
+    for meas_field_dim in meas_model.meas_fields_dims:
+      meas_fields.append(meas_value[idx_value:idx_value+meas_field_dim])
+      idx_value += meas_field_dim
+
+    self.msf_state_estimator.setMeas(meas_model.meas_mask, timestamp, *meas_fields)
+
+    return
+
+
+  def run(self, timestamp, meas_type, meas_value):
+
+    # Replays a log of measurements, sorted by timestamp.
+    # Returns the trajectory: timestamp, state, state_cov_triu
+
+    num_meas = timestamp.shape[0]
+    if(num_meas == 0):
+      return np.zeros((0,), dtype=np.int64), np.zeros((0, 9), dtype=float), np.zeros((0, 36), dtype=float)
+
+    # Timestamps of the steps of the estimator
+    if(self.replay_mode == 'timer'):
+      # Ticks of the state estim loop, from the first measurement
+      state_estim_loop_period_ns = int(round(1e9/self.state_estim_loop_freq))
+      num_steps = int((timestamp[-1]-timestamp[0]) // state_estim_loop_period_ns) + 2
+      step_timestamp = timestamp[0] + state_estim_loop_period_ns * np.arange(num_steps, dtype=np.int64)
+    else:
+      step_timestamp = np.unique(timestamp)
+      num_steps = step_timestamp.shape[0]
+
+    # Measurements with a timestamp <= the timestamp of the step.
+    # Vectorised: one binary search for all the steps
+    idx_meas_step_end = np.searchsorted(timestamp, step_timestamp, side='right')
+
+    # Trajectory: preallocated
+    traj_timestamp = step_timestamp
+    traj_state = np.zeros((num_steps, 9), dtype=float)
+    traj_state_cov_triu = np.zeros((num_steps, 36), dtype=float)
+
+    #
+    msf_state_estimator = self.msf_state_estimator
+    state_cov_triu_idx = self.state_cov_triu_idx
+
+    idx_meas = 0
+    for idx_step in range(num_steps):
+
+      # Measurements
+      idx_meas_end = idx_meas_step_end[idx_step]
+      while(idx_meas < idx_meas_end):
+        self.setMeas(meas_type[idx_meas], meas_value[idx_meas], int(timestamp[idx_meas]))
+        idx_meas += 1
+
+      # Predict and update
+      if(self.replay_mode == 'timer'):
+        # Same result as predict and update (as the ROS node does): with the
+        # history enabled, the measurements are fused at their timestamps
+        # either way, but in this order they are never fused late, which
+        # avoids rolling back and replaying the history
+        msf_state_estimator.update()
+        msf_state_estimator.predict(int(step_timestamp[idx_step]))
+      else:
+        msf_state_estimator.predict(int(step_timestamp[idx_step]))
+        msf_state_estimator.update()
+
+      # Trajectory
+      estim_state_snapshot = msf_state_estimator.getStateSnapshot()
+      traj_state[idx_step] = estim_state_snapshot.state
+      traj_state_cov_triu[idx_step] = estim_state_snapshot.state_cov[state_cov_triu_idx]
+
+    return traj_timestamp, traj_state, traj_state_cov_triu
+
+
+  def saveTrajectory(self, file_path, traj_timestamp, traj_state, traj_state_cov_triu):
+
+    # Uncompressed NPZ: fast to write and to memory-map
+    np.savez(file_path, timestamp=traj_timestamp, state=traj_state, state_cov_triu=traj_state_cov_triu)
+
+    return
+
+
+  def loadTrajectory(self, file_path):
+
+    # Returns timestamp, state, state_cov (full covariance)
+
+    with np.load(file_path) as traj:
+      traj_timestamp = traj['timestamp']
+      traj_state = traj['state']
+      traj_state_cov_triu = traj['state_cov_triu']
+
+    traj_state_cov = np.zeros((traj_timestamp.shape[0], 8, 8), dtype=float)
+    traj_state_cov[:, self.state_cov_triu_idx[0], self.state_cov_triu_idx[1]] = traj_state_cov_triu
+    traj_state_cov[:, self.state_cov_triu_idx[1], self.state_cov_triu_idx[0]] = traj_state_cov_triu
+
+    return traj_timestamp, traj_state, traj_state_cov
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+
+import os
+
+import time
+
+# pyyaml - https://pyyaml.org/wiki/PyYAMLDocumentation
+import yaml
+from yaml.loader import SafeLoader
+
+from ars_msf_state_estimator.ars_msf_state_estimator_replay import ArsMsfStateEstimatorReplay
+
+
+def main(args=None):
+
+  parser = argparse.ArgumentParser(description='Offline replay of a log of measurements through the MSF state estimator')
+  parser.add_argument('meas_log_file', help='Log of measurements: CSV, NPZ or rosbag2 (sqlite3 or mcap)')
+  parser.add_argument('-o', '--output', default='estim_trajectory.npz', help='Estimated trajectory (NPZ)')
+  parser.add_argument('-c', '--config', default=None, help='Config of the state estimator (YAML). Default: config of the ROS package')
+  parser.add_argument('-m', '--mode', default=None, choices=['timer', 'event'], help='Replay mode. Default: state_estim_mode of the config')
+  args = parser.parse_args(args)
+
+  # Config
+  config_param_yaml_file_name = args.config
+  if(config_param_yaml_file_name is None):
+    from ament_index_python.packages import get_package_share_directory
+    pkg_path = get_package_share_directory('ars_msf_state_estimator')
+    config_param_yaml_file_name = os.path.join(pkg_path, 'config', 'config_msf_state_estimator.yaml')
+
+  with open(config_param_yaml_file_name, 'r') as file:
+    config_param = yaml.load(file, Loader=SafeLoader)['msf_state_estimator']
+
+  # Replay
+  msf_state_estimator_replay = ArsMsfStateEstimatorReplay()
+  msf_state_estimator_replay.setConfigParameters(config_param)
+  if(args.mode is not None):
+    msf_state_estimator_replay.setReplayMode(args.mode)
+
+  timestamp, meas_type, meas_value = msf_state_estimator_replay.loadMeasLog(args.meas_log_file)
+
+  time_start = time.perf_counter()
+  traj_timestamp, traj_state, traj_state_cov_triu = msf_state_estimator_replay.run(timestamp, meas_type, meas_value)
+  time_replay = time.perf_counter() - time_start
+
+  msf_state_estimator_replay.saveTrajectory(args.output, traj_timestamp, traj_state, traj_state_cov_triu)
+
+  # Summary
+  if(timestamp.shape[0] > 0):
+    time_log = (timestamp[-1]-timestamp[0])/1e9
+    print('Replayed {} measurements ({:.1f} s of log) in {:.3f} s: {:.1f} x real time'.format(timestamp.shape[0], time_log, time_replay, time_log/max(time_replay, 1e-9)))
+  print('Trajectory: {} steps -> {}'.format(traj_timestamp.shape[0], args.output))
+
+  return 0
+
+
+''' MAIN '''
+if __name__ == '__main__':
+
+  main()
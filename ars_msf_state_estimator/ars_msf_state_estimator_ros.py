@@ -5,6 +5,10 @@ from numpy import *
 
 import os
 
+import time
+
+import threading
+
 # pyyaml - https://pyyaml.org/wiki/PyYAMLDocumentation
 import yaml
 from yaml.loader import SafeLoader
@@ -14,6 +18,9 @@ from yaml.loader import SafeLoader
 import rclpy
 from rclpy.node import Node
 from rclpy.time import Time
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup
+from rclpy.executors import SingleThreadedExecutor
+from rclpy.executors import MultiThreadedExecutor
 
 from ament_index_python.packages import get_package_share_directory
 
@@ -32,12 +39,25 @@ from geometry_msgs.msg import Twist
 from geometry_msgs.msg import TwistStamped
 from geometry_msgs.msg import TwistWithCovarianceStamped
 
+import sensor_msgs.msg
+from sensor_msgs.msg import Imu
+
+import nav_msgs.msg
+from nav_msgs.msg import Path
+
+
+import diagnostic_msgs.msg
+from diagnostic_msgs.msg import DiagnosticArray
+from diagnostic_msgs.msg import DiagnosticStatus
+from diagnostic_msgs.msg import KeyValue
+
 
 import tf2_ros
 
 
 #
 from ars_msf_state_estimator.ars_msf_state_estimator import *
+from ars_msf_state_estimator.ars_msf_state_estimator_latency import *
 
 #
 import ars_lib_helpers.ars_lib_helpers as ars_lib_helpers
@@ -56,12 +76,23 @@ class ArsMsfStateEstimatorRos(Node):
   world_frame = None
 
 
+  # State Estim mode
+  # - 'timer': predict and update in the state estim loop
+  # - 'event': predict and update on measurement arrival
+  # - 'hybrid': 'event' + a low rate loop for prediction-only outputs
+  state_estim_mode = None
+
   # State Estim loop freq 
   # time step
   state_estim_loop_freq = None
   # Timer
   state_estim_loop_timer = None
 
+  # State Pred loop freq (hybrid mode)
+  state_pred_loop_freq = None
+  # Timer
+  state_pred_loop_timer = None
+
 
   # Meas Robot posi subscriber
   meas_robot_posi_sub = None
@@ -69,6 +100,10 @@ class ArsMsfStateEstimatorRos(Node):
   meas_robot_atti_sub = None
   # Meas Robot velocity subscriber
   meas_robot_vel_robot_sub = None
+  # Meas Robot IMU subscriber (IMU-driven prediction)
+  meas_robot_imu_sub = None
+  # Subscribers of the additional sources of measurements (meas_sources)
+  meas_sources_sub = None
 
 
   # Estim Robot pose pub
@@ -80,12 +115,122 @@ class ArsMsfStateEstimatorRos(Node):
   #
   estim_robot_vel_world_pub = None
   estim_robot_vel_world_cov_pub = None
+  # Estim Robot pose and velocity pub, propagated at the rate of the IMU
+  estim_robot_pose_imu_pub = None
+  estim_robot_vel_world_imu_pub = None
+
+
+  # Queries of the state at given timestamps
+  # Request: the stamps of the poses of a Path (or its header stamp, if
+  # it has no poses). Reply: pose and velocity wrt world, with covariance,
+  # at each of the stamps that could be answered
+  estim_robot_state_query_sub = None
+  estim_robot_pose_cov_query_pub = None
+  estim_robot_vel_world_cov_query_pub = None
 
 
   # tf2 broadcaster
   tf2_broadcaster = None
 
 
+  # Messages of the outputs, reused (see createPublishMsgs)
+  # Headers
+  estim_header_world_msg = None
+  estim_header_robot_msg = None
+  # Pose
+  estim_robot_pose_msg = None
+  estim_robot_pose_stamped_msg = None
+  estim_robot_pose_cov_stamped_msg = None
+  # Covariance of the pose (6x6, row major)
+  estim_robot_pose_covariance = None
+  # Tf2
+  estim_robot_pose_tf2_msg = None
+  # Velocity
+  estim_robot_vel_world_msg = None
+  estim_robot_vel_world_stamped_msg = None
+  estim_robot_vel_world_cov_stamped_msg = None
+  estim_robot_vel_robot_msg = None
+  estim_robot_vel_robot_stamped_msg = None
+  estim_robot_vel_robot_cov_stamped_msg = None
+  # Covariance of the velocities (6x6, row major)
+  estim_robot_vel_world_covariance = None
+  estim_robot_vel_robot_covariance = None
+  # Outputs at the rate of the IMU (own messages: published from the
+  # ingestion callbacks)
+  estim_robot_pose_imu_stamped_msg = None
+  estim_robot_vel_world_imu_stamped_msg = None
+  # Jacobian of the velocity wrt robot, wrt the state
+  # [atti_yaw, vel_lin_x_world, vel_lin_y_world, vel_lin_z_world, vel_ang_z_world]
+  jac_vel_robot = None
+  #
+  lock_publish = None
+
+  # Covariance of the pose from the state covariance:
+  # pose [x, y, z, roll, pitch, yaw] <- state [posi_x, posi_y, posi_z, -, -, atti_yaw]
+  # Flat indices in the 6x6 pose covariance, and in the 8x8 state covariance
+  covariance_pose_idx = np.array([6*i+j for i in [0, 1, 2, 5] for j in [0, 1, 2, 5]])
+  covariance_pose_state_idx = np.array([8*i+j for i in [0, 1, 2, 3] for j in [0, 1, 2, 3]])
+  # Covariance of the velocity from the state covariance:
+  # twist [lin_x, lin_y, lin_z, ang_x, ang_y, ang_z] <- state [vel_lin_x_world, vel_lin_y_world, vel_lin_z_world, -, -, vel_ang_z_world]
+  covariance_twist_idx = np.array([6*i+j for i in [0, 1, 2, 5] for j in [0, 1, 2, 5]])
+  covariance_twist_state_idx = np.array([8*i+j for i in [4, 5, 6, 7] for j in [4, 5, 6, 7]])
+
+
+  # Outputs: publication control
+  # Names of the outputs
+  publish_output_names = ['estim_robot_pose', 'estim_robot_pose_cov', 'estim_robot_velocity_robot', 'estim_robot_velocity_robot_cov', 'estim_robot_velocity_world', 'estim_robot_velocity_world_cov', 'tf']
+  # Periods [ns] (0: every state estimation step)
+  # Key: name of the output
+  publish_periods = None
+  # Timestamp of the next publication [ns]
+  # Key: name of the output
+  publish_timestamp_next = None
+  # Tf2 enabled
+  flag_tf_enabled = None
+
+
+  # Executor
+  # - 'single_threaded': all the callbacks on one thread
+  # - 'multi_threaded': callback groups run in parallel
+  executor_type = None
+  # Number of threads (multi-threaded executor)
+  executor_num_threads = None
+  # Callback groups
+  # Ingestion: measurement callbacks
+  callback_group_ingestion = None
+  # Estimation: loop timers and publication
+  callback_group_estim = None
+  # Dedicated ingestion thread ('timer' mode only): the measurement
+  # subscriptions belong to a separate node, spun on its own thread. Its
+  # callbacks only enqueue the measurements
+  flag_ingestion_thread = None
+  ingestion_node = None
+  ingestion_executor = None
+  ingestion_thread = None
+
+
+  # Latency instrumentation
+  flag_latency_enabled = None
+  # Histograms
+  latency = None
+  # Diagnostics pub
+  diagnostics_pub = None
+  # Diagnostics freq
+  latency_diagnostics_freq = None
+  # Timer
+  latency_diagnostics_timer = None
+
+  # Gating of the measurements: counts of rejected measurements published
+  # on /diagnostics (at latency_diagnostics_freq)
+  flag_gating_enabled = None
+  # Timer
+  gating_diagnostics_timer = None
+
+
+  # IMU-driven prediction
+  flag_imu_enabled = None
+
+
   #
   config_param = None
 
@@ -107,12 +252,39 @@ class ArsMsfStateEstimatorRos(Node):
     # World frame
     self.world_frame = 'world'
 
+    # State Estim mode
+    self.state_estim_mode = 'timer'
+
     # State Estim loop freq 
     self.state_estim_loop_freq = 50.0
 
+    # State Pred loop freq
+    self.state_pred_loop_freq = 10.0
+
+    # Outputs
+    self.publish_periods = {output_name: 0 for output_name in self.publish_output_names}
+    self.publish_timestamp_next = {output_name: 0 for output_name in self.publish_output_names}
+    self.flag_tf_enabled = True
+
+    # Executor
+    self.executor_type = 'single_threaded'
+    self.executor_num_threads = 2
+    self.flag_ingestion_thread = False
+
     # Motion controller
     self.msf_state_estimator = ArsMsfStateEstimator()
 
+    # Latency instrumentation
+    self.flag_latency_enabled = False
+    self.setLatencyMeas()
+    self.latency_diagnostics_freq = 1.0
+
+    # Gating
+    self.flag_gating_enabled = False
+
+    # IMU
+    self.flag_imu_enabled = False
+
     #
     self.__init(node_name)
 
@@ -161,10 +333,40 @@ class ArsMsfStateEstimatorRos(Node):
     self.robot_frame = self.config_param['robot_frame']
     self.world_frame = self.config_param['world_frame']
     #
+    # Optional sections: if missing, as constructed
+    self.state_estim_mode = self.config_param.get('state_estim_mode', 'timer')
+    if(self.state_estim_mode not in ['timer', 'event', 'hybrid']):
+      self.get_logger().info("Unknown state estim mode " + str(self.state_estim_mode) + ". Using 'timer'")
+      self.state_estim_mode = 'timer'
+    #
     self.state_estim_loop_freq = self.config_param['state_estim_loop_freq']
+    #
+    self.state_pred_loop_freq = self.config_param.get('state_pred_loop_freq', 10.0)
+    #
+    self.setPublishParameters(self.config_param.get('publish', {}))
+    #
+    config_param_executor = self.config_param.get('executor', {})
+    self.executor_type = config_param_executor.get('type', 'single_threaded')
+    if(self.executor_type not in ['single_threaded', 'multi_threaded']):
+      self.get_logger().info("Unknown executor type " + str(self.executor_type) + ". Using 'single_threaded'")
+      self.executor_type = 'single_threaded'
+    self.executor_num_threads = config_param_executor.get('num_threads', 2)
+    self.flag_ingestion_thread = config_param_executor.get('flag_ingestion_thread', False)
+    if(self.flag_ingestion_thread and self.state_estim_mode != 'timer'):
+      self.get_logger().info("Ingestion thread only in 'timer' state estim mode. Disabled")
+      self.flag_ingestion_thread = False
+    #
+    self.flag_latency_enabled = self.config_param.get('latency', {}).get('flag_enabled', False)
+    self.latency_diagnostics_freq = self.config_param.get('latency', {}).get('diagnostics_freq', 1.0)
+    #
+    self.flag_gating_enabled = self.config_param['ekf'].get('gating', {}).get('flag_enabled', False)
+    #
+    self.flag_imu_enabled = self.config_param['ekf'].get('imu', {}).get('flag_enabled', False)
     
     #
     self.msf_state_estimator.setConfigParameters(self.config_param['ekf'])
+    # Latency of the measurements, with the additional sources
+    self.setLatencyMeas()
 
     
     # End
@@ -173,14 +375,37 @@ class ArsMsfStateEstimatorRos(Node):
 
   def open(self):
 
+    # Callback groups
+    self.callback_group_ingestion = MutuallyExclusiveCallbackGroup()
+    self.callback_group_estim = MutuallyExclusiveCallbackGroup()
+
+
     # Subscribers
+    if(self.flag_ingestion_thread):
+      self.ingestion_node = rclpy.create_node(self.get_name()+'_ingestion', namespace=self.get_namespace())
+      meas_sub_node = self.ingestion_node
+    else:
+      meas_sub_node = self
 
     # 
-    self.meas_robot_posi_sub = self.create_subscription(PointStamped, 'meas_robot_position', self.measRobotPositionCallback, qos_profile=10)
+    self.meas_robot_posi_sub = meas_sub_node.create_subscription(PointStamped, 'meas_robot_position', self.measRobotPositionCallback, qos_profile=10, callback_group=self.callback_group_ingestion)
     # 
-    self.meas_robot_atti_sub = self.create_subscription(QuaternionStamped, 'meas_robot_attitude', self.measRobotAttitudeCallback, qos_profile=10)
+    self.meas_robot_atti_sub = meas_sub_node.create_subscription(QuaternionStamped, 'meas_robot_attitude', self.measRobotAttitudeCallback, qos_profile=10, callback_group=self.callback_group_ingestion)
     #
-    self.meas_robot_vel_robot_sub = self.create_subscription(TwistStamped, 'meas_robot_velocity_robot', self.measRobotVelRobotCallback, qos_profile=10)
+    self.meas_robot_vel_robot_sub = meas_sub_node.create_subscription(TwistStamped, 'meas_robot_velocity_robot', self.measRobotVelRobotCallback, qos_profile=10, callback_group=self.callback_group_ingestion)
+    #
+    if(self.flag_imu_enabled):
+      self.meas_robot_imu_sub = meas_sub_node.create_subscription(Imu, 'meas_robot_imu', self.measRobotImuCallback, qos_profile=100, callback_group=self.callback_group_ingestion)
+    # Additional sources of measurements: one subscriber each, on its topic
+    meas_source_subs = {
+      'meas_position': (PointStamped, self.measRobotPositionCallback),
+      'meas_attitude': (QuaternionStamped, self.measRobotAttitudeCallback),
+      'meas_velocity': (TwistStamped, self.measRobotVelRobotCallback),
+    }
+    self.meas_sources_sub = []
+    for meas_model in self.msf_state_estimator.getMeasSources():
+      meas_msg_type, meas_callback = meas_source_subs[meas_model.meas_source_type]
+      self.meas_sources_sub.append(meas_sub_node.create_subscription(meas_msg_type, meas_model.meas_source_config['topic'], lambda meas_msg, meas_callback=meas_callback, meas_mask=meas_model.meas_mask: meas_callback(meas_msg, meas_mask), qos_profile=10, callback_group=self.callback_group_ingestion))
     
 
 
@@ -198,15 +423,42 @@ class ArsMsfStateEstimatorRos(Node):
     self.estim_robot_vel_world_pub = self.create_publisher(TwistStamped, 'estim_robot_velocity_world', qos_profile=10)
     #
     self.estim_robot_vel_world_cov_pub = self.create_publisher(TwistWithCovarianceStamped, 'estim_robot_velocity_world_cov', qos_profile=10)
+    #
+    if(self.flag_imu_enabled):
+      self.estim_robot_pose_imu_pub = self.create_publisher(PoseStamped, 'estim_robot_pose_imu', qos_profile=10)
+      self.estim_robot_vel_world_imu_pub = self.create_publisher(TwistStamped, 'estim_robot_velocity_world_imu', qos_profile=10)
+
+
+    # Queries
+    self.estim_robot_state_query_sub = self.create_subscription(Path, 'estim_robot_state_query', self.estimRobotStateQueryCallback, qos_profile=10, callback_group=self.callback_group_estim)
+    self.estim_robot_pose_cov_query_pub = self.create_publisher(PoseWithCovarianceStamped, 'estim_robot_pose_cov_query', qos_profile=100)
+    self.estim_robot_vel_world_cov_query_pub = self.create_publisher(TwistWithCovarianceStamped, 'estim_robot_velocity_world_cov_query', qos_profile=100)
 
 
     # Tf2 broadcasters
     self.tf2_broadcaster = tf2_ros.TransformBroadcaster(self)
 
+    # Messages
+    self.createPublishMsgs()
+
+    # Diagnostics
+    if(self.flag_latency_enabled or self.flag_gating_enabled):
+      self.diagnostics_pub = self.create_publisher(DiagnosticArray, '/diagnostics', qos_profile=10)
+
 
     # Timers
     #
-    self.state_estim_loop_timer = self.create_timer(1.0/self.state_estim_loop_freq, self.stateEstimLoopTimerCallback)
+    if(self.state_estim_mode == 'timer'):
+      self.state_estim_loop_timer = self.create_timer(1.0/self.state_estim_loop_freq, self.stateEstimLoopTimerCallback, callback_group=self.callback_group_estim)
+    #
+    if(self.state_estim_mode == 'hybrid'):
+      self.state_pred_loop_timer = self.create_timer(1.0/self.state_pred_loop_freq, self.statePredLoopTimerCallback, callback_group=self.callback_group_estim)
+    #
+    if(self.flag_latency_enabled):
+      self.latency_diagnostics_timer = self.create_timer(1.0/self.latency_diagnostics_freq, self.latencyDiagnosticsTimerCallback, callback_group=self.callback_group_estim)
+    #
+    if(self.flag_gating_enabled):
+      self.gating_diagnostics_timer = self.create_timer(1.0/self.latency_diagnostics_freq, self.gatingDiagnosticsTimerCallback, callback_group=self.callback_group_estim)
 
 
     # End
@@ -215,15 +467,42 @@ class ArsMsfStateEstimatorRos(Node):
 
   def run(self):
 
-    rclpy.spin(self)
+    # Executor
+    if(self.executor_type == 'multi_threaded'):
+      executor = MultiThreadedExecutor(num_threads=self.executor_num_threads)
+    else:
+      executor = SingleThreadedExecutor()
+    executor.add_node(self)
+
+    # Ingestion thread
+    if(self.flag_ingestion_thread):
+      self.ingestion_executor = SingleThreadedExecutor()
+      self.ingestion_executor.add_node(self.ingestion_node)
+      self.ingestion_thread = threading.Thread(target=self.ingestion_executor.spin, daemon=True)
+      self.ingestion_thread.start()
+
+    try:
+      executor.spin()
+    finally:
+      executor.shutdown()
+      if(self.flag_ingestion_thread):
+        self.ingestion_executor.shutdown()
+        self.ingestion_node.destroy_node()
 
     return
 
 
-  def measRobotPositionCallback(self, robot_position_msg):
+  def measRobotPositionCallback(self, robot_position_msg, meas_mask=ArsMsfStateEstimator.meas_mask_robot_posi):
+
+    # meas_mask: source of the measurement (additional sources)
 
     # Timestamp
-    timestamp = robot_position_msg.header.stamp
+    timestamp = Time.from_msg(robot_position_msg.header.stamp).nanoseconds
+
+    # Latency
+    time_receive = 0
+    if(self.flag_latency_enabled):
+      time_receive = self.latencyMeasReceived(meas_mask, timestamp)
 
     # Position
     robot_posi = np.zeros((3,), dtype=float)
@@ -232,22 +511,28 @@ class ArsMsfStateEstimatorRos(Node):
     robot_posi[2] = robot_position_msg.point.z
 
     #
-    self.msf_state_estimator.setMeasRobotPosition(timestamp, robot_posi)
+    self.msf_state_estimator.setMeas(meas_mask, timestamp, robot_posi, time_receive=time_receive)
 
-    # Predict
-    #self.msf_state_estimator.predict(timestamp)
-
-    # Update
-    #self.msf_state_estimator.update()
+    # Event-driven predict and update
+    # At the timestamp of the measurement, corrected for the latency of the source
+    if(self.state_estim_mode != 'timer'):
+      self.stateEstimEventCallback(timestamp - self.msf_state_estimator.getMeasModel(meas_mask).meas_latency)
 
     #
     return
 
 
-  def measRobotAttitudeCallback(self, robot_attitude_msg):
+  def measRobotAttitudeCallback(self, robot_attitude_msg, meas_mask=ArsMsfStateEstimator.meas_mask_robot_atti):
+
+    # meas_mask: source of the measurement (additional sources)
 
     # Timestamp
-    timestamp = robot_attitude_msg.header.stamp
+    timestamp = Time.from_msg(robot_attitude_msg.header.stamp).nanoseconds
+
+    # Latency
+    time_receive = 0
+    if(self.flag_latency_enabled):
+      time_receive = self.latencyMeasReceived(meas_mask, timestamp)
 
     # Attitude quat simp
     robot_atti_quat = ars_lib_helpers.Quaternion.zerosQuat()
@@ -259,22 +544,28 @@ class ArsMsfStateEstimatorRos(Node):
     robot_atti_quat_simp = ars_lib_helpers.Quaternion.getSimplifiedQuatRobotAtti(robot_atti_quat)
 
     #
-    self.msf_state_estimator.setMeasRobotAttitude(timestamp, robot_atti_quat_simp)
+    self.msf_state_estimator.setMeas(meas_mask, timestamp, robot_atti_quat_simp, time_receive=time_receive)
 
-    # Predict
-    #self.msf_state_estimator.predict(timestamp)
-
-    # Update
-    #self.msf_state_estimator.update()
+    # Event-driven predict and update
+    # At the timestamp of the measurement, corrected for the latency of the source
+    if(self.state_estim_mode != 'timer'):
+      self.stateEstimEventCallback(timestamp - self.msf_state_estimator.getMeasModel(meas_mask).meas_latency)
 
     #
     return
 
 
-  def measRobotVelRobotCallback(self, robot_vel_msg):
+  def measRobotVelRobotCallback(self, robot_vel_msg, meas_mask=ArsMsfStateEstimator.meas_mask_robot_vel_robot):
+
+    # meas_mask: source of the measurement (additional sources)
 
     # Timestamp
-    timestamp = robot_vel_msg.header.stamp
+    timestamp = Time.from_msg(robot_vel_msg.header.stamp).nanoseconds
+
+    # Latency
+    time_receive = 0
+    if(self.flag_latency_enabled):
+      time_receive = self.latencyMeasReceived(meas_mask, timestamp)
 
     # Linear
     lin_vel_robot = np.zeros((3,), dtype=float)
@@ -287,197 +578,652 @@ class ArsMsfStateEstimatorRos(Node):
     ang_vel_robot[0] = robot_vel_msg.twist.angular.z
 
     #
-    self.msf_state_estimator.setMeasRobotVelRobot(timestamp, lin_vel_robot, ang_vel_robot)
+    self.msf_state_estimator.setMeas(meas_mask, timestamp, lin_vel_robot, ang_vel_robot, time_receive=time_receive)
 
-    # Predict
-    #self.msf_state_estimator.predict(timestamp)
-
-    # Update
-    #self.msf_state_estimator.update()
+    # Event-driven predict and update
+    # At the timestamp of the measurement, corrected for the latency of the source
+    if(self.state_estim_mode != 'timer'):
+      self.stateEstimEventCallback(timestamp - self.msf_state_estimator.getMeasModel(meas_mask).meas_latency)
 
     #
     return
 
 
-  def estimRobotPosePublish(self):
+  def measRobotImuCallback(self, robot_imu_msg):
+
+    # Timestamp
+    timestamp = Time.from_msg(robot_imu_msg.header.stamp).nanoseconds
+
+    # Linear acceleration (specific force)
+    lin_acc_robot = np.zeros((3,), dtype=float)
+    lin_acc_robot[0] = robot_imu_msg.linear_acceleration.x
+    lin_acc_robot[1] = robot_imu_msg.linear_acceleration.y
+    lin_acc_robot[2] = robot_imu_msg.linear_acceleration.z
+
+    # Angular velocity (yaw rate)
+    ang_vel_robot = robot_imu_msg.angular_velocity.z
 
     #
-    header_msg = Header()
-    header_msg.stamp = self.msf_state_estimator.estim_state_timestamp.to_msg()
-    header_msg.frame_id = self.world_frame
+    if(not self.msf_state_estimator.setMeasImu(timestamp, lin_acc_robot, ang_vel_robot)):
+      return
+
+    # High-rate outputs
+    self.estimRobotStateImuPublish()
 
     #
-    robot_pose_msg = Pose()
+    return
+
+
+  def createPublishMsgs(self):
+
+    # Messages of the outputs, built once and filled in place at each
+    # publication (publish() serialises them before returning).
+    # Shared sub-messages: one stamp and one header per frame, one pose
+    # and one twist per frame for the messages with and without
+    # covariance
+
+    # Headers
+    self.estim_header_world_msg = Header()
+    self.estim_header_world_msg.frame_id = self.world_frame
+    self.estim_header_robot_msg = Header()
+    self.estim_header_robot_msg.frame_id = self.robot_frame
+
+    # Pose
+    self.estim_robot_pose_msg = Pose()
+    self.estim_robot_pose_msg.orientation.x = 0.0
+    self.estim_robot_pose_msg.orientation.y = 0.0
     #
-    robot_pose_msg.position.x = self.msf_state_estimator.estim_robot_posi[0]
-    robot_pose_msg.position.y = self.msf_state_estimator.estim_robot_posi[1]
-    robot_pose_msg.position.z = self.msf_state_estimator.estim_robot_posi[2]
+    self.estim_robot_pose_stamped_msg = PoseStamped()
+    self.estim_robot_pose_stamped_msg.header = self.estim_header_world_msg
+    self.estim_robot_pose_stamped_msg.pose = self.estim_robot_pose_msg
     #
-    robot_pose_msg.orientation.w = self.msf_state_estimator.estim_robot_atti_quat_simp[0]
-    robot_pose_msg.orientation.x = 0.0
-    robot_pose_msg.orientation.y = 0.0
-    robot_pose_msg.orientation.z = self.msf_state_estimator.estim_robot_atti_quat_simp[1]
+    self.estim_robot_pose_covariance = np.zeros((36,), dtype=float)
+    self.estim_robot_pose_cov_stamped_msg = PoseWithCovarianceStamped()
+    self.estim_robot_pose_cov_stamped_msg.header = self.estim_header_world_msg
+    self.estim_robot_pose_cov_stamped_msg.pose.pose = self.estim_robot_pose_msg
+    self.estim_robot_pose_cov_stamped_msg.pose.covariance = self.estim_robot_pose_covariance
 
+    # Tf2
+    self.estim_robot_pose_tf2_msg = geometry_msgs.msg.TransformStamped()
+    self.estim_robot_pose_tf2_msg.header = self.estim_header_world_msg
+    self.estim_robot_pose_tf2_msg.child_frame_id = self.robot_frame
+    self.estim_robot_pose_tf2_msg.transform.rotation.x = 0.0
+    self.estim_robot_pose_tf2_msg.transform.rotation.y = 0.0
+
+    # Velocity wrt world
+    self.estim_robot_vel_world_msg = Twist()
+    self.estim_robot_vel_world_msg.angular.x = 0.0
+    self.estim_robot_vel_world_msg.angular.y = 0.0
     #
-    # Covariance
-    covariance_pose = np.zeros((6,6), dtype=float)
-    # Position - Position
-    covariance_pose[0:3, 0:3] = self.msf_state_estimator.estim_state_cov[0:3, 0:3]
-    # Position - Attitude
-    covariance_pose[0:3, 5] = self.msf_state_estimator.estim_state_cov[0:3, 3]
-    # Attitude - Attitude
-    covariance_pose[5, 5] = self.msf_state_estimator.estim_state_cov[3, 3]
-    # Attitude - Position
-    covariance_pose[5, 0:3] = self.msf_state_estimator.estim_state_cov[3, 0:3]
-
+    self.estim_robot_vel_world_stamped_msg = TwistStamped()
+    self.estim_robot_vel_world_stamped_msg.header = self.estim_header_world_msg
+    self.estim_robot_vel_world_stamped_msg.twist = self.estim_robot_vel_world_msg
+    #
+    self.estim_robot_vel_world_cov_stamped_msg = TwistWithCovarianceStamped()
+    self.estim_robot_vel_world_cov_stamped_msg.header = self.estim_header_world_msg
+    self.estim_robot_vel_world_cov_stamped_msg.twist.twist = self.estim_robot_vel_world_msg
+    self.estim_robot_vel_world_covariance = np.zeros((36,), dtype=float)
+    self.estim_robot_vel_world_cov_stamped_msg.twist.covariance = self.estim_robot_vel_world_covariance
+
+    # Velocity wrt robot
+    self.estim_robot_vel_robot_msg = Twist()
+    self.estim_robot_vel_robot_msg.angular.x = 0.0
+    self.estim_robot_vel_robot_msg.angular.y = 0.0
     #
-    robot_pose_stamped_msg = PoseStamped()
+    self.estim_robot_vel_robot_stamped_msg = TwistStamped()
+    self.estim_robot_vel_robot_stamped_msg.header = self.estim_header_robot_msg
+    self.estim_robot_vel_robot_stamped_msg.twist = self.estim_robot_vel_robot_msg
     #
-    robot_pose_stamped_msg.header = header_msg
-    robot_pose_stamped_msg.pose = robot_pose_msg
+    self.estim_robot_vel_robot_cov_stamped_msg = TwistWithCovarianceStamped()
+    self.estim_robot_vel_robot_cov_stamped_msg.header = self.estim_header_robot_msg
+    self.estim_robot_vel_robot_cov_stamped_msg.twist.twist = self.estim_robot_vel_robot_msg
+    self.estim_robot_vel_robot_covariance = np.zeros((36,), dtype=float)
+    self.estim_robot_vel_robot_cov_stamped_msg.twist.covariance = self.estim_robot_vel_robot_covariance
+    # Outputs at the rate of the IMU
+    self.estim_robot_pose_imu_stamped_msg = PoseStamped()
+    self.estim_robot_pose_imu_stamped_msg.header.frame_id = self.world_frame
+    self.estim_robot_pose_imu_stamped_msg.pose.orientation.x = 0.0
+    self.estim_robot_pose_imu_stamped_msg.pose.orientation.y = 0.0
+    #
+    self.estim_robot_vel_world_imu_stamped_msg = TwistStamped()
+    self.estim_robot_vel_world_imu_stamped_msg.header.frame_id = self.world_frame
+    self.estim_robot_vel_world_imu_stamped_msg.twist.angular.x = 0.0
+    self.estim_robot_vel_world_imu_stamped_msg.twist.angular.y = 0.0
+
+    # v_robot = R(yaw)^T * v_world, w_robot = w_world
+    self.jac_vel_robot = np.zeros((4,5), dtype=float)
+    self.jac_vel_robot[2, 3] = 1.0
+    self.jac_vel_robot[3, 4] = 1.0
 
     #
-    robot_pose_cov_stamped_msg = PoseWithCovarianceStamped()
+    self.lock_publish = threading.Lock()
+
+    return
+
+
+  def estimRobotPosePublish(self, estim_state_snapshot):
+
+    # Outputs due
+    flag_publish_pose = self.isPublishDue('estim_robot_pose', estim_state_snapshot.timestamp, self.estim_robot_pose_pub)
+    flag_publish_pose_cov = self.isPublishDue('estim_robot_pose_cov', estim_state_snapshot.timestamp, self.estim_robot_pose_cov_pub)
+    flag_publish_tf = self.flag_tf_enabled and self.isPublishDue('tf', estim_state_snapshot.timestamp)
+
+    if(not (flag_publish_pose or flag_publish_pose_cov or flag_publish_tf)):
+      return
+
     #
-    robot_pose_cov_stamped_msg.header = header_msg
-    robot_pose_cov_stamped_msg.pose.pose = robot_pose_msg
-    robot_pose_cov_stamped_msg.pose.covariance = covariance_pose.reshape((36,))
-  
+    estim_robot_posi = estim_state_snapshot.robot_posi.tolist()
+    estim_robot_atti_quat_simp = estim_state_snapshot.robot_atti_quat_simp.tolist()
+
     #
-    self.estim_robot_pose_pub.publish(robot_pose_stamped_msg)
-    # 
-    self.estim_robot_pose_cov_pub.publish(robot_pose_cov_stamped_msg)
+    if(flag_publish_pose or flag_publish_pose_cov):
+      #
+      robot_pose_msg = self.estim_robot_pose_msg
+      robot_pose_msg.position.x = estim_robot_posi[0]
+      robot_pose_msg.position.y = estim_robot_posi[1]
+      robot_pose_msg.position.z = estim_robot_posi[2]
+      #
+      robot_pose_msg.orientation.w = estim_robot_atti_quat_simp[0]
+      robot_pose_msg.orientation.z = estim_robot_atti_quat_simp[1]
+
+      #
+      if(flag_publish_pose):
+        self.estim_robot_pose_pub.publish(self.estim_robot_pose_stamped_msg)
+
+      #
+      if(flag_publish_pose_cov):
+        # Covariance: position and attitude (yaw) blocks of the state
+        # covariance, in place
+        self.estim_robot_pose_covariance[self.covariance_pose_idx] = estim_state_snapshot.state_cov.ravel()[self.covariance_pose_state_idx]
+        #
+        self.estim_robot_pose_cov_pub.publish(self.estim_robot_pose_cov_stamped_msg)
 
 
     # Tf2
-    estim_robot_pose_tf2_msg = geometry_msgs.msg.TransformStamped()
-
-    estim_robot_pose_tf2_msg.header.stamp = self.msf_state_estimator.estim_state_timestamp.to_msg()
-    estim_robot_pose_tf2_msg.header.frame_id = self.world_frame
-    estim_robot_pose_tf2_msg.child_frame_id = self.robot_frame
+    if(flag_publish_tf):
+      estim_robot_pose_tf2_msg = self.estim_robot_pose_tf2_msg
 
-    estim_robot_pose_tf2_msg.transform.translation.x = self.msf_state_estimator.estim_robot_posi[0]
-    estim_robot_pose_tf2_msg.transform.translation.y = self.msf_state_estimator.estim_robot_posi[1]
-    estim_robot_pose_tf2_msg.transform.translation.z = self.msf_state_estimator.estim_robot_posi[2]
+      estim_robot_pose_tf2_msg.transform.translation.x = estim_robot_posi[0]
+      estim_robot_pose_tf2_msg.transform.translation.y = estim_robot_posi[1]
+      estim_robot_pose_tf2_msg.transform.translation.z = estim_robot_posi[2]
 
-    estim_robot_pose_tf2_msg.transform.rotation.w = self.msf_state_estimator.estim_robot_atti_quat_simp[0]
-    estim_robot_pose_tf2_msg.transform.rotation.x = 0.0
-    estim_robot_pose_tf2_msg.transform.rotation.y = 0.0
-    estim_robot_pose_tf2_msg.transform.rotation.z = self.msf_state_estimator.estim_robot_atti_quat_simp[1]
+      estim_robot_pose_tf2_msg.transform.rotation.w = estim_robot_atti_quat_simp[0]
+      estim_robot_pose_tf2_msg.transform.rotation.z = estim_robot_atti_quat_simp[1]
 
-    # Broadcast
-    self.tf2_broadcaster.sendTransform(estim_robot_pose_tf2_msg)
+      # Broadcast
+      self.tf2_broadcaster.sendTransform(estim_robot_pose_tf2_msg)
 
 
     # End
     return
 
 
-  def estimRobotVelocityPublish(self):
+  def estimRobotVelocityPublish(self, estim_state_snapshot):
+
+    # Outputs due
+    flag_publish_vel_world = self.isPublishDue('estim_robot_velocity_world', estim_state_snapshot.timestamp, self.estim_robot_vel_world_pub)
+    flag_publish_vel_world_cov = self.isPublishDue('estim_robot_velocity_world_cov', estim_state_snapshot.timestamp, self.estim_robot_vel_world_cov_pub)
+    flag_publish_vel_robot = self.isPublishDue('estim_robot_velocity_robot', estim_state_snapshot.timestamp, self.estim_robot_vel_robot_pub)
+    flag_publish_vel_robot_cov = self.isPublishDue('estim_robot_velocity_robot_cov', estim_state_snapshot.timestamp, self.estim_robot_vel_robot_cov_pub)
 
     #
     # Robot Velocity Wrt world
+    if(flag_publish_vel_world or flag_publish_vel_world_cov):
+
+      # Twist
+      estim_robot_velo_lin_world = estim_state_snapshot.robot_velo_lin_world.tolist()
+      robot_velocity_world_msg = self.estim_robot_vel_world_msg
+      #
+      robot_velocity_world_msg.linear.x = estim_robot_velo_lin_world[0]
+      robot_velocity_world_msg.linear.y = estim_robot_velo_lin_world[1]
+      robot_velocity_world_msg.linear.z = estim_robot_velo_lin_world[2]
+      #
+      robot_velocity_world_msg.angular.z = float(estim_state_snapshot.robot_velo_ang_world[0])
+
+      # TwistStamped
+      if(flag_publish_vel_world):
+        self.estim_robot_vel_world_pub.publish(self.estim_robot_vel_world_stamped_msg)
+
+      # TwistWithCovarianceStamped
+      if(flag_publish_vel_world_cov):
+        # Covariance: velocity blocks of the state covariance, in place
+        self.estim_robot_vel_world_covariance[self.covariance_twist_idx] = estim_state_snapshot.state_cov.ravel()[self.covariance_twist_state_idx]
+        #
+        self.estim_robot_vel_world_cov_pub.publish(self.estim_robot_vel_world_cov_stamped_msg)
 
-    # Header
-    header_wrt_world_msg = Header()
-    header_wrt_world_msg.stamp = self.msf_state_estimator.estim_state_timestamp.to_msg()
-    header_wrt_world_msg.frame_id = self.world_frame
 
-    # Twist
-    robot_velocity_world_msg = Twist()
     #
-    robot_velocity_world_msg.linear.x = self.msf_state_estimator.estim_robot_velo_lin_world[0]
-    robot_velocity_world_msg.linear.y = self.msf_state_estimator.estim_robot_velo_lin_world[1]
-    robot_velocity_world_msg.linear.z = self.msf_state_estimator.estim_robot_velo_lin_world[2]
+    # Robot velocity wrt robot
+    if(flag_publish_vel_robot or flag_publish_vel_robot_cov):
+
+      # computation estim robot velocity robot
+      # v_robot = R(yaw)^T * v_world, with the rotation of the snapshot
+      # Yaw only: the angular velocity is the same in both frames
+      cos_robot_atti_ang = estim_state_snapshot.cos_robot_atti_ang
+      sin_robot_atti_ang = estim_state_snapshot.sin_robot_atti_ang
+      estim_robot_velo_lin_world = estim_state_snapshot.robot_velo_lin_world.tolist()
+      estim_robot_vel_lin_robot = [
+        cos_robot_atti_ang*estim_robot_velo_lin_world[0] + sin_robot_atti_ang*estim_robot_velo_lin_world[1],
+        -sin_robot_atti_ang*estim_robot_velo_lin_world[0] + cos_robot_atti_ang*estim_robot_velo_lin_world[1],
+        estim_robot_velo_lin_world[2] ]
+
+      # Twist
+      robot_velocity_robot_msg = self.estim_robot_vel_robot_msg
+      #
+      robot_velocity_robot_msg.linear.x = estim_robot_vel_lin_robot[0]
+      robot_velocity_robot_msg.linear.y = estim_robot_vel_lin_robot[1]
+      robot_velocity_robot_msg.linear.z = estim_robot_vel_lin_robot[2]
+      #
+      robot_velocity_robot_msg.angular.z = float(estim_state_snapshot.robot_velo_ang_world[0])
+
+      # TwistStamped
+      if(flag_publish_vel_robot):
+        self.estim_robot_vel_robot_pub.publish(self.estim_robot_vel_robot_stamped_msg)
+
+      # TwistWithCovarianceStamped
+      if(flag_publish_vel_robot_cov):
+        # Covariance: first-order propagation of the attitude and velocity
+        # blocks of the state covariance, in place
+        # d v_robot / d yaw = [v_robot_y, -v_robot_x, 0]
+        # d v_robot / d v_world = R(yaw)^T
+        jac_vel_robot = self.jac_vel_robot
+        jac_vel_robot[0, 0:3] = [estim_robot_vel_lin_robot[1], cos_robot_atti_ang, sin_robot_atti_ang]
+        jac_vel_robot[1, 0:3] = [-estim_robot_vel_lin_robot[0], -sin_robot_atti_ang, cos_robot_atti_ang]
+        covariance_vel_robot = np.matmul(np.matmul(jac_vel_robot, estim_state_snapshot.state_cov[3:8, 3:8]), jac_vel_robot.T)
+        self.estim_robot_vel_robot_covariance[self.covariance_twist_idx] = covariance_vel_robot.ravel()
+        #
+        self.estim_robot_vel_robot_cov_pub.publish(self.estim_robot_vel_robot_cov_stamped_msg)
+
+    # End
+    return
+
+
+  def estimRobotStateImuPublish(self):
+
+    # Pose and velocity wrt world propagated to the last IMU sample, only
+    # when subscribed
+    flag_publish_pose = self.estim_robot_pose_imu_pub.get_subscription_count() > 0
+    flag_publish_vel_world = self.estim_robot_vel_world_imu_pub.get_subscription_count() > 0
+
+    if(not (flag_publish_pose or flag_publish_vel_world)):
+      return
+
     #
-    robot_velocity_world_msg.angular.x = 0.0
-    robot_velocity_world_msg.angular.y = 0.0
-    robot_velocity_world_msg.angular.z = self.msf_state_estimator.estim_robot_velo_ang_world[0]
-    
-    # TwistStamped
-    robot_velocity_world_stamp_msg = TwistStamped()
-    robot_velocity_world_stamp_msg.header = header_wrt_world_msg
-    robot_velocity_world_stamp_msg.twist = robot_velocity_world_msg
+    estim_state_snapshot = self.msf_state_estimator.getStateSnapshotImu()
+    if(not estim_state_snapshot.timestamp):
+      return
 
-    # TwistWithCovarianceStamped
-    # TODO JL Cov
-    robot_velocity_world_cov_stamp_msg = TwistWithCovarianceStamped()
-    robot_velocity_world_cov_stamp_msg.header = header_wrt_world_msg
-    robot_velocity_world_cov_stamp_msg.twist.twist = robot_velocity_world_msg
-    # robot_velocity_world_cov_stamp_msg.twist.covariance
+    estim_state_stamp_msg = Time(nanoseconds=estim_state_snapshot.timestamp).to_msg()
 
+    #
+    if(flag_publish_pose):
+      estim_robot_posi = estim_state_snapshot.robot_posi.tolist()
+      estim_robot_atti_quat_simp = estim_state_snapshot.robot_atti_quat_simp.tolist()
+      #
+      robot_pose_stamped_msg = self.estim_robot_pose_imu_stamped_msg
+      robot_pose_stamped_msg.header.stamp = estim_state_stamp_msg
+      robot_pose_stamped_msg.pose.position.x = estim_robot_posi[0]
+      robot_pose_stamped_msg.pose.position.y = estim_robot_posi[1]
+      robot_pose_stamped_msg.pose.position.z = estim_robot_posi[2]
+      robot_pose_stamped_msg.pose.orientation.w = estim_robot_atti_quat_simp[0]
+      robot_pose_stamped_msg.pose.orientation.z = estim_robot_atti_quat_simp[1]
+      #
+      self.estim_robot_pose_imu_pub.publish(robot_pose_stamped_msg)
 
     #
-    # Robot velocity wrt robot
+    if(flag_publish_vel_world):
+      estim_robot_velo_lin_world = estim_state_snapshot.robot_velo_lin_world.tolist()
+      #
+      robot_velocity_world_stamped_msg = self.estim_robot_vel_world_imu_stamped_msg
+      robot_velocity_world_stamped_msg.header.stamp = estim_state_stamp_msg
+      robot_velocity_world_stamped_msg.twist.linear.x = estim_robot_velo_lin_world[0]
+      robot_velocity_world_stamped_msg.twist.linear.y = estim_robot_velo_lin_world[1]
+      robot_velocity_world_stamped_msg.twist.linear.z = estim_robot_velo_lin_world[2]
+      robot_velocity_world_stamped_msg.twist.angular.z = float(estim_state_snapshot.robot_velo_ang_world[0])
+      #
+      self.estim_robot_vel_world_imu_pub.publish(robot_velocity_world_stamped_msg)
+
+    # End
+    return
 
-    # computation estim robot velocity robot
-    estim_robot_vel_lin_robot = ars_lib_helpers.Conversions.convertVelLinFromWorldToRobot(self.msf_state_estimator.estim_robot_velo_lin_world, self.msf_state_estimator.estim_robot_atti_quat_simp, flag_quat_simp=True)
-    estim_robot_vel_ang_robot = ars_lib_helpers.Conversions.convertVelAngFromWorldToRobot(self.msf_state_estimator.estim_robot_velo_ang_world, self.msf_state_estimator.estim_robot_atti_quat_simp, flag_quat_simp=True)
 
-    # Header
-    header_wrt_robot_msg = Header()
-    header_wrt_robot_msg.stamp = self.msf_state_estimator.estim_state_timestamp.to_msg()
-    header_wrt_robot_msg.frame_id = self.robot_frame
+  def estimRobotStateQueryCallback(self, state_query_msg):
+
+    # Timestamps of the query
+    if(state_query_msg.poses):
+      timestamps = np.array([Time.from_msg(pose_stamped_msg.header.stamp).nanoseconds for pose_stamped_msg in state_query_msg.poses], dtype=np.int64)
+    else:
+      timestamps = np.array([Time.from_msg(state_query_msg.header.stamp).nanoseconds], dtype=np.int64)
+
+    # All at once
+    state, state_cov, flag_valid = self.msf_state_estimator.getStateAtTimestamp(timestamps)
+
+    if(not flag_valid.all()):
+      self.get_logger().info("State query: " + str(int(np.count_nonzero(~flag_valid))) + " timestamps out of the history and of the extrapolation horizon")
+
+    # One reply per timestamp answered. New messages: the replies are
+    # queued by the publishers
+    for idx_query in np.flatnonzero(flag_valid).tolist():
+      state_i = state[idx_query].tolist()
+      state_cov_i = state_cov[idx_query].ravel()
+      header_msg = Header()
+      header_msg.stamp = Time(nanoseconds=int(timestamps[idx_query])).to_msg()
+      header_msg.frame_id = self.world_frame
+
+      #
+      robot_pose_cov_msg = PoseWithCovarianceStamped()
+      robot_pose_cov_msg.header = header_msg
+      robot_pose_cov_msg.pose.pose.position.x = state_i[0]
+      robot_pose_cov_msg.pose.pose.position.y = state_i[1]
+      robot_pose_cov_msg.pose.pose.position.z = state_i[2]
+      robot_pose_cov_msg.pose.pose.orientation.w = state_i[3]
+      robot_pose_cov_msg.pose.pose.orientation.x = 0.0
+      robot_pose_cov_msg.pose.pose.orientation.y = 0.0
+      robot_pose_cov_msg.pose.pose.orientation.z = state_i[4]
+      robot_pose_covariance = np.zeros((36,), dtype=float)
+      robot_pose_covariance[self.covariance_pose_idx] = state_cov_i[self.covariance_pose_state_idx]
+      robot_pose_cov_msg.pose.covariance = robot_pose_covariance
+      #
+      self.estim_robot_pose_cov_query_pub.publish(robot_pose_cov_msg)
+
+      #
+      robot_vel_world_cov_msg = TwistWithCovarianceStamped()
+      robot_vel_world_cov_msg.header = header_msg
+      robot_vel_world_cov_msg.twist.twist.linear.x = state_i[5]
+      robot_vel_world_cov_msg.twist.twist.linear.y = state_i[6]
+      robot_vel_world_cov_msg.twist.twist.linear.z = state_i[7]
+      robot_vel_world_cov_msg.twist.twist.angular.x = 0.0
+      robot_vel_world_cov_msg.twist.twist.angular.y = 0.0
+      robot_vel_world_cov_msg.twist.twist.angular.z = state_i[8]
+      robot_vel_world_covariance = np.zeros((36,), dtype=float)
+      robot_vel_world_covariance[self.covariance_twist_idx] = state_cov_i[self.covariance_twist_state_idx]
+      robot_vel_world_cov_msg.twist.covariance = robot_vel_world_covariance
+      #
+      self.estim_robot_vel_world_cov_query_pub.publish(robot_vel_world_cov_msg)
+
+    return
+
+
+  def isAnyPublishDue(self, timestamp):
+
+    # True if any output is due at the timestamp [ns], as isPublishDue(),
+    # without advancing the schedules.
+    # The subscribers are checked first: no output subscribed is the
+    # common idle case
+
+    if(self.flag_tf_enabled and self.isPublishDue('tf', timestamp, flag_peek=True)):
+      return True
+
+    for output_name, publisher in (
+        ('estim_robot_pose', self.estim_robot_pose_pub),
+        ('estim_robot_pose_cov', self.estim_robot_pose_cov_pub),
+        ('estim_robot_velocity_robot', self.estim_robot_vel_robot_pub),
+        ('estim_robot_velocity_robot_cov', self.estim_robot_vel_robot_cov_pub),
+        ('estim_robot_velocity_world', self.estim_robot_vel_world_pub),
+        ('estim_robot_velocity_world_cov', self.estim_robot_vel_world_cov_pub),
+        ):
+      if(publisher.get_subscription_count() and self.isPublishDue(output_name, timestamp, flag_peek=True)):
+        return True
+
+    return False
+
+
+  def isPublishDue(self, output_name, timestamp, publisher=None, flag_peek=False):
+
+    # True if the output is due at the timestamp [ns] and, if a publisher
+    # is given, has subscribers.
+    # Rate 0: every call. Otherwise, the publications follow a fixed
+    # schedule, one period apart; a publication up to a quarter of a
+    # period early is accepted, to absorb the jitter of the loop timer.
+    # flag_peek: the schedule is not advanced
+    publish_period = self.publish_periods[output_name]
+    if(publish_period):
+      publish_timestamp_next = self.publish_timestamp_next[output_name]
+      if(4*(publish_timestamp_next - timestamp) > publish_period):
+        return False
+      if(not flag_peek):
+        publish_timestamp_next += publish_period
+        if(publish_timestamp_next <= timestamp):
+          # Behind the schedule: restarted
+          publish_timestamp_next = timestamp + publish_period
+        self.publish_timestamp_next[output_name] = publish_timestamp_next
+
+    if(publisher is not None and publisher.get_subscription_count() == 0):
+      return False
+
+    return True
+
+
+  def setPublishParameters(self, config_param_publish):
+
+    # Periods [ns] of the outputs (0: every state estimation step)
+    # Optional entries: every step, TF enabled
+    self.publish_periods = {output_name: 0 for output_name in self.publish_output_names}
+    for output_name, publish_rate in config_param_publish.get('rates', {}).items():
+      self.publish_periods[output_name] = int(round(1e9/publish_rate)) if publish_rate > 0.0 else 0
+    self.flag_tf_enabled = config_param_publish.get('tf', {}).get('flag_enabled', True)
+    publish_rate = config_param_publish.get('tf', {}).get('rate', 0.0)
+    self.publish_periods['tf'] = int(round(1e9/publish_rate)) if publish_rate > 0.0 else 0
 
-    # Twist
-    robot_velocity_robot_msg = Twist()
     #
-    robot_velocity_robot_msg.linear.x = estim_robot_vel_lin_robot[0]
-    robot_velocity_robot_msg.linear.y = estim_robot_vel_lin_robot[1]
-    robot_velocity_robot_msg.linear.z = estim_robot_vel_lin_robot[2]
+    self.publish_timestamp_next = {output_name: 0 for output_name in self.publish_periods}
+
+    return
+
+
+  def stateEstimPredict(self, timestamp):
+
+    if(not self.flag_latency_enabled):
+      self.msf_state_estimator.predict(timestamp)
+      return
+
+    time_start = time.perf_counter_ns()
+    self.msf_state_estimator.predict(timestamp)
+    self.latency.addSample('compute_predict', time.perf_counter_ns()-time_start)
+
+    return
+
+
+  def stateEstimUpdate(self):
+
+    if(not self.flag_latency_enabled):
+      self.msf_state_estimator.update()
+      return
+
+    time_update = self.get_clock().now().nanoseconds
+
+    time_start = time.perf_counter_ns()
+    self.msf_state_estimator.update()
+    self.latency.addSample('compute_update', time.perf_counter_ns()-time_start)
+
+    # Queue delay of each sample consumed
+    for meas_mask, meas_time_receive in self.msf_state_estimator.meas_time_receive_last_update.items():
+      meas_name = self.msf_state_estimator.getMeasModel(meas_mask).meas_name
+      for time_receive in meas_time_receive:
+        self.latency.addSample('queue_delay_'+meas_name, time_update-time_receive)
+
+    return
+
+
+  def stateEstimPublish(self):
+
+    # Lazy prediction: the state is only propagated if an output is due
+    if(self.msf_state_estimator.flag_lazy_predict and not self.isAnyPublishDue(self.msf_state_estimator.getStateTimestamp())):
+      return
+
+    if(self.flag_latency_enabled):
+      time_start = time.perf_counter_ns()
+
+    # Same snapshot for all the outputs
+    estim_state_snapshot = self.msf_state_estimator.getStateSnapshot()
+
+    # The messages are shared: one publication at a time
+    self.lock_publish.acquire()
+
+    # Stamp, converted once for all the outputs
+    estim_state_stamp_msg = Time(nanoseconds=estim_state_snapshot.timestamp).to_msg()
+    self.estim_header_world_msg.stamp = estim_state_stamp_msg
+    self.estim_header_robot_msg.stamp = estim_state_stamp_msg
+
     #
-    robot_velocity_robot_msg.angular.x = 0.0
-    robot_velocity_robot_msg.angular.y = 0.0
-    robot_velocity_robot_msg.angular.z = estim_robot_vel_ang_robot[0]
+    self.estimRobotPosePublish(estim_state_snapshot)
+    self.estimRobotVelocityPublish(estim_state_snapshot)
+
+    self.lock_publish.release()
+
+    if(self.flag_latency_enabled):
+      self.latency.addSample('compute_publish', time.perf_counter_ns()-time_start)
+
+    return
 
-    # TwistStamped
-    robot_velocity_robot_stamp_msg = TwistStamped()
-    robot_velocity_robot_stamp_msg.header = header_wrt_robot_msg
-    robot_velocity_robot_stamp_msg.twist = robot_velocity_robot_msg
 
-    # TwistWithCovarianceStamped
-    # TODO JL Cov
-    robot_velocity_robot_cov_stamp_msg = TwistWithCovarianceStamped()
-    robot_velocity_robot_cov_stamp_msg.header = header_wrt_robot_msg
-    robot_velocity_robot_cov_stamp_msg.twist.twist = robot_velocity_robot_msg
-    # robot_velocity_robot_cov_stamp_msg.twist.covariance
+  def stateEstimEventCallback(self, timestamp):
+
+    # Predict to the timestamp of the measurement
+    self.stateEstimPredict(timestamp)
+
+    # Update
+    self.stateEstimUpdate()
 
 
     # Publish
-    #
-    self.estim_robot_vel_world_pub.publish(robot_velocity_world_stamp_msg)
-    # 
-    self.estim_robot_vel_world_cov_pub.publish(robot_velocity_world_cov_stamp_msg)
+    self.stateEstimPublish()
 
-    #
-    self.estim_robot_vel_robot_pub.publish(robot_velocity_robot_stamp_msg)
-    # 
-    self.estim_robot_vel_robot_cov_pub.publish(robot_velocity_robot_cov_stamp_msg)
 
     # End
     return
 
-    
+
+  def statePredLoopTimerCallback(self):
+
+    # Jitter of the loop timer
+    if(self.flag_latency_enabled):
+      self.latency.addTimerTick(time.monotonic_ns(), int(1e9/self.state_pred_loop_freq))
+
+    # Get time [ns]
+    time_stamp_current = self.get_clock().now().nanoseconds
+
+    # Predict
+    self.stateEstimPredict(time_stamp_current)
+
+
+    # Publish
+    self.stateEstimPublish()
+
+
+    # End
+    return
+
+
   def stateEstimLoopTimerCallback(self):
 
-    # Get time
-    time_stamp_current = self.get_clock().now()
+    # Jitter of the loop timer
+    if(self.flag_latency_enabled):
+      self.latency.addTimerTick(time.monotonic_ns(), int(1e9/self.state_estim_loop_freq))
+
+    # Get time [ns]
+    time_stamp_current = self.get_clock().now().nanoseconds
 
     # Predict
-    self.msf_state_estimator.predict(time_stamp_current)
+    self.stateEstimPredict(time_stamp_current)
 
     # Update
-    self.msf_state_estimator.update()
+    self.stateEstimUpdate()
 
 
     # Publish
-    #
-    self.estimRobotPosePublish()
-    #
-    self.estimRobotVelocityPublish()
+    self.stateEstimPublish()
 
      
     # End
     return
 
-  
\ No newline at end of file
+
+  def setLatencyMeas(self):
+
+    # Histograms of the latencies of the registered measurements
+
+    meas_models = self.msf_state_estimator.meas_models
+
+    self.latency = ArsMsfStateEstimatorLatency([meas_model.meas_name for meas_model in meas_models])
+
+    return
+
+
+  def latencyMeasReceived(self, meas_mask, timestamp):
+
+    # Returns the time of reception [ns], kept with the sample in its queue
+
+    time_receive = self.get_clock().now().nanoseconds
+
+    self.latency.addSample('receive_delay_'+self.msf_state_estimator.getMeasModel(meas_mask).meas_name, time_receive-timestamp)
+
+    return time_receive
+
+
+  def latencyDiagnosticsTimerCallback(self):
+
+    # Summaries of the latencies since the last publication
+    latency_summary = self.latency.getSummary(flag_reset=True)
+
+    #
+    diagnostic_status_msg = DiagnosticStatus()
+    diagnostic_status_msg.level = DiagnosticStatus.OK
+    diagnostic_status_msg.name = self.get_fully_qualified_name() + ': latency'
+    diagnostic_status_msg.message = 'Latencies [us] since the last report'
+    diagnostic_status_msg.values = []
+    for latency_name, latency_name_summary in latency_summary.items():
+      for summary_key, summary_value in latency_name_summary.items():
+        key_value_msg = KeyValue()
+        key_value_msg.key = latency_name + '.' + summary_key
+        key_value_msg.value = '{:.1f}'.format(summary_value) if isinstance(summary_value, float) else str(summary_value)
+        diagnostic_status_msg.values.append(key_value_msg)
+
+    # Samples dropped by the queues of measurements (total)
+    for meas_mask, num_meas_dropped in self.msf_state_estimator.getNumMeasDropped().items():
+      key_value_msg = KeyValue()
+      key_value_msg.key = 'meas_queue_dropped_' + self.msf_state_estimator.getMeasModel(meas_mask).meas_name
+      key_value_msg.value = str(num_meas_dropped)
+      diagnostic_status_msg.values.append(key_value_msg)
+
+    # Samples skipped by the rate of the sources (total)
+    for meas_mask, num_meas_skipped in self.msf_state_estimator.getNumMeasSkipped().items():
+      key_value_msg = KeyValue()
+      key_value_msg.key = 'meas_queue_skipped_' + self.msf_state_estimator.getMeasModel(meas_mask).meas_name
+      key_value_msg.value = str(num_meas_skipped)
+      diagnostic_status_msg.values.append(key_value_msg)
+
+    #
+    diagnostic_array_msg = DiagnosticArray()
+    diagnostic_array_msg.header.stamp = self.get_clock().now().to_msg()
+    diagnostic_array_msg.status = [diagnostic_status_msg]
+
+    #
+    self.diagnostics_pub.publish(diagnostic_array_msg)
+
+    return
+
+
+  def gatingDiagnosticsTimerCallback(self):
+
+    #
+    diagnostic_status_msg = DiagnosticStatus()
+    diagnostic_status_msg.level = DiagnosticStatus.OK
+    diagnostic_status_msg.name = self.get_fully_qualified_name() + ': gating'
+    diagnostic_status_msg.message = 'Measurements rejected by the gating (total)'
+    diagnostic_status_msg.values = []
+    for meas_mask, num_meas_rejected in self.msf_state_estimator.getNumMeasRejected().items():
+      key_value_msg = KeyValue()
+      key_value_msg.key = 'gating_rejected_' + self.msf_state_estimator.getMeasModel(meas_mask).meas_name
+      key_value_msg.value = str(num_meas_rejected)
+      diagnostic_status_msg.values.append(key_value_msg)
+
+    #
+    diagnostic_array_msg = DiagnosticArray()
+    diagnostic_array_msg.header.stamp = self.get_clock().now().to_msg()
+    diagnostic_array_msg.status = [diagnostic_status_msg]
+
+    #
+    self.diagnostics_pub.publish(diagnostic_array_msg)
+
+    return
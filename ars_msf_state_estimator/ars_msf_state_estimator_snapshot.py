@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+
+
+class ArsMsfStateEstimatorSnapshot:
+
+  #######
+
+  # Immutable copy of the estimated state, published by the filter.
+  # The arrays are read-only: a new snapshot is built after each filter
+  # step and replaces the previous one by a single reference swap.
+  # Readers (publishers, queries) keep a consistent state without locks.
+
+  # Version: number of snapshots published before this one
+  version = None
+
+  # Timestamp of the estimated state [ns]
+  timestamp = None
+
+  # Estimated state
+  # [ posi_x, posi_y, posi_z,
+  #   atti_quat_simp_w, atti_quat_simp_z,
+  #   vel_lin_x_world, vel_lin_y_world, vel_lin_z_world,
+  #   vel_ang_z_world ]
+  state = None
+  # Covariance of the estimated state
+  state_cov = None
+
+  # Views of the state
+  robot_posi = None
+  robot_atti_quat_simp = None
+  robot_velo_lin_world = None
+  robot_velo_ang_world = None
+
+  # Rotation of the attitude (yaw), from robot to world:
+  # R = [cos, -sin, 0; sin, cos, 0; 0, 0, 1]
+  # Computed once, for the conversions of the readers
+  cos_robot_atti_ang = None
+  sin_robot_atti_ang = None
+
+
+
+  #########
+
+  def __init__(self, version, timestamp, robot_posi, robot_atti_quat_simp, robot_velo_lin_world, robot_velo_ang_world, state_cov):
+
+    #
+    self.version = version
+    self.timestamp = timestamp
+
+    #
+    self.state = np.empty((9,), dtype=float)
+    self.state[0:3] = robot_posi
+    self.state[3:5] = robot_atti_quat_simp
+    self.state[5:8] = robot_velo_lin_world
+    self.state[8] = robot_velo_ang_world[0]
+    self.state.flags.writeable = False
+    #
+    self.state_cov = np.array(state_cov, dtype=float)
+    self.state_cov.flags.writeable = False
+
+    #
+    self.robot_posi = self.state[0:3]
+    self.robot_atti_quat_simp = self.state[3:5]
+    self.robot_velo_lin_world = self.state[5:8]
+    self.robot_velo_ang_world = self.state[8:9]
+
+    # Rotation: from the quat simp, without trigonometry
+    # cos(yaw) = w^2 - z^2, sin(yaw) = 2*w*z (unit quat simp)
+    robot_atti_quat_simp_w, robot_atti_quat_simp_z = self.robot_atti_quat_simp.tolist()
+    robot_atti_quat_simp_norm_sq = robot_atti_quat_simp_w*robot_atti_quat_simp_w + robot_atti_quat_simp_z*robot_atti_quat_simp_z
+    self.cos_robot_atti_ang = (robot_atti_quat_simp_w*robot_atti_quat_simp_w - robot_atti_quat_simp_z*robot_atti_quat_simp_z) / robot_atti_quat_simp_norm_sq
+    self.sin_robot_atti_ang = 2.0*robot_atti_quat_simp_w*robot_atti_quat_simp_z / robot_atti_quat_simp_norm_sq
+
+    # End
+    return
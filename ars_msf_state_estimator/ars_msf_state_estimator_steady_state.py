@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import math
+
+
+
+
+class ArsMsfStateEstimatorSteadyStateEntry:
+
+  #######
+
+  # Converged filter cycle (predict by delta_time, then update with one
+  # combination of measurements)
+
+  # Mask of the combination of measurements
+  meas_mask = None
+
+  # Time step [s]
+  delta_time = None
+
+  # Covariance after the prediction
+  cov_prior = None
+  # Covariance after the update
+  cov_post = None
+  # Kalman gain
+  kalman_gain = None
+  # Inverse of the Cholesky factor of the covariance of the innovation
+  # (normalised innovation for the gating)
+  cov_innov_meas_chol_inv = None
+
+  # Linearisation point: robot attitude angle and linear velocity (world).
+  # The Jacobian of the velocity measurement depends on them
+  robot_atti_ang = None
+  robot_velo_lin_world = None
+
+
+
+  #########
+
+  def __init__(self, meas_mask, delta_time, cov_prior, cov_post, kalman_gain, cov_innov_meas_chol_inv, robot_atti_ang, robot_velo_lin_world):
+
+    self.meas_mask = meas_mask
+    self.delta_time = delta_time
+    self.cov_prior = cov_prior.copy()
+    self.cov_post = cov_post.copy()
+    self.kalman_gain = kalman_gain.copy()
+    self.cov_innov_meas_chol_inv = cov_innov_meas_chol_inv.copy()
+    self.robot_atti_ang = robot_atti_ang
+    self.robot_velo_lin_world = robot_velo_lin_world.copy()
+
+    # End
+    return
+
+
+
+
+class ArsMsfStateEstimatorSteadyState:
+
+  #######
+
+  # Steady-state Kalman gain.
+  # With a constant time step and the same combination of measurements at
+  # every cycle, the covariance converges. Convergence is detected on the
+  # covariance after the update; the covariances and the gain of the
+  # cycle are then cached per combination of measurements. While a cycle
+  # matches the cached one (time step and linearisation point within the
+  # tolerances), the cached values replace the covariance propagation and
+  # the computation of the gain. Otherwise the full EKF is used, until the
+  # covariance after a full update is back to the cached one.
+  #
+  # Phase: which cached covariance the covariance of the state is equal to
+  # - None: none (full EKF)
+  # - 'prior': cov_prior of the entry phase_meas_mask (after a predict)
+  # - 'post': cov_post of the entry phase_meas_mask (after an update)
+
+  # Enabled
+  flag_enabled = None
+
+  # Convergence: relative change of the covariance after the update, and
+  # number of consecutive cycles below it
+  conv_tol = None
+  conv_num_cycles = None
+  # Tolerances of a cycle wrt the cached one
+  # Relative deviation of the time step
+  delta_time_tol = None
+  # Deviation of the robot attitude angle [rad]
+  robot_atti_ang_tol = None
+  # Deviation of the robot linear velocity [m/s]
+  robot_velo_lin_tol = None
+
+  # Mask of the measurements depending on the linearisation point
+  meas_mask_lin = None
+
+  # Cached cycles
+  # Key: mask of the combination of measurements
+  entries = None
+
+  # Phase
+  phase = None
+  phase_meas_mask = None
+
+  # Convergence detection
+  # Time step of the last full prediction [s] (None: no prediction since
+  # the last update)
+  delta_time_last = None
+  # Covariance after the last full prediction
+  cov_prior_last = None
+  # Cycle being checked: mask, time step and covariance after the update
+  conv_meas_mask = None
+  conv_delta_time = None
+  conv_cov_post = None
+  # Number of consecutive converged cycles
+  conv_num_cycles_count = None
+
+  # Number of steps using the cache
+  num_predict_steady = None
+  num_update_steady = None
+
+
+
+  #########
+
+  def __init__(self):
+
+    self.flag_enabled = False
+
+    self.conv_tol = 1e-4
+    self.conv_num_cycles = 5
+    self.delta_time_tol = 0.05
+    self.robot_atti_ang_tol = 0.02
+    self.robot_velo_lin_tol = 0.05
+
+    self.meas_mask_lin = 0
+
+    self.cov_prior_last = np.zeros((8,8), dtype=float)
+    self.conv_cov_post = np.zeros((8,8), dtype=float)
+
+    self.num_predict_steady = 0
+    self.num_update_steady = 0
+
+    #
+    self.reset()
+
+    # End
+    return
+
+
+  def setConfigParameters(self, config_param, meas_mask_lin):
+
+    # Optional entries: as constructed (disabled)
+
+    self.flag_enabled = config_param.get('flag_enabled', False)
+    self.conv_tol = config_param.get('conv_tol', 1e-4)
+    self.conv_num_cycles = config_param.get('conv_num_cycles', 5)
+    self.delta_time_tol = config_param.get('delta_time_tol', 0.05)
+    self.robot_atti_ang_tol = config_param.get('robot_atti_ang_tol', 0.02)
+    self.robot_velo_lin_tol = config_param.get('robot_velo_lin_tol', 0.05)
+
+    self.meas_mask_lin = meas_mask_lin
+
+    self.reset()
+
+    return
+
+
+  def reset(self):
+
+    # Clears the cache, e.g. when the models change
+
+    self.entries = dict()
+
+    self.resetPhase()
+
+    return
+
+
+  def resetPhase(self):
+
+    # The covariance of the state was set from elsewhere (initialisation,
+    # roll back of the history)
+
+    self.phase = None
+    self.phase_meas_mask = None
+
+    self.delta_time_last = None
+    self.conv_meas_mask = None
+    self.conv_num_cycles_count = 0
+
+    return
+
+
+  def isDeltaTimeMatching(self, delta_time, delta_time_ref):
+
+    return abs(delta_time - delta_time_ref) <= self.delta_time_tol * delta_time_ref
+
+
+  def getPredictEntry(self, delta_time):
+
+    # Entry whose cov_prior is the predicted covariance, or None
+
+    if(self.phase != 'post'):
+      return None
+
+    entry = self.entries.get(self.phase_meas_mask)
+    if(entry is None or not self.isDeltaTimeMatching(delta_time, entry.delta_time)):
+      return None
+
+    return entry
+
+
+  def setPredicted(self, delta_time, cov, entry=None):
+
+    # After a prediction: steady (entry given) or full
+
+    if(entry is not None):
+      self.phase = 'prior'
+      self.num_predict_steady += 1
+      return
+
+    self.phase = None
+    self.delta_time_last = delta_time
+    np.copyto(self.cov_prior_last, cov)
+
+    return
+
+
+  def getUpdateEntry(self, meas_mask, robot_atti_ang, robot_velo_lin_world):
+
+    # Entry whose gain and cov_post apply to the update, or None
+
+    if(self.phase != 'prior' or meas_mask != self.phase_meas_mask):
+      return None
+
+    entry = self.entries[meas_mask]
+
+    # Linearisation point
+    if(meas_mask & self.meas_mask_lin):
+      delta_robot_atti_ang = math.remainder(robot_atti_ang - entry.robot_atti_ang, 2.0*math.pi)
+      if(abs(delta_robot_atti_ang) > self.robot_atti_ang_tol):
+        return None
+      if(np.max(np.abs(robot_velo_lin_world - entry.robot_velo_lin_world)) > self.robot_velo_lin_tol):
+        return None
+
+    return entry
+
+
+  def setUpdated(self, meas_mask, cov, entry=None, jac_Hx=None, cov_meas=None, robot_atti_ang=None, robot_velo_lin_world=None):
+
+    # After an update: steady (entry given) or full. After a full update,
+    # checks the convergence of the cycle and caches it once converged
+
+    if(entry is not None):
+      self.phase = 'post'
+      self.num_update_steady += 1
+      return
+
+    # Full update from a cached covariance (e.g. linearisation point out of
+    # the tolerances): not a full cycle, nothing to check
+    if(self.phase is not None):
+      self.phase = None
+      self.delta_time_last = None
+      self.conv_meas_mask = None
+      self.conv_num_cycles_count = 0
+      return
+
+    cov_max = np.max(np.abs(cov))
+
+    # Back to a cached cycle (e.g. after a jitter of the time step)
+    entry = self.entries.get(meas_mask)
+    if(entry is not None and np.max(np.abs(cov - entry.cov_post)) <= self.conv_tol * cov_max):
+      self.phase = 'post'
+      self.phase_meas_mask = meas_mask
+      self.delta_time_last = None
+      return
+
+    # Cycle: full prediction, then update
+    delta_time = self.delta_time_last
+    self.delta_time_last = None
+    if(delta_time is None):
+      self.conv_meas_mask = None
+      self.conv_num_cycles_count = 0
+      return
+
+    if(meas_mask == self.conv_meas_mask and self.isDeltaTimeMatching(delta_time, self.conv_delta_time)):
+      if(np.max(np.abs(cov - self.conv_cov_post)) <= self.conv_tol * cov_max):
+        self.conv_num_cycles_count += 1
+      else:
+        self.conv_num_cycles_count = 0
+    else:
+      self.conv_meas_mask = meas_mask
+      self.conv_delta_time = delta_time
+      self.conv_num_cycles_count = 0
+    np.copyto(self.conv_cov_post, cov)
+
+    if(self.conv_num_cycles_count < self.conv_num_cycles):
+      return
+
+    # Converged: K = P- * Hx^T * (Hx * P- * Hx^T + R)^-1
+    cov_jac_Hx_t = np.matmul(self.cov_prior_last, jac_Hx.T)
+    cov_innov_meas = np.matmul(jac_Hx, cov_jac_Hx_t) + cov_meas
+    kalman_gain = np.linalg.solve(cov_innov_meas, cov_jac_Hx_t.T).T
+    cov_innov_meas_chol_inv = np.linalg.inv(np.linalg.cholesky(cov_innov_meas))
+    self.entries[meas_mask] = ArsMsfStateEstimatorSteadyStateEntry(meas_mask, self.conv_delta_time, self.cov_prior_last, cov, kalman_gain, cov_innov_meas_chol_inv, robot_atti_ang, robot_velo_lin_world)
+
+    self.phase = 'post'
+    self.phase_meas_mask = meas_mask
+    self.conv_meas_mask = None
+    self.conv_num_cycles_count = 0
+
+    return
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+import math
+
+
+
+
+class ArsMsfStateEstimatorWorkspaceUpdate:
+
+  #######
+
+  # Preallocated arrays of the update for one combination of measurements
+
+  # Mask of the combination of measurements
+  meas_mask = None
+
+  # Dimension of the stacked measurement
+  dim_meas = None
+
+  # Models of the measurements of the combination, with their rows of the
+  # innovation and of the Jacobian Hx (views)
+  # List of (model, innov_meas rows, jac_Hx rows)
+  meas_models_rows = None
+
+  # First row of each measurement in the stacked measurement
+  # Key: mask of the measurement
+  meas_idx = None
+
+  # Blocks of the stacked measurement (one per measurement)
+  meas_blocks = None
+  # Mask of the measurement of each block
+  meas_blocks_mask = None
+  # First row of each block
+  meas_blocks_start = None
+  # Blocks of the stacked measurement (one per row)
+  meas_blocks_scalar = None
+
+  # Innovation of the measurement
+  innov_meas = None
+  # Covariance of the measurement (constant)
+  cov_meas = None
+  # Inverse of the smallest eigenvalue of the covariance of the measurement
+  # (constant)
+  var_meas_min_inv = None
+  # Jacobian Hx (constant entries written once; view of jac_Hx_joint)
+  jac_Hx = None
+
+  # Batch update: joint matrix M = G * P * G^T + R_joint, factorised once
+  #   M = [ S         .      .
+  #         innov^T   alpha  .
+  #         P * Hx^T  0      P ]
+  # G = [Hx; 0; I] (constant entries written once)
+  jac_Hx_joint = None
+  # R_joint: R on the block S, zero elsewhere (constant)
+  cov_meas_joint = None
+  # G * P
+  jac_Hx_joint_cov = None
+  # M
+  cov_joint = None
+  # Correction of the state
+  delta_x = None
+
+
+
+  #########
+
+  def __init__(self, meas_mask, meas_models):
+
+    #
+    self.meas_mask = meas_mask
+
+    # Models of the combination, in the order of the stacked measurement
+    meas_models = [meas_model for meas_model in meas_models if meas_mask & meas_model.meas_mask]
+
+    # Layout of the stacked measurement
+    self.dim_meas = 0
+    self.meas_idx = dict()
+    self.meas_blocks = []
+    self.meas_blocks_mask = []
+    for meas_model in meas_models:
+      self.meas_idx[meas_model.meas_mask] = self.dim_meas
+      self.meas_blocks.append((self.dim_meas, self.dim_meas+meas_model.dim_meas))
+      self.meas_blocks_mask.append(meas_model.meas_mask)
+      self.dim_meas += meas_model.dim_meas
+    self.meas_blocks_start = np.array([meas_block[0] for meas_block in self.meas_blocks], dtype=int)
+    self.meas_blocks_scalar = [(idx, idx+1) for idx in range(self.dim_meas)]
+
+    #
+    dim_meas = self.dim_meas
+    dim_joint = dim_meas+1+8
+    self.jac_Hx_joint = np.zeros((dim_joint, 8), dtype=float)
+    self.jac_Hx_joint[dim_meas+1:] = np.eye(8)
+    self.cov_meas_joint = np.zeros((dim_joint, dim_joint), dtype=float)
+    self.jac_Hx_joint_cov = np.zeros((dim_joint, 8), dtype=float)
+    self.cov_joint = np.zeros((dim_joint, dim_joint), dtype=float)
+
+    #
+    self.innov_meas = np.zeros((dim_meas,), dtype=float)
+    self.cov_meas = self.cov_meas_joint[0:dim_meas, 0:dim_meas]
+    self.jac_Hx = self.jac_Hx_joint[0:dim_meas]
+
+    # Constant entries
+    # Rows of each model
+    self.meas_models_rows = []
+    for meas_model, meas_block in zip(meas_models, self.meas_blocks):
+      self.cov_meas[meas_block[0]:meas_block[1], meas_block[0]:meas_block[1]] = meas_model.cov_meas
+      self.jac_Hx[meas_block[0]:meas_block[1]] = meas_model.jac_Hx_const
+      self.meas_models_rows.append((meas_model, self.innov_meas[meas_block[0]:meas_block[1]], self.jac_Hx[meas_block[0]:meas_block[1]]))
+
+    # The batch update requires R positive definite
+    cov_meas_eig_min = np.min(np.linalg.eigvalsh(self.cov_meas))
+    self.var_meas_min_inv = 1.0/cov_meas_eig_min if cov_meas_eig_min > 0.0 else math.inf
+
+    #
+    self.delta_x = np.zeros((8,), dtype=float)
+
+    # End
+    return
+
+
+
+
+class ArsMsfStateEstimatorWorkspace:
+
+  #######
+
+  # Preallocated arrays of the predict and update steps.
+  # Constant entries are written only once
+
+  # Predict
+  # Jacobian - Fx
+  jac_Fx = None
+  # Entries of Fx equal to delta_time
+  jac_Fx_delta_time_idx = None
+  # Jacobian - Fn (constant)
+  jac_Fn = None
+  # Fn * Q * Fn^T (constant)
+  cov_proc_mod_jac_Fn = None
+  # Fx * P
+  jac_Fx_cov = None
+  # Block of Fn * Q * Fn^T on the velocities (lazy prediction)
+  cov_proc_mod_block = None
+  # Increment of position
+  delta_robot_posi = None
+  # IMU-driven predict
+  # Jacobian - Fx (entries depending on the interval written each time)
+  jac_Fx_imu = None
+  # Entries of Fx equal to the duration of the interval
+  jac_Fx_imu_delta_time_idx = None
+  # Jacobian - Fn, wrt the errors of the preintegration
+  jac_Fn_imu = None
+
+  # Update
+  # Rotation matrix of the robot attitude
+  robot_atti_rot_mat = None
+  # Derivative of the rotation matrix wrt the robot attitude angle
+  robot_atti_diff_rot_mat = None
+  # Measurement models, in the order of the stacked measurement
+  meas_models = None
+  # Mask of all the measurement models
+  meas_mask_all = None
+  # Workspaces for each combination of measurements, built at the first
+  # update with the combination (cache)
+  # Key: mask of the combination of measurements
+  update = None
+
+
+
+  #########
+
+  def __init__(self):
+
+    # Jacobian - Fx
+    self.jac_Fx = np.zeros((8,8), dtype=float)
+    # Position k+1 - Position k
+    self.jac_Fx[0:3, 0:3] = np.eye(3)
+    # Attitude k+1 - Attitude k
+    self.jac_Fx[3, 3] = 1.0
+    # Velocity linear k+1 - Velocity linear k
+    self.jac_Fx[4:7, 4:7] = np.eye(3)
+    # Velocity angular k+1 - Velocity angular k
+    self.jac_Fx[7, 7] = 1.0
+    # Position k+1 - Velocity k, and Attitude k+1 - Velocity angular k
+    self.jac_Fx_delta_time_idx = (np.array([0, 1, 2, 3]), np.array([4, 5, 6, 7]))
+
+    # Jacobian - Fn
+    self.jac_Fn = np.zeros((8,4), dtype=float)
+    # Velocity linear k+1 - Noise Velocity linear
+    self.jac_Fn[4:7, 0:3] = np.eye(3)
+    # Velocity angular k+1 - Noise Velocity angular
+    self.jac_Fn[7, 3] = 1.0
+
+    #
+    self.cov_proc_mod_jac_Fn = np.zeros((8,8), dtype=float)
+    self.jac_Fx_cov = np.zeros((8,8), dtype=float)
+    self.cov_proc_mod_block = np.zeros((4,4), dtype=float)
+    self.delta_robot_posi = np.zeros((3,), dtype=float)
+
+    # IMU-driven predict
+    # Position, attitude and linear velocity k+1 wrt k. The angular
+    # velocity is the one of the IMU (row of zeros)
+    self.jac_Fx_imu = np.zeros((8,8), dtype=float)
+    self.jac_Fx_imu[0:7, 0:7] = np.eye(7)
+    # Position k+1 - Velocity linear k
+    self.jac_Fx_imu_delta_time_idx = (np.array([0, 1, 2]), np.array([4, 5, 6]))
+    # Position, attitude and linear velocity k+1 wrt the errors of the
+    # preintegration [posi, atti_yaw, vel_lin] (rotations written each time)
+    self.jac_Fn_imu = np.zeros((8,7), dtype=float)
+    self.jac_Fn_imu[3, 3] = 1.0
+
+    #
+    self.robot_atti_rot_mat = np.zeros((3,3), dtype=float)
+    self.robot_atti_rot_mat[2, 2] = 1.0
+    self.robot_atti_diff_rot_mat = np.zeros((3,3), dtype=float)
+
+    #
+    self.meas_models = []
+    self.meas_mask_all = 0
+    self.update = dict()
+
+    # End
+    return
+
+
+  def setCovProcMod(self, cov_proc_mod):
+
+    self.cov_proc_mod_jac_Fn = np.matmul(np.matmul(self.jac_Fn, cov_proc_mod), self.jac_Fn.T)
+    self.cov_proc_mod_block = np.ascontiguousarray(self.cov_proc_mod_jac_Fn[4:8, 4:8])
+
+    return
+
+
+  def setMeasModels(self, meas_models):
+
+    # meas_models: measurement models (ArsMsfStateEstimatorMeasModel), in
+    # the order of the stacked measurement. The workspaces of the
+    # combinations are built when first used.
+    # Requires setCovProcMod() first
+
+    self.meas_models = list(meas_models)
+    self.update = dict()
+
+    self.meas_mask_all = 0
+    for meas_model in self.meas_models:
+      self.meas_mask_all |= meas_model.meas_mask
+
+    return
+
+
+  def getUpdate(self, meas_mask):
+
+    # Workspace of the combination of measurements (built once), or None
+    # if the mask has no measurement or an unknown one
+
+    workspace_update = self.update.get(meas_mask)
+    if(workspace_update is not None):
+      return workspace_update
+
+    if(meas_mask <= 0 or (meas_mask & ~self.meas_mask_all)):
+      return None
+
+    workspace_update = ArsMsfStateEstimatorWorkspaceUpdate(meas_mask, self.meas_models)
+    self.update[meas_mask] = workspace_update
+
+    return workspace_update
+
+
+  def setRobotAttiAngle(self, robot_atti_ang):
+
+    cos_robot_atti_ang = math.cos(robot_atti_ang)
+    sin_robot_atti_ang = math.sin(robot_atti_ang)
+
+    # Rotation matrix
+    self.robot_atti_rot_mat[0, 0] = cos_robot_atti_ang
+    self.robot_atti_rot_mat[0, 1] = -sin_robot_atti_ang
+    self.robot_atti_rot_mat[1, 0] = sin_robot_atti_ang
+    self.robot_atti_rot_mat[1, 1] = cos_robot_atti_ang
+
+    # Derivative wrt the angle
+    self.robot_atti_diff_rot_mat[0, 0] = -sin_robot_atti_ang
+    self.robot_atti_diff_rot_mat[0, 1] = -cos_robot_atti_ang
+    self.robot_atti_diff_rot_mat[1, 0] = cos_robot_atti_ang
+    self.robot_atti_diff_rot_mat[1, 1] = -sin_robot_atti_ang
+
+    return
@@ -0,0 +1,661 @@
+#!/usr/bin/env python3
+
+import argparse
+
+import json
+
+import os
+
+import platform
+
+import copy
+
+import time
+
+import numpy as np
+
+# pyyaml - https://pyyaml.org/wiki/PyYAMLDocumentation
+import yaml
+from yaml.loader import SafeLoader
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_bank import ArsMsfStateEstimatorBank
+
+
+# Benchmark suite of the hot path of the MSF state estimator:
+# - predict: predict() alone
+# - update_<meas>: update() for every combination of measurements, and
+#   of all the measurements with the gating
+# - batch_update_kernel: computeBatchUpdate() alone (Cholesky of the joint
+#   matrix), all the measurements, and the explicit gain with the inverse
+#   of the covariance of the innovation it replaced, as a reference
+# - state_estim_loop_timer_callback: full stateEstimLoopTimerCallback of the
+#   ROS node, with stubbed publishers (requires ROS; skipped otherwise),
+#   without and with the latency instrumentation, and without subscribers
+# - state_estim_publish: stateEstimPublish alone (all the outputs)
+# - multi_sensor_high_rate: event-driven predict and update of three
+#   sensors at 100/200/400 Hz, arriving with latency (out of order)
+# - fixed_rate_cycle: predict and update of all the sensors at 50 Hz, robot
+#   at rest, without and with the steady-state Kalman gain; and robot
+#   turning (the linearisation point leaves the tolerances: full EKF)
+# - imu_high_rate: IMU-driven prediction, IMU at 1 kHz (sample ingestion
+#   and high-rate state), predict and update of all the sensors at 50 Hz.
+#   Latency per IMU sample, including the corrections
+# - idle_loop: stateEstimLoopTimerCallback without measurements nor
+#   subscribers (tf disabled), without and with the lazy prediction
+# - state_query_<n>: getStateAtTimestamp() of n timestamps at once, within
+#   the history and past the estimated state
+# - bank_<n>: predict and update of a bank of n robots at 50 Hz, all the
+#   sensors of all the robots at each tick; and the same with n
+#   independent estimators, as a reference
+#
+# Reports ops/s and p50/p99 latencies, saves the results as JSON and
+# compares them against a stored baseline (p50)
+
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+
+default_config_param_yaml_file_name = os.path.join(benchmark_dir, '..', 'config', 'config_msf_state_estimator.yaml')
+default_baseline_file_name = os.path.join(benchmark_dir, 'benchmark_baseline.json')
+
+
+meas_mask_names = {
+  ArsMsfStateEstimator.meas_mask_robot_posi: 'posi',
+  ArsMsfStateEstimator.meas_mask_robot_atti: 'atti',
+  ArsMsfStateEstimator.meas_mask_robot_vel_robot: 'velo',
+}
+
+
+def getMeasMaskName(meas_mask):
+
+  return '_'.join(meas_mask_name for meas_mask_i, meas_mask_name in meas_mask_names.items() if meas_mask & meas_mask_i)
+
+
+def summariseLatency(latency_ns):
+
+  latency_us = np.asarray(latency_ns, dtype=float) / 1e3
+
+  return {
+    'num_iter': int(latency_us.shape[0]),
+    'ops_per_sec': float(1e6 / np.mean(latency_us)),
+    'mean_us': float(np.mean(latency_us)),
+    'p50_us': float(np.percentile(latency_us, 50)),
+    'p99_us': float(np.percentile(latency_us, 99)),
+  }
+
+
+def createEstimator(config_param):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(config_param['ekf'])
+
+  return msf_state_estimator
+
+
+def setMeas(msf_state_estimator, meas_mask, timestamp, rng):
+
+  if(meas_mask & ArsMsfStateEstimator.meas_mask_robot_posi):
+    msf_state_estimator.setMeasRobotPosition(timestamp, rng.normal(size=(3,)))
+  if(meas_mask & ArsMsfStateEstimator.meas_mask_robot_atti):
+    meas_robot_atti_ang = rng.uniform(-0.1, 0.1)
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.5*meas_robot_atti_ang), np.sin(0.5*meas_robot_atti_ang)]))
+  if(meas_mask & ArsMsfStateEstimator.meas_mask_robot_vel_robot):
+    msf_state_estimator.setMeasRobotVelRobot(timestamp, rng.normal(size=(3,)), rng.normal(size=(1,)))
+
+  return
+
+
+def benchmarkPredict(config_param, num_iter):
+
+  msf_state_estimator = createEstimator(config_param)
+
+  timestamp = 1000000000
+  delta_time_ns = 20000000
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamp += delta_time_ns
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.predict(timestamp)
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkUpdate(config_param, meas_mask, num_iter):
+
+  msf_state_estimator = createEstimator(config_param)
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000
+  delta_time_ns = 20000000
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamp += delta_time_ns
+    msf_state_estimator.predict(timestamp)
+    setMeas(msf_state_estimator, meas_mask, timestamp, rng)
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.update()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkBatchUpdateKernel(config_param, num_iter, flag_inverse=False):
+
+  # Kernel of the batch update of all the measurements, on the same
+  # innovation and prior covariance at each iteration
+
+  msf_state_estimator = createEstimator(config_param)
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+  setMeas(msf_state_estimator, 7, timestamp, rng)
+  msf_state_estimator.update()
+
+  workspace_update = msf_state_estimator.workspace.getUpdate(7)
+  innov_meas = rng.normal(size=(workspace_update.dim_meas,))
+  jac_Hx = workspace_update.jac_Hx
+  cov_meas = workspace_update.cov_meas
+  estim_P = msf_state_estimator.estim_state_cov
+  estim_P_prior = estim_P.copy()
+
+  # Explicit gain: buffers
+  cov_jac_Hx_t = np.zeros((8, workspace_update.dim_meas), dtype=float)
+  cov_innov_meas = np.zeros((workspace_update.dim_meas, workspace_update.dim_meas), dtype=float)
+  kalman_gain = np.zeros((8, workspace_update.dim_meas), dtype=float)
+  jac_Hx_cov = np.zeros((workspace_update.dim_meas, 8), dtype=float)
+  kalman_gain_jac_Hx_cov = np.zeros((8, 8), dtype=float)
+  delta_x = np.zeros((8,), dtype=float)
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    np.copyto(estim_P, estim_P_prior)
+    time_start = time.perf_counter_ns()
+    if(flag_inverse):
+      np.matmul(estim_P, jac_Hx.T, out=cov_jac_Hx_t)
+      np.matmul(jac_Hx, cov_jac_Hx_t, out=cov_innov_meas)
+      cov_innov_meas += cov_meas
+      np.matmul(cov_jac_Hx_t, np.linalg.inv(cov_innov_meas), out=kalman_gain)
+      np.matmul(kalman_gain, innov_meas, out=delta_x)
+      np.matmul(jac_Hx, estim_P, out=jac_Hx_cov)
+      np.matmul(kalman_gain, jac_Hx_cov, out=kalman_gain_jac_Hx_cov)
+      estim_P -= kalman_gain_jac_Hx_cov
+    else:
+      msf_state_estimator.computeBatchUpdate(innov_meas, estim_P, workspace_update)
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+class StubPublisher:
+
+  # Stands for a ROS publisher: only counts the messages
+
+  def __init__(self, num_subscriptions=1):
+    self.num_msgs = 0
+    self.num_subscriptions = num_subscriptions
+
+  def publish(self, msg):
+    self.num_msgs += 1
+
+  def get_subscription_count(self):
+    return self.num_subscriptions
+
+
+class StubTf2Broadcaster:
+
+  def sendTransform(self, transform):
+    pass
+
+
+class StubClock:
+
+  # Simulated clock, advanced by the benchmark
+
+  class StubTime:
+    def __init__(self, nanoseconds):
+      self.nanoseconds = nanoseconds
+
+  def __init__(self, timestamp):
+    self.timestamp = timestamp
+
+  def now(self):
+    return StubClock.StubTime(self.timestamp)
+
+
+def createEstimatorRosStub(config_param, flag_latency_enabled, num_subscriptions=1):
+
+  # ArsMsfStateEstimatorRos without a ROS node: no rclpy.init, no
+  # executor, stubbed publishers, tf2 broadcaster and clock.
+  # Messages are still built, as in the node
+  from ars_msf_state_estimator.ars_msf_state_estimator_ros import ArsMsfStateEstimatorRos
+
+  msf_state_estimator_ros = ArsMsfStateEstimatorRos.__new__(ArsMsfStateEstimatorRos)
+
+  msf_state_estimator_ros.config_param = config_param
+  msf_state_estimator_ros.robot_frame = config_param['robot_frame']
+  msf_state_estimator_ros.world_frame = config_param['world_frame']
+  msf_state_estimator_ros.state_estim_mode = 'timer'
+  msf_state_estimator_ros.state_estim_loop_freq = config_param['state_estim_loop_freq']
+  msf_state_estimator_ros.state_pred_loop_freq = config_param['state_pred_loop_freq']
+  msf_state_estimator_ros.msf_state_estimator = createEstimator(config_param)
+
+  msf_state_estimator_ros.flag_latency_enabled = flag_latency_enabled
+  msf_state_estimator_ros.setLatencyMeas()
+
+  msf_state_estimator_ros.setPublishParameters(config_param['publish'])
+  msf_state_estimator_ros.estim_robot_pose_pub = StubPublisher(num_subscriptions)
+  msf_state_estimator_ros.estim_robot_pose_cov_pub = StubPublisher(num_subscriptions)
+  msf_state_estimator_ros.estim_robot_vel_robot_pub = StubPublisher(num_subscriptions)
+  msf_state_estimator_ros.estim_robot_vel_robot_cov_pub = StubPublisher(num_subscriptions)
+  msf_state_estimator_ros.estim_robot_vel_world_pub = StubPublisher(num_subscriptions)
+  msf_state_estimator_ros.estim_robot_vel_world_cov_pub = StubPublisher(num_subscriptions)
+  msf_state_estimator_ros.tf2_broadcaster = StubTf2Broadcaster()
+  msf_state_estimator_ros.createPublishMsgs()
+
+  stub_clock = StubClock(1000000000)
+  msf_state_estimator_ros.get_clock = lambda: stub_clock
+
+  return msf_state_estimator_ros
+
+
+def benchmarkStateEstimLoopTimerCallback(config_param, num_iter, flag_latency_enabled=False, num_subscriptions=1):
+
+  try:
+    msf_state_estimator_ros = createEstimatorRosStub(config_param, flag_latency_enabled, num_subscriptions)
+  except ImportError as error:
+    return {'skipped': 'ROS not available: ' + str(error)}
+
+  rng = np.random.default_rng(0)
+
+  stub_clock = msf_state_estimator_ros.get_clock()
+  delta_time_ns = int(1e9/config_param['state_estim_loop_freq'])
+
+  meas_mask_all = ArsMsfStateEstimator.meas_mask_robot_posi | ArsMsfStateEstimator.meas_mask_robot_atti | ArsMsfStateEstimator.meas_mask_robot_vel_robot
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    # New measurements at the previous tick
+    setMeas(msf_state_estimator_ros.msf_state_estimator, meas_mask_all, stub_clock.timestamp, rng)
+    stub_clock.timestamp += delta_time_ns
+    time_start = time.perf_counter_ns()
+    msf_state_estimator_ros.stateEstimLoopTimerCallback()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkIdleLoop(config_param, num_iter, flag_lazy_predict=False):
+
+  config_param = copy.deepcopy(config_param)
+  config_param['ekf']['lazy_predict']['flag_enabled'] = flag_lazy_predict
+  config_param['publish']['tf']['flag_enabled'] = False
+
+  try:
+    msf_state_estimator_ros = createEstimatorRosStub(config_param, False, num_subscriptions=0)
+  except ImportError as error:
+    return {'skipped': 'ROS not available: ' + str(error)}
+
+  stub_clock = msf_state_estimator_ros.get_clock()
+  delta_time_ns = int(1e9/config_param['state_estim_loop_freq'])
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    stub_clock.timestamp += delta_time_ns
+    time_start = time.perf_counter_ns()
+    msf_state_estimator_ros.stateEstimLoopTimerCallback()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkStateEstimPublish(config_param, num_iter):
+
+  try:
+    msf_state_estimator_ros = createEstimatorRosStub(config_param, False)
+  except ImportError as error:
+    return {'skipped': 'ROS not available: ' + str(error)}
+
+  stub_clock = msf_state_estimator_ros.get_clock()
+  delta_time_ns = int(1e9/config_param['state_estim_loop_freq'])
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    stub_clock.timestamp += delta_time_ns
+    msf_state_estimator_ros.msf_state_estimator.predict(stub_clock.timestamp)
+    time_start = time.perf_counter_ns()
+    msf_state_estimator_ros.stateEstimPublish()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkUpdateSources(config_param, num_sources, num_iter):
+
+  # Position from the built-in source and num_sources additional sources,
+  # all fused at each update
+  config_param = copy.deepcopy(config_param)
+  config_param['ekf']['meas_sources']['meas_position'] = [{'name': 'meas_position_'+str(idx_source), 'topic': 'meas_robot_position_'+str(idx_source), 'cov_diag': [1.0, 1.0, 1.0]} for idx_source in range(num_sources)]
+
+  msf_state_estimator = createEstimator(config_param)
+  meas_masks_sources = [meas_model.meas_mask for meas_model in msf_state_estimator.getMeasSources()]
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000
+  delta_time_ns = 20000000
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamp += delta_time_ns
+    msf_state_estimator.predict(timestamp)
+    setMeas(msf_state_estimator, ArsMsfStateEstimator.meas_mask_robot_posi, timestamp, rng)
+    for meas_mask_source in meas_masks_sources:
+      msf_state_estimator.setMeas(meas_mask_source, timestamp, rng.normal(size=(3,)))
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.update()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkMultiSensorHighRate(config_param, num_iter):
+
+  msf_state_estimator = createEstimator(config_param)
+
+  rng = np.random.default_rng(0)
+
+  # Measurements: (timestamp of arrival, timestamp, mask).
+  # Position 100 Hz, attitude 200 Hz, velocity 400 Hz, with 0-5 ms latency
+  meas_events = []
+  time_duration_ns = int(num_iter / 700 * 1e9)
+  for meas_mask, meas_freq in [(ArsMsfStateEstimator.meas_mask_robot_posi, 100.0), (ArsMsfStateEstimator.meas_mask_robot_atti, 200.0), (ArsMsfStateEstimator.meas_mask_robot_vel_robot, 400.0)]:
+    meas_timestamp = 1000000000 + np.arange(0, time_duration_ns, int(1e9/meas_freq), dtype=np.int64)
+    meas_timestamp_arrival = meas_timestamp + rng.integers(0, 5000000, meas_timestamp.shape[0])
+    meas_events.extend(zip(meas_timestamp_arrival.tolist(), meas_timestamp.tolist(), [meas_mask]*meas_timestamp.shape[0]))
+  meas_events.sort()
+
+  # Event-driven: predict to the arrival and update on each measurement
+  latency_ns = np.zeros((len(meas_events),), dtype=np.int64)
+  for idx_event, (meas_timestamp_arrival, meas_timestamp, meas_mask) in enumerate(meas_events):
+    setMeas(msf_state_estimator, meas_mask, meas_timestamp, rng)
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.predict(meas_timestamp_arrival)
+    msf_state_estimator.update()
+    latency_ns[idx_event] = time.perf_counter_ns() - time_start
+
+  results = summariseLatency(latency_ns)
+  results['num_meas_dropped_too_old'] = int(msf_state_estimator.num_meas_dropped_too_old)
+
+  return results
+
+
+def benchmarkFixedRateCycle(config_param, num_iter, flag_steady_state_enabled=False, flag_turning=False):
+
+  config_param = copy.deepcopy(config_param)
+  config_param['ekf']['steady_state']['flag_enabled'] = flag_steady_state_enabled
+
+  msf_state_estimator = createEstimator(config_param)
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000
+  delta_time_ns = 20000000
+
+  # Robot at rest: the linearisation point stays within the tolerances.
+  # Robot turning: circle at 1 m/s and 0.5 rad/s
+  robot_velo_lin = 1.0 if flag_turning else 0.0
+  robot_velo_ang = 0.5 if flag_turning else 0.0
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamp += delta_time_ns
+    robot_atti_ang = robot_velo_ang * (idx_iter+1) * delta_time_ns / 1e9
+    if(flag_turning):
+      robot_posi = robot_velo_lin/robot_velo_ang * np.array([np.sin(robot_atti_ang), 1.0-np.cos(robot_atti_ang), 0.0])
+    else:
+      robot_posi = np.zeros((3,))
+    msf_state_estimator.setMeasRobotPosition(timestamp, robot_posi + 0.01*rng.normal(size=(3,)))
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.5*robot_atti_ang), np.sin(0.5*robot_atti_ang)]))
+    msf_state_estimator.setMeasRobotVelRobot(timestamp, np.array([robot_velo_lin, 0.0, 0.0]) + 0.01*rng.normal(size=(3,)), np.array([robot_velo_ang]) + 0.01*rng.normal(size=(1,)))
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.update()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  results = summariseLatency(latency_ns)
+  results['num_update_steady'] = int(msf_state_estimator.steady_state.num_update_steady)
+
+  return results
+
+
+def benchmarkImuHighRate(config_param, num_iter):
+
+  config_param = copy.deepcopy(config_param)
+  config_param['ekf']['imu']['flag_enabled'] = True
+
+  msf_state_estimator = createEstimator(config_param)
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000
+  delta_time_imu_ns = 1000000
+  num_imu_per_cycle = 20
+
+  msf_state_estimator.predict(timestamp)
+
+  # Robot at rest
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamp += delta_time_imu_ns
+    lin_acc = np.array([0.0, 0.0, 9.81]) + 0.01*rng.normal(size=(3,))
+    ang_vel = 0.001*rng.normal()
+    flag_cycle = (idx_iter % num_imu_per_cycle) == num_imu_per_cycle-1
+    if(flag_cycle):
+      msf_state_estimator.setMeasRobotPosition(timestamp, 0.01*rng.normal(size=(3,)))
+      msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([1.0, 0.0]))
+      msf_state_estimator.setMeasRobotVelRobot(timestamp, 0.01*rng.normal(size=(3,)), 0.01*rng.normal(size=(1,)))
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.setMeasImu(timestamp, lin_acc, ang_vel)
+    if(flag_cycle):
+      msf_state_estimator.predict(timestamp)
+      msf_state_estimator.update()
+    msf_state_estimator.getStateSnapshotImu()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkStateQuery(config_param, num_iter, num_timestamps):
+
+  config_param = copy.deepcopy(config_param)
+  config_param['ekf']['history']['flag_enabled'] = True
+
+  msf_state_estimator = createEstimator(config_param)
+
+  rng = np.random.default_rng(0)
+
+  # Full history, 50 Hz
+  timestamp = 1000000000
+  delta_time_ns = 20000000
+  for idx_cycle in range(config_param['ekf']['history']['size']+10):
+    timestamp += delta_time_ns
+    setMeas(msf_state_estimator, 7, timestamp, rng)
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.update()
+
+  timestamp_oldest = msf_state_estimator.history.getTimestamp(0)
+  timestamp_max = timestamp + int(0.5e9*config_param['ekf']['state_query']['extrapolation_time_max'])
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamps = rng.integers(timestamp_oldest, timestamp_max, num_timestamps)
+    time_start = time.perf_counter_ns()
+    msf_state_estimator.getStateAtTimestamp(timestamps)
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def benchmarkBank(config_param, num_iter, num_robots, flag_independent=False):
+
+  if(flag_independent):
+    msf_state_estimators = [createEstimator(config_param) for idx_robot in range(num_robots)]
+  else:
+    msf_state_estimator_bank = ArsMsfStateEstimatorBank(num_robots)
+    msf_state_estimator_bank.setConfigParameters(config_param['ekf'])
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000
+  delta_time_ns = 20000000
+
+  latency_ns = np.zeros((num_iter,), dtype=np.int64)
+  for idx_iter in range(num_iter):
+    timestamp += delta_time_ns
+    meas_robot_posi = rng.normal(size=(num_robots, 3))
+    meas_robot_atti_ang = rng.uniform(-0.1, 0.1, size=(num_robots,))
+    meas_robot_velo = rng.normal(size=(num_robots, 4))
+    for idx_robot in range(num_robots):
+      meas_robot_atti_quat_simp = np.array([np.cos(0.5*meas_robot_atti_ang[idx_robot]), np.sin(0.5*meas_robot_atti_ang[idx_robot])])
+      if(flag_independent):
+        msf_state_estimators[idx_robot].setMeasRobotPosition(timestamp, meas_robot_posi[idx_robot])
+        msf_state_estimators[idx_robot].setMeasRobotAttitude(timestamp, meas_robot_atti_quat_simp)
+        msf_state_estimators[idx_robot].setMeasRobotVelRobot(timestamp, meas_robot_velo[idx_robot, 0:3], meas_robot_velo[idx_robot, 3:4])
+      else:
+        msf_state_estimator_bank.setMeasRobotPosition(idx_robot, timestamp, meas_robot_posi[idx_robot])
+        msf_state_estimator_bank.setMeasRobotAttitude(idx_robot, timestamp, meas_robot_atti_quat_simp)
+        msf_state_estimator_bank.setMeasRobotVelRobot(idx_robot, timestamp, meas_robot_velo[idx_robot, 0:3], meas_robot_velo[idx_robot, 3:4])
+    time_start = time.perf_counter_ns()
+    if(flag_independent):
+      for msf_state_estimator in msf_state_estimators:
+        msf_state_estimator.predict(timestamp)
+        msf_state_estimator.update()
+    else:
+      msf_state_estimator_bank.predict(timestamp)
+      msf_state_estimator_bank.update()
+    latency_ns[idx_iter] = time.perf_counter_ns() - time_start
+
+  return summariseLatency(latency_ns)
+
+
+def runBenchmarks(config_param, num_iter):
+
+  results = dict()
+
+  results['predict'] = benchmarkPredict(config_param, num_iter)
+
+  for meas_mask in range(1, 8):
+    results['update_'+getMeasMaskName(meas_mask)] = benchmarkUpdate(config_param, meas_mask, num_iter)
+
+  results['batch_update_kernel'] = benchmarkBatchUpdateKernel(config_param, num_iter)
+  results['batch_update_kernel_inverse'] = benchmarkBatchUpdateKernel(config_param, num_iter, flag_inverse=True)
+
+  config_param_gating = copy.deepcopy(config_param)
+  config_param_gating['ekf']['gating']['flag_enabled'] = True
+  results['update_posi_atti_velo_gating'] = benchmarkUpdate(config_param_gating, 7, num_iter)
+
+  for num_sources in [1, 4, 8]:
+    results['update_posi_sources_'+str(num_sources)] = benchmarkUpdateSources(config_param, num_sources, num_iter)
+
+  results['state_estim_loop_timer_callback'] = benchmarkStateEstimLoopTimerCallback(config_param, num_iter)
+  results['state_estim_loop_timer_callback_latency'] = benchmarkStateEstimLoopTimerCallback(config_param, num_iter, flag_latency_enabled=True)
+  results['state_estim_loop_timer_callback_no_subscribers'] = benchmarkStateEstimLoopTimerCallback(config_param, num_iter, num_subscriptions=0)
+  results['state_estim_publish'] = benchmarkStateEstimPublish(config_param, num_iter)
+  results['idle_loop'] = benchmarkIdleLoop(config_param, num_iter)
+  results['idle_loop_lazy'] = benchmarkIdleLoop(config_param, num_iter, flag_lazy_predict=True)
+
+  results['multi_sensor_high_rate'] = benchmarkMultiSensorHighRate(config_param, num_iter)
+
+  results['fixed_rate_cycle'] = benchmarkFixedRateCycle(config_param, num_iter)
+  results['fixed_rate_cycle_steady_state'] = benchmarkFixedRateCycle(config_param, num_iter, flag_steady_state_enabled=True)
+  results['fixed_rate_cycle_turning'] = benchmarkFixedRateCycle(config_param, num_iter, flag_turning=True)
+  results['fixed_rate_cycle_turning_steady_state'] = benchmarkFixedRateCycle(config_param, num_iter, flag_steady_state_enabled=True, flag_turning=True)
+
+  results['imu_high_rate'] = benchmarkImuHighRate(config_param, num_iter)
+
+  results['state_query_1'] = benchmarkStateQuery(config_param, num_iter, 1)
+  results['state_query_64'] = benchmarkStateQuery(config_param, num_iter, 64)
+
+  results['bank_50'] = benchmarkBank(config_param, num_iter, 50)
+  results['bank_50_independent'] = benchmarkBank(config_param, num_iter, 50, flag_independent=True)
+
+  return results
+
+
+def compareBaseline(results, results_baseline, tolerance):
+
+  # Returns the benchmarks with p50 worse than the baseline by more than
+  # the tolerance: list of (name, p50, p50 baseline); and the benchmarks
+  # not compared, skipped here or without p50 in the baseline: list of names
+
+  regressions = []
+  benchmarks_not_compared = []
+
+  for benchmark_name, benchmark_results in results.items():
+    benchmark_results_baseline = results_baseline.get(benchmark_name)
+    if(benchmark_results_baseline is None or 'p50_us' not in benchmark_results or 'p50_us' not in benchmark_results_baseline):
+      benchmarks_not_compared.append(benchmark_name)
+      continue
+    if(benchmark_results['p50_us'] > (1.0 + tolerance) * benchmark_results_baseline['p50_us']):
+      regressions.append((benchmark_name, benchmark_results['p50_us'], benchmark_results_baseline['p50_us']))
+
+  return regressions, benchmarks_not_compared
+
+
+def main(args=None):
+
+  parser = argparse.ArgumentParser(description='Benchmark suite of the MSF state estimator')
+  parser.add_argument('-c', '--config', default=default_config_param_yaml_file_name, help='Config of the state estimator (YAML)')
+  parser.add_argument('-n', '--num-iter', type=int, default=5000, help='Iterations per benchmark')
+  parser.add_argument('-o', '--output', default=None, help='Results (JSON). Use the baseline file to update the baseline')
+  parser.add_argument('-b', '--baseline', default=default_baseline_file_name, help='Baseline results (JSON)')
+  parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='Tolerated relative increase of p50 over the baseline')
+  args = parser.parse_args(args)
+
+  with open(args.config, 'r') as file:
+    config_param = yaml.load(file, Loader=SafeLoader)['msf_state_estimator']
+
+  results = runBenchmarks(config_param, args.num_iter)
+
+  # Report
+  print("{:<48s} {:>12s} {:>10s} {:>10s} {:>10s}".format('benchmark', 'ops/s', 'mean [us]', 'p50 [us]', 'p99 [us]'))
+  for benchmark_name, benchmark_results in results.items():
+    if('skipped' in benchmark_results):
+      print("{:<48s} skipped ({})".format(benchmark_name, benchmark_results['skipped']))
+      continue
+    print("{:<48s} {:>12.0f} {:>10.2f} {:>10.2f} {:>10.2f}".format(benchmark_name, benchmark_results['ops_per_sec'], benchmark_results['mean_us'], benchmark_results['p50_us'], benchmark_results['p99_us']))
+
+  # Save
+  if(args.output is not None):
+    with open(args.output, 'w') as file:
+      json.dump({'machine': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__, 'num_iter': args.num_iter, 'results': results}, file, indent=2)
+
+  # Compare against the baseline
+  if(args.baseline is None or not os.path.exists(args.baseline) or os.path.abspath(args.baseline) == os.path.abspath(args.output or '')):
+    return 0
+
+  with open(args.baseline, 'r') as file:
+    results_baseline = json.load(file)['results']
+
+  regressions, benchmarks_not_compared = compareBaseline(results, results_baseline, args.tolerance)
+  for benchmark_name in benchmarks_not_compared:
+    print("Not compared against the baseline (skipped or no baseline): {}".format(benchmark_name))
+  if(not regressions):
+    print("No regression against the baseline (p50, tolerance {:.0f} %)".format(100*args.tolerance))
+    return 0
+
+  for benchmark_name, p50_us, p50_us_baseline in regressions:
+    print("REGRESSION {}: p50 {:.2f} us vs {:.2f} us baseline ({:+.0f} %)".format(benchmark_name, p50_us, p50_us_baseline, 100*(p50_us/p50_us_baseline-1.0)))
+
+  return 1
+
+
+''' MAIN '''
+if __name__ == '__main__':
+
+  raise SystemExit(main())
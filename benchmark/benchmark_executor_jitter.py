@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import argparse
+
+import copy
+
+import os
+
+import tempfile
+
+import threading
+
+import time
+
+# pyyaml - https://pyyaml.org/wiki/PyYAMLDocumentation
+import yaml
+from yaml.loader import SafeLoader
+
+# ROS
+import rclpy
+from rclpy.executors import SingleThreadedExecutor
+
+from geometry_msgs.msg import PointStamped
+from geometry_msgs.msg import QuaternionStamped
+from geometry_msgs.msg import TwistStamped
+
+from ars_msf_state_estimator.ars_msf_state_estimator_ros import ArsMsfStateEstimatorRos
+
+
+# Jitter of the state estim loop timer of the ROS node under bursts of
+# measurements, for each executor configuration:
+# - single_threaded: measurement callbacks and loop timer on one thread
+# - multi_threaded: ingestion and estimation callback groups in parallel
+# - ingestion_thread: measurement subscriptions on a dedicated thread
+#
+# A publisher node sends bursts of measurements of the three sensors. The
+# jitter and the missed deadlines are the ones of the node latency
+# instrumentation (as published on /diagnostics). Requires ROS
+
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+
+default_config_param_yaml_file_name = os.path.join(benchmark_dir, '..', 'config', 'config_msf_state_estimator.yaml')
+
+
+executor_configs = {
+  'single_threaded': {'type': 'single_threaded', 'flag_ingestion_thread': False},
+  'multi_threaded': {'type': 'multi_threaded', 'flag_ingestion_thread': False},
+  'ingestion_thread': {'type': 'single_threaded', 'flag_ingestion_thread': True},
+}
+
+
+def createMeasBurstNode(burst_size, burst_freq):
+
+  meas_burst_node = rclpy.create_node('benchmark_meas_burst')
+
+  meas_robot_posi_pub = meas_burst_node.create_publisher(PointStamped, 'meas_robot_position', qos_profile=1000)
+  meas_robot_atti_pub = meas_burst_node.create_publisher(QuaternionStamped, 'meas_robot_attitude', qos_profile=1000)
+  meas_robot_vel_robot_pub = meas_burst_node.create_publisher(TwistStamped, 'meas_robot_velocity_robot', qos_profile=1000)
+
+  def measBurstTimerCallback():
+    stamp_msg = meas_burst_node.get_clock().now().to_msg()
+    for _ in range(burst_size):
+      robot_position_msg = PointStamped()
+      robot_position_msg.header.stamp = stamp_msg
+      meas_robot_posi_pub.publish(robot_position_msg)
+      robot_attitude_msg = QuaternionStamped()
+      robot_attitude_msg.header.stamp = stamp_msg
+      robot_attitude_msg.quaternion.w = 1.0
+      meas_robot_atti_pub.publish(robot_attitude_msg)
+      robot_vel_msg = TwistStamped()
+      robot_vel_msg.header.stamp = stamp_msg
+      meas_robot_vel_robot_pub.publish(robot_vel_msg)
+
+  meas_burst_node.create_timer(1.0/burst_freq, measBurstTimerCallback)
+
+  return meas_burst_node
+
+
+def benchmarkExecutor(config_param, executor_config, duration, burst_size, burst_freq):
+
+  # Config of the node: executor under test, latency instrumentation on
+  config_param = copy.deepcopy(config_param)
+  config_param['state_estim_mode'] = 'timer'
+  config_param['executor'].update(executor_config)
+  config_param['latency']['flag_enabled'] = True
+  # No reset of the summaries by the diagnostics during the run
+  config_param['latency']['diagnostics_freq'] = 1.0/(duration+10.0)
+
+  with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as file:
+    yaml.dump({'msf_state_estimator': config_param}, file)
+    config_param_yaml_file_name = file.name
+
+  rclpy.init(args=['--ros-args', '-p', 'config_param_msf_state_estimator_yaml_file:='+config_param_yaml_file_name])
+
+  try:
+    msf_state_estimator_ros = ArsMsfStateEstimatorRos()
+    msf_state_estimator_ros.open()
+
+    meas_burst_node = createMeasBurstNode(burst_size, burst_freq)
+    meas_burst_executor = SingleThreadedExecutor()
+    meas_burst_executor.add_node(meas_burst_node)
+
+    def spinNode():
+      try:
+        msf_state_estimator_ros.run()
+      except rclpy.executors.ExternalShutdownException:
+        pass
+
+    node_thread = threading.Thread(target=spinNode, daemon=True)
+    meas_burst_thread = threading.Thread(target=meas_burst_executor.spin, daemon=True)
+    node_thread.start()
+    meas_burst_thread.start()
+
+    # Warm-up, then measure
+    time.sleep(1.0)
+    msf_state_estimator_ros.latency.getSummary(flag_reset=True)
+    time.sleep(duration)
+    latency_summary = msf_state_estimator_ros.latency.getSummary()
+
+  finally:
+    rclpy.try_shutdown()
+    os.remove(config_param_yaml_file_name)
+
+  return {
+    'timer_jitter_p50_us': latency_summary['timer_jitter']['p50_us'],
+    'timer_jitter_p99_us': latency_summary['timer_jitter']['p99_us'],
+    'timer_jitter_max_us': latency_summary['timer_jitter']['max_us'],
+    'num_ticks': latency_summary['timer_jitter']['count'],
+    'timer_deadlines_missed': latency_summary['timer_deadlines_missed']['count'],
+  }
+
+
+def main(args=None):
+
+  parser = argparse.ArgumentParser(description='Jitter of the state estim loop timer per executor configuration')
+  parser.add_argument('-c', '--config', default=default_config_param_yaml_file_name, help='Config of the state estimator (YAML)')
+  parser.add_argument('-d', '--duration', type=float, default=10.0, help='Duration per configuration [s]')
+  parser.add_argument('--burst-size', type=int, default=50, help='Messages per sensor per burst')
+  parser.add_argument('--burst-freq', type=float, default=20.0, help='Bursts per second')
+  args = parser.parse_args(args)
+
+  with open(args.config, 'r') as file:
+    config_param = yaml.load(file, Loader=SafeLoader)['msf_state_estimator']
+
+  print("{:<20s} {:>8s} {:>12s} {:>12s} {:>12s} {:>8s}".format('executor', 'ticks', 'p50 [us]', 'p99 [us]', 'max [us]', 'missed'))
+  for executor_name, executor_config in executor_configs.items():
+    results = benchmarkExecutor(config_param, executor_config, args.duration, args.burst_size, args.burst_freq)
+    print("{:<20s} {:>8d} {:>12.1f} {:>12.1f} {:>12.1f} {:>8d}".format(executor_name, results['num_ticks'], results['timer_jitter_p50_us'], results['timer_jitter_p99_us'], results['timer_jitter_max_us'], results['timer_deadlines_missed']))
+
+  return 0
+
+
+''' MAIN '''
+if __name__ == '__main__':
+
+  raise SystemExit(main())
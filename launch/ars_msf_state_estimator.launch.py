@@ -41,6 +41,11 @@ def generate_launch_description():
         description='Topic meas_robot_velocity_robot'
     )
 
+    meas_robot_imu_topic_arg = DeclareLaunchArgument(
+        'meas_robot_imu_topic', default_value='/meas_robot_imu',
+        description='Topic meas_robot_imu'
+    )
+
     estim_robot_pose_topic_arg = DeclareLaunchArgument(
         'estim_robot_pose_topic', default_value='/estim_robot_pose',
         description='Topic estim_robot_pose'
@@ -72,6 +77,33 @@ def generate_launch_description():
     )
 
 
+    estim_robot_pose_imu_topic_arg = DeclareLaunchArgument(
+        'estim_robot_pose_imu_topic', default_value='/estim_robot_pose_imu',
+        description='Topic estim_robot_pose_imu'
+    )
+
+    estim_robot_velocity_world_imu_topic_arg = DeclareLaunchArgument(
+        'estim_robot_velocity_world_imu_topic', default_value='/estim_robot_velocity_world_imu',
+        description='Topic estim_robot_velocity_world_imu'
+    )
+
+
+    estim_robot_state_query_topic_arg = DeclareLaunchArgument(
+        'estim_robot_state_query_topic', default_value='/estim_robot_state_query',
+        description='Topic estim_robot_state_query'
+    )
+
+    estim_robot_pose_cov_query_topic_arg = DeclareLaunchArgument(
+        'estim_robot_pose_cov_query_topic', default_value='/estim_robot_pose_cov_query',
+        description='Topic estim_robot_pose_cov_query'
+    )
+
+    estim_robot_velocity_world_cov_query_topic_arg = DeclareLaunchArgument(
+        'estim_robot_velocity_world_cov_query_topic', default_value='/estim_robot_velocity_world_cov_query',
+        description='Topic estim_robot_velocity_world_cov_query'
+    )
+
+
     # Get the launch configuration for parameters
     ars_msf_state_estimator_conf_yaml_file = PathJoinSubstitution([FindPackageShare('ars_msf_state_estimator'), 'config', LaunchConfiguration('config_param_msf_state_estimator_yaml_file')])
     
@@ -87,12 +119,18 @@ def generate_launch_description():
           ('meas_robot_position', LaunchConfiguration('meas_robot_position_topic')),
           ('meas_robot_attitude', LaunchConfiguration('meas_robot_attitude_topic')),
           ('meas_robot_velocity_robot', LaunchConfiguration('meas_robot_velocity_robot_topic')),
+          ('meas_robot_imu', LaunchConfiguration('meas_robot_imu_topic')),
           ('estim_robot_pose', LaunchConfiguration('estim_robot_pose_topic')),
           ('estim_robot_pose_cov', LaunchConfiguration('estim_robot_pose_cov_topic')),
           ('estim_robot_velocity_robot', LaunchConfiguration('estim_robot_velocity_robot_topic')),
           ('estim_robot_velocity_robot_cov', LaunchConfiguration('estim_robot_velocity_robot_cov_topic')),
           ('estim_robot_velocity_world', LaunchConfiguration('estim_robot_velocity_world_topic')),
           ('estim_robot_velocity_world_cov', LaunchConfiguration('estim_robot_velocity_world_cov_topic')),
+          ('estim_robot_pose_imu', LaunchConfiguration('estim_robot_pose_imu_topic')),
+          ('estim_robot_velocity_world_imu', LaunchConfiguration('estim_robot_velocity_world_imu_topic')),
+          ('estim_robot_state_query', LaunchConfiguration('estim_robot_state_query_topic')),
+          ('estim_robot_pose_cov_query', LaunchConfiguration('estim_robot_pose_cov_query_topic')),
+          ('estim_robot_velocity_world_cov_query', LaunchConfiguration('estim_robot_velocity_world_cov_query_topic')),
         ]
     )
 
@@ -104,11 +142,17 @@ def generate_launch_description():
         meas_robot_position_topic_arg,
         meas_robot_attitude_topic_arg,
         meas_robot_velocity_robot_topic_arg,
+        meas_robot_imu_topic_arg,
         estim_robot_pose_topic_arg,
         estim_robot_pose_cov_topic_arg,
         estim_robot_velocity_robot_topic_arg,
         estim_robot_velocity_robot_cov_topic_arg,
         estim_robot_velocity_world_topic_arg,
         estim_robot_velocity_world_cov_topic_arg,
+        estim_robot_pose_imu_topic_arg,
+        estim_robot_velocity_world_imu_topic_arg,
+        estim_robot_state_query_topic_arg,
+        estim_robot_pose_cov_query_topic_arg,
+        estim_robot_velocity_world_cov_query_topic_arg,
         ars_msf_state_estimator_node,
     ])
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+from launch import LaunchDescription
+from launch.actions import DeclareLaunchArgument
+from launch.substitutions import LaunchConfiguration, PathJoinSubstitution
+from launch_ros.actions import Node
+from launch_ros.substitutions import FindPackageShare
+
+
+def generate_launch_description():
+    # Define the arguments
+    screen_arg = DeclareLaunchArgument(
+        'screen', default_value='screen',
+        description='Output setting for the nodes'
+    )
+
+    ars_msf_state_estimator_bank_node_name_arg = DeclareLaunchArgument(
+        'ars_msf_state_estimator_bank_node_name', default_value='ars_msf_state_estimator_bank_node',
+        description='Name of the node'
+    )
+
+    ars_msf_state_estimator_bank_yaml_file_arg=DeclareLaunchArgument(
+      'config_param_msf_state_estimator_bank_yaml_file',
+      default_value=PathJoinSubstitution(['config_msf_state_estimator_bank.yaml']), 
+      description='Path to the config_param_msf_state_estimator_bank_yaml_file'
+    )
+
+
+    # Get the launch configuration for parameters
+    ars_msf_state_estimator_bank_conf_yaml_file = PathJoinSubstitution([FindPackageShare('ars_msf_state_estimator'), 'config', LaunchConfiguration('config_param_msf_state_estimator_bank_yaml_file')])
+    
+
+    # Define the nodes
+    # Topics are namespaced per robot: <robot_namespace>/meas_robot_position, ...
+    ars_msf_state_estimator_bank_node = Node(
+        package='ars_msf_state_estimator',
+        executable='ars_msf_state_estimator_bank_ros_node',
+        name=LaunchConfiguration('ars_msf_state_estimator_bank_node_name'),
+        output=LaunchConfiguration('screen'),
+        parameters=[{'config_param_msf_state_estimator_bank_yaml_file': ars_msf_state_estimator_bank_conf_yaml_file}],
+    )
+
+
+    return LaunchDescription([
+        screen_arg,
+        ars_msf_state_estimator_bank_node_name_arg,
+        ars_msf_state_estimator_bank_yaml_file_arg,
+        ars_msf_state_estimator_bank_node,
+    ])
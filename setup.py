@@ -23,5 +23,7 @@ setup(
  tests_require=['pytest'],
  entry_points={'console_scripts': [
  		'ars_msf_state_estimator_ros_node = ars_msf_state_estimator.ars_msf_state_estimator_ros_node:main',
+ 		'ars_msf_state_estimator_bank_ros_node = ars_msf_state_estimator.ars_msf_state_estimator_bank_ros_node:main',
+ 		'ars_msf_state_estimator_replay = ars_msf_state_estimator.ars_msf_state_estimator_replay_main:main',
         ],},
 )
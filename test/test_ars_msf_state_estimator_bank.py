@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_bank import ArsMsfStateEstimatorBank
+
+
+def getConfigParam():
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.3), np.sin(0.3)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.2],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.2, 0.3, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+      'meas_attitude': {'cov_diag': [0.1]},
+      'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+      'meas_velo_ang': {'cov_diag': [0.2]},
+    },
+    'history': {'flag_enabled': False, 'size': 10},
+  }
+
+  return config_param
+
+
+def test_bank_equals_independent_estimators():
+
+  num_robots = 5
+
+  msf_state_estimator_bank = ArsMsfStateEstimatorBank(num_robots)
+  msf_state_estimator_bank.setConfigParameters(getConfigParam())
+
+  msf_state_estimators = []
+  for idx_robot in range(num_robots):
+    msf_state_estimator = ArsMsfStateEstimator()
+    msf_state_estimator.setConfigParameters(getConfigParam())
+    msf_state_estimators.append(msf_state_estimator)
+
+  rng = np.random.default_rng(0)
+
+  for step in range(1, 50):
+
+    timestamp = 1000000000 + step*20000000
+
+    msf_state_estimator_bank.predict(timestamp)
+    for msf_state_estimator in msf_state_estimators:
+      msf_state_estimator.predict(timestamp)
+
+    # Each robot gets a different combination of measurements
+    for idx_robot in range(num_robots):
+      meas_mask = rng.integers(0, 8)
+      meas_z_robot_posi = rng.normal(size=(3,))
+      meas_z_robot_atti_ang = rng.uniform(-np.pi, np.pi)
+      meas_z_robot_atti_quat_simp = np.array([np.cos(0.5*meas_z_robot_atti_ang), np.sin(0.5*meas_z_robot_atti_ang)])
+      meas_z_robot_velo_lin_robot = rng.normal(size=(3,))
+      meas_z_robot_velo_ang_robot = rng.normal(size=(1,))
+      if(meas_mask & ArsMsfStateEstimator.meas_mask_robot_posi):
+        msf_state_estimator_bank.setMeasRobotPosition(idx_robot, timestamp, meas_z_robot_posi)
+        msf_state_estimators[idx_robot].setMeasRobotPosition(timestamp, meas_z_robot_posi)
+      if(meas_mask & ArsMsfStateEstimator.meas_mask_robot_atti):
+        msf_state_estimator_bank.setMeasRobotAttitude(idx_robot, timestamp, meas_z_robot_atti_quat_simp)
+        msf_state_estimators[idx_robot].setMeasRobotAttitude(timestamp, meas_z_robot_atti_quat_simp)
+      if(meas_mask & ArsMsfStateEstimator.meas_mask_robot_vel_robot):
+        msf_state_estimator_bank.setMeasRobotVelRobot(idx_robot, timestamp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot)
+        msf_state_estimators[idx_robot].setMeasRobotVelRobot(timestamp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot)
+
+    msf_state_estimator_bank.update()
+    for msf_state_estimator in msf_state_estimators:
+      msf_state_estimator.update()
+
+  for idx_robot in range(num_robots):
+    msf_state_estimator = msf_state_estimators[idx_robot]
+    np.testing.assert_allclose(msf_state_estimator_bank.estim_robot_posi[idx_robot], msf_state_estimator.estim_robot_posi, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(msf_state_estimator_bank.estim_robot_atti_quat_simp[idx_robot], msf_state_estimator.estim_robot_atti_quat_simp, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(msf_state_estimator_bank.estim_robot_velo_lin_world[idx_robot], msf_state_estimator.estim_robot_velo_lin_world, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(msf_state_estimator_bank.estim_robot_velo_ang_world[idx_robot], msf_state_estimator.estim_robot_velo_ang_world, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(msf_state_estimator_bank.estim_state_cov[idx_robot], msf_state_estimator.estim_state_cov, rtol=1e-8, atol=1e-10)
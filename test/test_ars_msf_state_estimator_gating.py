@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_gating import ArsMsfStateEstimatorGating
+
+
+meas_mask_posi = ArsMsfStateEstimator.meas_mask_robot_posi
+meas_mask_atti = ArsMsfStateEstimator.meas_mask_robot_atti
+meas_mask_velo = ArsMsfStateEstimator.meas_mask_robot_vel_robot
+meas_mask_all = meas_mask_posi | meas_mask_atti | meas_mask_velo
+
+
+def getConfigParam(update_mode, flag_gating_enabled, flag_steady_state_enabled=False):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.15), np.sin(0.15)],
+        'robot_vel_lin_world': [0.0, 0.0, 0.0],
+        'robot_vel_ang_world': [0.0],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.02, 0.03, 0.04]},
+      'meas_attitude': {'cov_diag': [0.01]},
+      'meas_velo_lin': {'cov_diag': [0.05, 0.05, 0.07]},
+      'meas_velo_ang': {'cov_diag': [0.02]},
+    },
+    'update_mode': update_mode,
+    'history': {'flag_enabled': False, 'size': 10},
+    'steady_state': {'flag_enabled': flag_steady_state_enabled, 'conv_tol': 1.0e-4, 'conv_num_cycles': 5, 'delta_time_tol': 0.05, 'robot_atti_ang_tol': 0.02, 'robot_velo_lin_tol': 0.05},
+    'gating': {'flag_enabled': flag_gating_enabled, 'confidence': {'meas_position': 0.99, 'meas_attitude': 0.99, 'meas_velocity': 0.99}},
+  }
+
+  return config_param
+
+
+def createEstimator(update_mode, flag_gating_enabled):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(update_mode, flag_gating_enabled))
+
+  # Correlated covariance
+  rng = np.random.default_rng(0)
+  mat_A = rng.normal(size=(8, 8))
+  msf_state_estimator.estim_state_cov = 0.1*np.matmul(mat_A, mat_A.T) + 0.1*np.eye(8)
+
+  return msf_state_estimator
+
+
+def getMeas(meas_mask_outlier=0):
+
+  # Consistent with the initial state, except the outlier
+  meas_z_robot_posi = np.array([0.15, -0.25, 1.05])
+  meas_z_robot_atti_ang = 0.35
+  meas_z_robot_velo_lin_robot = np.array([0.1, -0.1, 0.05])
+  meas_z_robot_velo_ang_robot = np.array([0.05])
+
+  if(meas_mask_outlier & meas_mask_posi):
+    meas_z_robot_posi += np.array([20.0, 0.0, 0.0])
+  if(meas_mask_outlier & meas_mask_atti):
+    meas_z_robot_atti_ang += 2.5
+  if(meas_mask_outlier & meas_mask_velo):
+    meas_z_robot_velo_lin_robot += np.array([0.0, 10.0, 0.0])
+
+  meas_z_robot_atti_quat_simp = np.array([np.cos(0.5*meas_z_robot_atti_ang), np.sin(0.5*meas_z_robot_atti_ang)])
+
+  # Fields of the samples, by mask of the measurement
+  return {
+    meas_mask_posi: (meas_z_robot_posi, ),
+    meas_mask_atti: (meas_z_robot_atti_quat_simp, ),
+    meas_mask_velo: (meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot),
+  }
+
+
+def assertEstimatorsEqual(msf_state_estimator, msf_state_estimator_ref):
+
+  rtol = 1e-9
+  atol = 1e-9
+
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, msf_state_estimator_ref.estim_robot_posi, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_atti_quat_simp, msf_state_estimator_ref.estim_robot_atti_quat_simp, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_velo_lin_world, msf_state_estimator_ref.estim_robot_velo_lin_world, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_velo_ang_world, msf_state_estimator_ref.estim_robot_velo_ang_world, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, msf_state_estimator_ref.estim_state_cov, rtol=rtol, atol=atol)
+
+
+def test_gating_thresholds_table():
+
+  gating = ArsMsfStateEstimatorGating()
+
+  assert gating.getThreshold(1, 0.95) == pytest.approx(3.841459)
+  assert gating.getThreshold(3, 0.99) == pytest.approx(11.344867)
+  assert gating.getThreshold(4, 0.999) == pytest.approx(18.466827)
+
+  with pytest.raises(ValueError):
+    gating.getThreshold(7, 0.99)
+
+  config_param = getConfigParam('batch', True)['gating']
+  config_param['confidence']['meas_position'] = 0.98
+  with pytest.raises(ValueError):
+    gating.setConfigParameters(config_param, {'meas_position': meas_mask_posi})
+
+
+@pytest.mark.parametrize('update_mode', ['batch', 'sequential_block', 'sequential_scalar'])
+def test_gating_accepts_consistent_meas(update_mode):
+
+  msf_state_estimator = createEstimator(update_mode, False)
+  msf_state_estimator.updateState(meas_mask_all, getMeas())
+
+  msf_state_estimator_gating = createEstimator(update_mode, True)
+  msf_state_estimator_gating.updateState(meas_mask_all, getMeas())
+
+  assert msf_state_estimator_gating.getNumMeasRejected() == {meas_mask_posi: 0, meas_mask_atti: 0, meas_mask_velo: 0}
+  assertEstimatorsEqual(msf_state_estimator_gating, msf_state_estimator)
+
+
+@pytest.mark.parametrize('update_mode', ['batch', 'sequential_block'])
+@pytest.mark.parametrize('meas_mask_outlier', [meas_mask_posi, meas_mask_atti, meas_mask_velo, meas_mask_posi | meas_mask_velo])
+def test_gating_drops_rejected_blocks(update_mode, meas_mask_outlier):
+
+  # Same as the update without the rejected measurements
+  msf_state_estimator = createEstimator('batch', False)
+  msf_state_estimator.updateState(meas_mask_all & ~meas_mask_outlier, getMeas())
+
+  msf_state_estimator_gating = createEstimator(update_mode, True)
+  msf_state_estimator_gating.updateState(meas_mask_all, getMeas(meas_mask_outlier))
+
+  num_meas_rejected = msf_state_estimator_gating.getNumMeasRejected()
+  for meas_mask in [meas_mask_posi, meas_mask_atti, meas_mask_velo]:
+    assert num_meas_rejected[meas_mask] == int(bool(meas_mask & meas_mask_outlier))
+  assertEstimatorsEqual(msf_state_estimator_gating, msf_state_estimator)
+
+
+def test_gating_steady_state_falls_back():
+
+  rng = np.random.default_rng(3)
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam('batch', True, True))
+  msf_state_estimator.predict(1000000000)
+
+  def stepCycle(timestamp, meas_robot_posi_outlier=np.zeros((3,))):
+    # Robot at rest, all the sensors at every cycle
+    meas_robot_posi = np.array([0.1, -0.2, 1.0]) + 0.01*rng.normal(size=(3,)) + meas_robot_posi_outlier
+    meas_robot_velo = 0.01*rng.normal(size=(4,))
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.setMeasRobotPosition(timestamp, meas_robot_posi)
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.15), np.sin(0.15)]))
+    msf_state_estimator.setMeasRobotVelRobot(timestamp, meas_robot_velo[0:3], meas_robot_velo[3:4])
+    msf_state_estimator.update()
+
+  # 50 Hz
+  timestamp = 1000000000
+  for step in range(100):
+    timestamp += 20000000
+    stepCycle(timestamp)
+
+  steady_state = msf_state_estimator.steady_state
+  num_update_steady = steady_state.num_update_steady
+  assert num_update_steady > 0
+  assert msf_state_estimator.getNumMeasRejected()[meas_mask_posi] == 0
+
+  # Outlier: full EKF, without the position
+  estim_robot_posi = msf_state_estimator.estim_robot_posi.copy()
+  timestamp += 20000000
+  stepCycle(timestamp, np.array([20.0, 0.0, 0.0]))
+
+  assert steady_state.num_update_steady == num_update_steady
+  assert steady_state.phase is None
+  assert msf_state_estimator.getNumMeasRejected() == {meas_mask_posi: 1, meas_mask_atti: 0, meas_mask_velo: 0}
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, estim_robot_posi, atol=0.01)
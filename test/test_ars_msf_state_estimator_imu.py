@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+
+
+def getConfigParam(flag_imu_enabled, imu_buffer_size=1000):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.15), np.sin(0.15)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.2],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.0004, 0.0004, 0.0004]},
+      'meas_attitude': {'cov_diag': [0.0001]},
+      'meas_velo_lin': {'cov_diag': [0.05, 0.05, 0.07]},
+      'meas_velo_ang': {'cov_diag': [0.02]},
+    },
+    'history': {'flag_enabled': False, 'size': 10},
+    'imu': {'flag_enabled': flag_imu_enabled, 'buffer_size': imu_buffer_size, 'cov_diag_lin_acc': [0.01, 0.02, 0.03], 'cov_diag_ang_vel': [0.001], 'gravity': 9.81},
+  }
+
+  return config_param
+
+
+def createEstimator(flag_imu_enabled, imu_buffer_size=1000):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(flag_imu_enabled, imu_buffer_size))
+  msf_state_estimator.predict(1000000000)
+
+  # Correlated covariance
+  rng = np.random.default_rng(0)
+  mat_A = rng.normal(size=(8, 8))
+  msf_state_estimator.estim_state_cov = 0.1*np.matmul(mat_A, mat_A.T) + 0.1*np.eye(8)
+
+  return msf_state_estimator
+
+
+def predictPerSample(msf_state_estimator, imu_samples, timestamp_end):
+
+  # Reference: state and covariance propagated one IMU sample after the
+  # other (same discretisation and linearisation)
+
+  config_param_imu = getConfigParam(True)['imu']
+  gravity = np.array([0.0, 0.0, -config_param_imu['gravity']])
+  cov_lin_acc = np.array(config_param_imu['cov_diag_lin_acc'])
+  cov_ang_vel = config_param_imu['cov_diag_ang_vel'][0]
+
+  robot_posi = msf_state_estimator.estim_robot_posi.copy()
+  robot_atti_ang = 2.0*np.arctan2(msf_state_estimator.estim_robot_atti_quat_simp[1], msf_state_estimator.estim_robot_atti_quat_simp[0])
+  robot_velo_lin = msf_state_estimator.estim_robot_velo_lin_world.copy()
+  estim_P = msf_state_estimator.estim_state_cov.copy()
+
+  timestamps = [timestamp for timestamp, _, _ in imu_samples] + [timestamp_end]
+  for idx_sample, (timestamp, lin_acc, ang_vel) in enumerate(imu_samples):
+    delta_time = (timestamps[idx_sample+1] - max(timestamp, msf_state_estimator.estim_state_timestamp))*1e-9
+    if(delta_time <= 0.0):
+      continue
+
+    robot_atti_ang_mid = robot_atti_ang + 0.5*ang_vel*delta_time
+    rot_mat = np.array([[np.cos(robot_atti_ang_mid), -np.sin(robot_atti_ang_mid), 0.0], [np.sin(robot_atti_ang_mid), np.cos(robot_atti_ang_mid), 0.0], [0.0, 0.0, 1.0]])
+    acc = np.matmul(rot_mat, lin_acc)
+    acc_g = acc + gravity
+
+    # Covariance
+    jac_Fx = np.eye(8)
+    jac_Fx[7, 7] = 0.0
+    jac_Fx[0:3, 4:7] = delta_time*np.eye(3)
+    jac_Fx[0:2, 3] = 0.5*delta_time*delta_time*np.array([-acc[1], acc[0]])
+    jac_Fx[4:6, 3] = delta_time*np.array([-acc[1], acc[0]])
+    jac_Fn = np.zeros((8, 4))
+    jac_Fn[3, 0] = delta_time
+    jac_Fn[0:3, 1:4] = 0.5*delta_time*delta_time*rot_mat
+    jac_Fn[4:7, 1:4] = delta_time*rot_mat
+    cov_noise = np.diag(np.concatenate([[cov_ang_vel], cov_lin_acc]))/delta_time
+    estim_P = np.matmul(np.matmul(jac_Fx, estim_P), jac_Fx.T) + np.matmul(np.matmul(jac_Fn, cov_noise), jac_Fn.T)
+    estim_P[7, 7] = cov_ang_vel/delta_time
+
+    # State
+    robot_posi = robot_posi + robot_velo_lin*delta_time + 0.5*acc_g*delta_time*delta_time
+    robot_velo_lin = robot_velo_lin + acc_g*delta_time
+    robot_atti_ang = robot_atti_ang + ang_vel*delta_time
+    robot_velo_ang = ang_vel
+
+  return robot_posi, robot_atti_ang, robot_velo_lin, robot_velo_ang, estim_P
+
+
+def getImuSamples(rng, timestamp_start, num_samples, delta_time_ns=1000000):
+
+  imu_samples = []
+  for idx_sample in range(num_samples):
+    timestamp = timestamp_start + idx_sample*delta_time_ns + int(rng.integers(0, delta_time_ns//4))
+    lin_acc = np.array([1.0, -0.5, 9.81]) + rng.normal(size=(3,))
+    ang_vel = 0.5 + 0.2*rng.normal()
+    imu_samples.append((timestamp, lin_acc, ang_vel))
+
+  return imu_samples
+
+
+@pytest.mark.parametrize('imu_buffer_size', [1000, 28])
+def test_imu_preintegration_equals_per_sample_propagation(imu_buffer_size):
+
+  rng = np.random.default_rng(1)
+
+  msf_state_estimator = createEstimator(True, imu_buffer_size)
+
+  # Samples before the state, within the interval, and after the end
+  # The small buffer wraps around, and still covers the interval
+  imu_samples = getImuSamples(rng, 1000000000-5000000, 30)
+  for timestamp, lin_acc, ang_vel in imu_samples:
+    assert msf_state_estimator.setMeasImu(timestamp, lin_acc, ang_vel)
+  timestamp_end = 1000000000+20000000+300000
+
+  robot_posi, robot_atti_ang, robot_velo_lin, robot_velo_ang, estim_P = predictPerSample(msf_state_estimator, [imu_sample for imu_sample in imu_samples if imu_sample[0] < timestamp_end], timestamp_end)
+
+  msf_state_estimator.predict(timestamp_end)
+
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, robot_posi, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_atti_quat_simp, [np.cos(0.5*robot_atti_ang), np.sin(0.5*robot_atti_ang)], rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_velo_lin_world, robot_velo_lin, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_velo_ang_world, [robot_velo_ang], rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, estim_P, rtol=1e-6, atol=1e-9)
+
+
+def test_imu_out_of_order_sample_dropped():
+
+  msf_state_estimator = createEstimator(True)
+
+  assert msf_state_estimator.setMeasImu(1000000000, np.array([0.0, 0.0, 9.81]), 0.0)
+  assert not msf_state_estimator.setMeasImu(999000000, np.array([0.0, 0.0, 9.81]), 0.0)
+  assert msf_state_estimator.imu.num_dropped == 1
+
+
+def test_imu_no_samples_constant_velocity():
+
+  msf_state_estimator_imu = createEstimator(True)
+  msf_state_estimator_imu.predict(1020000000)
+
+  msf_state_estimator = createEstimator(False)
+  msf_state_estimator.predict(1020000000)
+
+  np.testing.assert_array_equal(msf_state_estimator_imu.estim_robot_posi, msf_state_estimator.estim_robot_posi)
+  np.testing.assert_array_equal(msf_state_estimator_imu.estim_state_cov, msf_state_estimator.estim_state_cov)
+
+
+def test_imu_high_rate_snapshot():
+
+  rng = np.random.default_rng(2)
+
+  msf_state_estimator = createEstimator(True)
+  msf_state_estimator.publishStateSnapshot()
+  estim_state_snapshot = msf_state_estimator.getStateSnapshot()
+  msf_state_estimator_ref = createEstimator(True)
+
+  imu_samples = getImuSamples(rng, 1000000000, 15)
+  for timestamp, lin_acc, ang_vel in imu_samples:
+    msf_state_estimator.setMeasImu(timestamp, lin_acc, ang_vel)
+    msf_state_estimator_ref.setMeasImu(timestamp, lin_acc, ang_vel)
+
+  estim_state_snapshot_imu = msf_state_estimator.getStateSnapshotImu()
+
+  # Propagated to the last sample, mean only
+  timestamp_imu = imu_samples[-1][0]
+  msf_state_estimator_ref.predict(timestamp_imu)
+
+  assert estim_state_snapshot_imu.timestamp == timestamp_imu
+  np.testing.assert_allclose(estim_state_snapshot_imu.robot_posi, msf_state_estimator_ref.estim_robot_posi, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(estim_state_snapshot_imu.robot_atti_quat_simp, msf_state_estimator_ref.estim_robot_atti_quat_simp, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(estim_state_snapshot_imu.robot_velo_lin_world, msf_state_estimator_ref.estim_robot_velo_lin_world, rtol=1e-9, atol=1e-12)
+  assert estim_state_snapshot_imu.robot_velo_ang_world[0] == imu_samples[-1][2]
+  np.testing.assert_array_equal(estim_state_snapshot_imu.state_cov, estim_state_snapshot.state_cov)
+
+  # The filter is not modified
+  assert msf_state_estimator.getStateSnapshot() is estim_state_snapshot
+  assert msf_state_estimator.estim_state_timestamp == 1000000000
+
+
+def test_imu_tracks_circular_motion():
+
+  # Robot on a circle (radius 2 m, 0.5 rad/s), heading along the path.
+  # IMU at 1 kHz, position and attitude at 50 Hz
+
+  rng = np.random.default_rng(3)
+
+  radius = 2.0
+  ang_vel = 0.5
+
+  def getTruth(time):
+    robot_atti_ang = ang_vel*time + 0.5*np.pi
+    robot_posi = np.array([radius*np.cos(ang_vel*time), radius*np.sin(ang_vel*time), 1.0])
+    robot_velo_lin = radius*ang_vel*np.array([-np.sin(ang_vel*time), np.cos(ang_vel*time), 0.0])
+    return robot_posi, robot_atti_ang, robot_velo_lin
+
+  config_param = getConfigParam(True)
+  robot_posi, robot_atti_ang, robot_velo_lin = getTruth(0.0)
+  config_param['estimated_state_init']['state'] = {
+    'robot_position': robot_posi.tolist(),
+    'robot_atti_quat_simp': [np.cos(0.5*robot_atti_ang), np.sin(0.5*robot_atti_ang)],
+    'robot_vel_lin_world': robot_velo_lin.tolist(),
+    'robot_vel_ang_world': [ang_vel],
+  }
+  config_param['estimated_state_init']['cov_diag'] = [0.01]*8
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(config_param)
+  msf_state_estimator.predict(1000000000)
+
+  # Centripetal acceleration, in robot frame (heading along the path):
+  # towards the left
+  lin_acc_robot = np.array([0.0, radius*ang_vel*ang_vel, 9.81])
+
+  for step in range(1, 5*50+1):
+    for idx_sample in range(20):
+      time = (step-1)*0.02 + idx_sample*0.001
+      msf_state_estimator.setMeasImu(1000000000+int(round(time*1e9)), lin_acc_robot + 0.05*rng.normal(size=(3,)), ang_vel + 0.01*rng.normal())
+    time = step*0.02
+    timestamp = 1000000000+int(round(time*1e9))
+    robot_posi, robot_atti_ang, robot_velo_lin = getTruth(time)
+    msf_state_estimator.setMeasRobotPosition(timestamp, robot_posi + 0.02*rng.normal(size=(3,)))
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.5*robot_atti_ang), np.sin(0.5*robot_atti_ang)]))
+    msf_state_estimator.update()
+
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, robot_posi, atol=0.03)
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_velo_lin_world, robot_velo_lin, atol=0.1)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from ars_msf_state_estimator.ars_msf_state_estimator_latency import ArsMsfStateEstimatorLatency
+from ars_msf_state_estimator.ars_msf_state_estimator_latency import ArsMsfStateEstimatorLatencyHistogram
+
+
+def test_histogram_percentiles_within_one_bin():
+
+  rng = np.random.default_rng(0)
+  samples = rng.lognormal(mean=np.log(2e5), sigma=1.0, size=10000).astype(np.int64)
+
+  histogram = ArsMsfStateEstimatorLatencyHistogram()
+  for sample in samples.tolist():
+    histogram.addSample(sample)
+
+  summary = histogram.getSummary()
+  assert summary['count'] == samples.shape[0]
+  np.testing.assert_allclose(summary['mean_us'], np.mean(samples)/1e3, rtol=1e-9)
+  np.testing.assert_allclose(summary['max_us'], np.max(samples)/1e3, rtol=1e-9)
+
+  # Bins are 10 per decade: upper edge within a factor 10^0.1 of the percentile
+  for percentile in [50.0, 90.0, 99.0]:
+    percentile_us = np.percentile(samples, percentile)/1e3
+    assert percentile_us <= summary['p{:.0f}_us'.format(percentile)] <= percentile_us*10.0**0.1 + 1e-3
+
+
+def test_latency_summary_reset():
+
+  latency = ArsMsfStateEstimatorLatency(['meas_position'])
+  latency.addSample('receive_delay_meas_position', 3000000)
+  # Negative latencies (clock offsets) are counted as 0
+  latency.addSample('receive_delay_meas_position', -1000)
+
+  summary = latency.getSummary(flag_reset=True)
+  assert summary['receive_delay_meas_position']['count'] == 2
+  assert summary['receive_delay_meas_position']['max_us'] == 3000.0
+  assert summary['compute_update']['count'] == 0
+
+  assert latency.getSummary()['receive_delay_meas_position']['count'] == 0
+
+
+def test_timer_jitter_and_missed_deadlines():
+
+  latency = ArsMsfStateEstimatorLatency()
+
+  # Period 20 ms: on time, 1 ms late, one tick skipped (40 ms)
+  for time_tick in [1000000000, 1020000000, 1041000000, 1081000000]:
+    latency.addTimerTick(time_tick, 20000000)
+
+  summary = latency.getSummary(flag_reset=True)
+  assert summary['timer_jitter']['count'] == 3
+  assert summary['timer_jitter']['max_us'] == 20000.0
+  assert summary['timer_deadlines_missed']['count'] == 1
+
+  assert latency.getSummary()['timer_deadlines_missed']['count'] == 0
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_meas_model import ArsMsfStateEstimatorMeasModel
+
+
+class MeasModelAltitude(ArsMsfStateEstimatorMeasModel):
+
+  # Barometer: altitude above a reference level
+  # z_h = [m_posi_z - altitude_ref]
+
+  altitude_ref = None
+
+  def __init__(self, altitude_ref=0.5):
+
+    super().__init__('meas_altitude', 1)
+
+    self.jac_Hx_const[0, 2] = 1.0
+
+    self.altitude_ref = altitude_ref
+
+    return
+
+  def predictMeas(self, msf_state_estimator, workspace, meas_pred):
+
+    meas_pred[0] = msf_state_estimator.estim_robot_posi[2] - self.altitude_ref
+
+    return
+
+
+class MeasModelYawRate(ArsMsfStateEstimatorMeasModel):
+
+  # Gyroscope: yaw rate. Linear in the state: default h(x)
+  # z_w = [m_vel_ang_z]
+
+  def __init__(self):
+
+    super().__init__('meas_yaw_rate', 1)
+
+    self.jac_Hx_const[0, 7] = 1.0
+
+    return
+
+
+def getConfigParam(update_mode):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.15), np.sin(0.15)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.2],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+      'meas_attitude': {'cov_diag': [0.1]},
+      'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+      'meas_velo_ang': {'cov_diag': [0.2]},
+      'meas_altitude': {'cov_diag': [0.05]},
+    },
+    'update_mode': update_mode,
+  }
+
+  return config_param
+
+
+def createEstimator(update_mode):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  meas_mask_alti = msf_state_estimator.registerMeasModel(MeasModelAltitude())
+  msf_state_estimator.setConfigParameters(getConfigParam(update_mode))
+
+  return msf_state_estimator, meas_mask_alti
+
+
+@pytest.mark.parametrize('update_mode', ['batch', 'sequential_block', 'sequential_scalar'])
+def test_meas_model_plugin_equals_kalman_update(update_mode):
+
+  msf_state_estimator, meas_mask_alti = createEstimator(update_mode)
+  assert meas_mask_alti == 8
+
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+  timestamp += 20000000
+  msf_state_estimator.predict(timestamp)
+
+  # Prior
+  estim_robot_posi = msf_state_estimator.estim_robot_posi.copy()
+  estim_P = msf_state_estimator.estim_state_cov.copy()
+
+  # Position and altitude
+  meas_z_robot_posi = np.array([0.2, -0.1, 1.1])
+  meas_z_alti = np.array([0.45])
+  msf_state_estimator.setMeasRobotPosition(timestamp, meas_z_robot_posi)
+  msf_state_estimator.setMeas(meas_mask_alti, timestamp, meas_z_alti)
+  msf_state_estimator.update()
+
+  # Reference: explicit gain
+  jac_Hx = np.zeros((4, 8))
+  jac_Hx[0:3, 0:3] = np.eye(3)
+  jac_Hx[3, 2] = 1.0
+  cov_meas = np.diag([0.2, 0.3, 0.4, 0.05])
+  innov_meas = np.concatenate([estim_robot_posi - meas_z_robot_posi, [estim_robot_posi[2] - 0.5 - meas_z_alti[0]]])
+  kalman_gain = estim_P @ jac_Hx.T @ np.linalg.inv(jac_Hx @ estim_P @ jac_Hx.T + cov_meas)
+
+  assert msf_state_estimator.meas_mask_last_update == ArsMsfStateEstimator.meas_mask_robot_posi | meas_mask_alti
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, estim_robot_posi - (kalman_gain @ innov_meas)[0:3], rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, estim_P - kalman_gain @ jac_Hx @ estim_P, rtol=1e-9, atol=1e-12)
+
+  # Recorded in the history
+  meas_z_entry = msf_state_estimator.history.getEntryMeas(msf_state_estimator.history.getNumEntries()-1)
+  np.testing.assert_array_equal(meas_z_entry[meas_mask_alti][0], meas_z_alti)
+
+
+def test_meas_model_layouts_cached():
+
+  msf_state_estimator, meas_mask_alti = createEstimator('batch')
+  workspace = msf_state_estimator.workspace
+
+  # Built when first used
+  assert workspace.update == {}
+
+  timestamp = 1000000000
+  for step in range(3):
+    timestamp += 20000000
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.15), np.sin(0.15)]))
+    msf_state_estimator.setMeas(meas_mask_alti, timestamp, np.array([0.5]))
+    msf_state_estimator.update()
+
+  meas_mask = ArsMsfStateEstimator.meas_mask_robot_atti | meas_mask_alti
+  assert list(workspace.update.keys()) == [meas_mask]
+
+  # Stacked in the order of registration
+  workspace_update = workspace.getUpdate(meas_mask)
+  assert workspace_update is workspace.update[meas_mask]
+  assert workspace_update.meas_blocks == [(0, 1), (1, 2)]
+  np.testing.assert_array_equal(workspace_update.cov_meas, np.diag([0.1, 0.05]))
+
+  # Unknown measurement
+  assert workspace.getUpdate(16) is None
+
+
+def test_meas_model_default_linear():
+
+  config_param = getConfigParam('batch')
+  config_param['measurements']['meas_yaw_rate'] = {'cov_diag': [0.02]}
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  meas_mask_yaw_rate = msf_state_estimator.registerMeasModel(MeasModelYawRate())
+  msf_state_estimator.setConfigParameters(config_param)
+
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+
+  # Prior
+  estim_robot_velo_ang = msf_state_estimator.estim_robot_velo_ang_world[0]
+  estim_P = msf_state_estimator.estim_state_cov.copy()
+
+  meas_z_yaw_rate = np.array([0.35])
+  msf_state_estimator.setMeas(meas_mask_yaw_rate, timestamp, meas_z_yaw_rate)
+  msf_state_estimator.update()
+
+  # Reference: explicit gain
+  jac_Hx = np.zeros((1, 8))
+  jac_Hx[0, 7] = 1.0
+  kalman_gain = estim_P @ jac_Hx.T / (estim_P[7, 7] + 0.02)
+  innov_meas = np.array([estim_robot_velo_ang - meas_z_yaw_rate[0]])
+
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_velo_ang_world, [estim_robot_velo_ang - (kalman_gain @ innov_meas)[7]], rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, estim_P - kalman_gain @ jac_Hx @ estim_P, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_meas_queue import ArsMsfStateEstimatorMeasQueue
+
+
+def getConfigParam(flag_history_enabled, depth):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.0, 0.0, 1.0],
+        'robot_atti_quat_simp': [1.0, 0.0],
+        'robot_vel_lin_world': [0.5, 0.0, 0.0],
+        'robot_vel_ang_world': [0.1],
+      },
+      'cov_diag': [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+      'meas_attitude': {'cov_diag': [0.1]},
+      'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+      'meas_velo_ang': {'cov_diag': [0.2]},
+    },
+    'history': {'flag_enabled': flag_history_enabled, 'size': 50},
+    'meas_queues': {
+      'meas_position': {'depth': depth, 'overflow_policy': 'drop_oldest'},
+      'meas_attitude': {'depth': depth, 'overflow_policy': 'drop_oldest'},
+      'meas_velocity': {'depth': depth, 'overflow_policy': 'drop_oldest'},
+    },
+  }
+
+  return config_param
+
+
+@pytest.mark.parametrize('overflow_policy', ['drop_oldest', 'drop_newest'])
+def test_queue_overflow_policy(overflow_policy):
+
+  meas_queue = ArsMsfStateEstimatorMeasQueue([3, 1], 3, overflow_policy)
+
+  for idx_sample in range(5):
+    flag_not_dropped = meas_queue.push(10*idx_sample, np.full((3,), float(idx_sample)), np.array([float(idx_sample)]))
+    assert flag_not_dropped == (idx_sample < 3)
+
+  assert meas_queue.num_dropped == 2
+
+  timestamp, (meas_lin, meas_ang), time_receive = meas_queue.popAll()
+  idx_samples_kept = [2, 3, 4] if overflow_policy == 'drop_oldest' else [0, 1, 2]
+  assert timestamp == [10*idx_sample for idx_sample in idx_samples_kept]
+  np.testing.assert_array_equal(meas_lin[:, 0], idx_samples_kept)
+  np.testing.assert_array_equal(meas_ang[:, 0], idx_samples_kept)
+
+  assert meas_queue.getNumSamples() == 0
+
+
+def test_queue_period_min():
+
+  meas_queue = ArsMsfStateEstimatorMeasQueue([1], 10, 'drop_oldest', 100)
+
+  # Newer than the newest accepted by less than the min period: skipped.
+  # Older (out of order): kept
+  flags_not_dropped = [meas_queue.push(timestamp, np.array([float(timestamp)])) for timestamp in [1000, 1050, 1100, 1030, 1150, 1210, 900, 1210]]
+
+  assert flags_not_dropped == [True, False, True, True, False, True, True, True]
+  assert meas_queue.num_skipped == 2
+  assert meas_queue.num_dropped == 0
+  assert meas_queue.timestamp_last == 1210
+
+  timestamp, (meas,), time_receive = meas_queue.popAll()
+  assert timestamp == [1000, 1100, 1030, 1210, 900, 1210]
+
+
+@pytest.mark.parametrize('flag_history_enabled', [False, True])
+def test_update_fuses_all_queued_samples_in_order(flag_history_enabled):
+
+  rng = np.random.default_rng(0)
+
+  # Samples between two ticks, with sensors interleaved and out of order
+  meas_samples = []
+  for idx_sample in range(4):
+    meas_samples.append((1005000000+idx_sample*5000000, ArsMsfStateEstimator.meas_mask_robot_posi, rng.normal(size=(3,))))
+    meas_samples.append((1007000000+idx_sample*5000000, ArsMsfStateEstimator.meas_mask_robot_vel_robot, rng.normal(size=(4,))))
+  meas_samples.append((1015000000, ArsMsfStateEstimator.meas_mask_robot_atti, np.array([np.cos(0.05), np.sin(0.05)])))
+
+  def setMeas(msf_state_estimator, meas_sample):
+    meas_timestamp, meas_mask, meas_value = meas_sample
+    if(meas_mask == ArsMsfStateEstimator.meas_mask_robot_posi):
+      msf_state_estimator.setMeasRobotPosition(meas_timestamp, meas_value)
+    elif(meas_mask == ArsMsfStateEstimator.meas_mask_robot_atti):
+      msf_state_estimator.setMeasRobotAttitude(meas_timestamp, meas_value)
+    else:
+      msf_state_estimator.setMeasRobotVelRobot(meas_timestamp, meas_value[0:3], meas_value[3:4])
+
+  # Queued: all the samples, then one update
+  msf_state_estimator_queue = ArsMsfStateEstimator()
+  msf_state_estimator_queue.setConfigParameters(getConfigParam(flag_history_enabled, 10))
+  msf_state_estimator_queue.predict(1000000000)
+  for meas_sample in reversed(meas_samples):
+    setMeas(msf_state_estimator_queue, meas_sample)
+  msf_state_estimator_queue.update()
+
+  # Reference: one update per sample, in time order
+  msf_state_estimator_ref = ArsMsfStateEstimator()
+  msf_state_estimator_ref.setConfigParameters(getConfigParam(flag_history_enabled, 1))
+  msf_state_estimator_ref.predict(1000000000)
+  for meas_sample in sorted(meas_samples, key=lambda meas_sample: meas_sample[0]):
+    msf_state_estimator_ref.predict(meas_sample[0])
+    setMeas(msf_state_estimator_ref, meas_sample)
+    msf_state_estimator_ref.update()
+
+  assert msf_state_estimator_queue.estim_state_timestamp == msf_state_estimator_ref.estim_state_timestamp
+  np.testing.assert_allclose(msf_state_estimator_queue.estim_robot_posi, msf_state_estimator_ref.estim_robot_posi, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator_queue.estim_robot_velo_lin_world, msf_state_estimator_ref.estim_robot_velo_lin_world, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator_queue.estim_state_cov, msf_state_estimator_ref.estim_state_cov, rtol=1e-9, atol=1e-12)
+
+  assert msf_state_estimator_queue.getNumMeasDropped() == {ArsMsfStateEstimator.meas_mask_robot_posi: 0, ArsMsfStateEstimator.meas_mask_robot_atti: 0, ArsMsfStateEstimator.meas_mask_robot_vel_robot: 0}
+
+
+def test_queue_time_receive():
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(True, 4))
+
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+
+  # Time of reception of each sample, as the ROS node gives it: one queue
+  # delay per sample consumed
+  for idx_sample in range(3):
+    msf_state_estimator.setMeas(ArsMsfStateEstimator.meas_mask_robot_posi, timestamp+idx_sample*10000000, np.array([0.0, 0.0, 1.0]), time_receive=5000000000+idx_sample*1000)
+  msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([1.0, 0.0]))
+  msf_state_estimator.update()
+
+  assert msf_state_estimator.meas_time_receive_last_update == {
+    ArsMsfStateEstimator.meas_mask_robot_posi: [5000000000, 5000001000, 5000002000],
+    ArsMsfStateEstimator.meas_mask_robot_atti: [0]}
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import copy
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_latency import ArsMsfStateEstimatorLatency
+
+
+def getConfigParam(update_mode, meas_sources_posi):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.15), np.sin(0.15)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.2],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+      'meas_attitude': {'cov_diag': [0.1]},
+      'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+      'meas_velo_ang': {'cov_diag': [0.2]},
+    },
+    'update_mode': update_mode,
+    'meas_sources': {'meas_position': meas_sources_posi, 'meas_attitude': [], 'meas_velocity': []},
+  }
+
+  return config_param
+
+
+def getMeasSourcesPosi():
+
+  return [
+    {'name': 'meas_position_gnss', 'topic': 'meas_robot_position_gnss', 'cov_diag': [0.5, 0.6, 1.0]},
+    {'name': 'meas_position_mocap', 'topic': 'meas_robot_position_mocap', 'cov_diag': [0.01, 0.02, 0.03]},
+  ]
+
+
+@pytest.mark.parametrize('update_mode', ['batch', 'sequential_block', 'sequential_scalar'])
+def test_meas_sources_equal_stacked_kalman_update(update_mode):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(update_mode, getMeasSourcesPosi()))
+
+  meas_sources = msf_state_estimator.getMeasSources()
+  assert [meas_model.meas_mask for meas_model in meas_sources] == [8, 16]
+  assert msf_state_estimator.getMeasModelByName('meas_position_mocap') is meas_sources[1]
+
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+  timestamp += 20000000
+  msf_state_estimator.predict(timestamp)
+
+  # Prior
+  estim_robot_posi = msf_state_estimator.estim_robot_posi.copy()
+  estim_P = msf_state_estimator.estim_state_cov.copy()
+
+  # Three position sources
+  meas_z_robot_posi = [np.array([0.2, -0.1, 1.1]), np.array([0.3, -0.2, 0.9]), np.array([0.15, -0.15, 1.05])]
+  msf_state_estimator.setMeasRobotPosition(timestamp, meas_z_robot_posi[0])
+  for meas_model, meas_z in zip(meas_sources, meas_z_robot_posi[1:]):
+    msf_state_estimator.setMeas(meas_model.meas_mask, timestamp, meas_z)
+  msf_state_estimator.update()
+
+  # Reference: explicit gain
+  jac_Hx = np.zeros((9, 8))
+  for idx_source in range(3):
+    jac_Hx[3*idx_source:3*idx_source+3, 0:3] = np.eye(3)
+  cov_meas = np.diag([0.2, 0.3, 0.4, 0.5, 0.6, 1.0, 0.01, 0.02, 0.03])
+  innov_meas = np.concatenate([estim_robot_posi - meas_z for meas_z in meas_z_robot_posi])
+  kalman_gain = estim_P @ jac_Hx.T @ np.linalg.inv(jac_Hx @ estim_P @ jac_Hx.T + cov_meas)
+
+  assert msf_state_estimator.meas_mask_last_update == ArsMsfStateEstimator.meas_mask_robot_posi | 8 | 16
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, estim_robot_posi - (kalman_gain @ innov_meas)[0:3], rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, estim_P - kalman_gain @ jac_Hx @ estim_P, rtol=1e-9, atol=1e-12)
+
+  # Layout stacked once, reused at the next ticks
+  workspace_update = msf_state_estimator.workspace.getUpdate(ArsMsfStateEstimator.meas_mask_robot_posi | 8 | 16)
+  for step in range(3):
+    timestamp += 20000000
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.setMeasRobotPosition(timestamp, meas_z_robot_posi[0])
+    for meas_model, meas_z in zip(meas_sources, meas_z_robot_posi[1:]):
+      msf_state_estimator.setMeas(meas_model.meas_mask, timestamp, meas_z)
+    msf_state_estimator.update()
+  assert list(msf_state_estimator.workspace.update.values()) == [workspace_update]
+
+
+def test_meas_sources_rate_and_latency():
+
+  meas_sources_posi = [{'name': 'meas_position_gnss', 'topic': 'meas_robot_position_gnss', 'cov_diag': [0.5, 0.6, 1.0], 'rate': 10.0, 'latency': 0.05}]
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam('batch', meas_sources_posi))
+  meas_mask_gnss = msf_state_estimator.getMeasModelByName('meas_position_gnss').meas_mask
+
+  # Reference: the built-in position, with the same covariance, given the
+  # samples kept at their timestamp minus the latency
+  config_param_ref = getConfigParam('batch', [])
+  config_param_ref['measurements']['meas_position']['cov_diag'] = [0.5, 0.6, 1.0]
+  msf_state_estimator_ref = ArsMsfStateEstimator()
+  msf_state_estimator_ref.setConfigParameters(config_param_ref)
+
+  rng = np.random.default_rng(0)
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+  msf_state_estimator_ref.predict(timestamp)
+
+  # Samples at 50 Hz: one in five kept
+  flags_not_dropped = []
+  for step in range(20):
+    timestamp += 20000000
+    meas_z = np.array([0.1, -0.2, 1.0]) + 0.05*rng.normal(size=(3,))
+    flag_not_dropped = msf_state_estimator.setMeas(meas_mask_gnss, timestamp, meas_z)
+    flags_not_dropped.append(flag_not_dropped)
+    if(flag_not_dropped):
+      msf_state_estimator_ref.setMeasRobotPosition(timestamp - 50000000, meas_z)
+    for msf_state_estimator_i in [msf_state_estimator, msf_state_estimator_ref]:
+      msf_state_estimator_i.predict(timestamp)
+      msf_state_estimator_i.update()
+
+  assert flags_not_dropped == [step % 5 == 0 for step in range(20)]
+  assert msf_state_estimator.getNumMeasDropped()[meas_mask_gnss] == 0
+  assert msf_state_estimator.getNumMeasSkipped()[meas_mask_gnss] == 16
+  np.testing.assert_allclose(msf_state_estimator.estim_robot_posi, msf_state_estimator_ref.estim_robot_posi, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, msf_state_estimator_ref.estim_state_cov, rtol=1e-9, atol=1e-12)
+
+
+def test_meas_sources_config():
+
+  config_param = getConfigParam('batch', getMeasSourcesPosi())
+
+  # Configured again: same masks
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(config_param)
+  msf_state_estimator.setConfigParameters(config_param)
+  assert [meas_model.meas_mask for meas_model in msf_state_estimator.getMeasSources()] == [8, 16]
+  assert msf_state_estimator.gating.confidence[16] == 0.99
+
+  # Velocity source: covariance [lin_x, lin_y, lin_z, ang_z]
+  config_param_velo = copy.deepcopy(config_param)
+  config_param_velo['meas_sources']['meas_velocity'] = [{'name': 'meas_velocity_odom', 'topic': 'meas_robot_velocity_odom', 'cov_diag': [0.1, 0.2, 0.3, 0.4]}]
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(config_param_velo)
+  meas_model_velo = msf_state_estimator.getMeasModelByName('meas_velocity_odom')
+  assert meas_model_velo.meas_fields_dims == [3, 1]
+  np.testing.assert_array_equal(meas_model_velo.cov_meas, np.diag([0.1, 0.2, 0.3, 0.4]))
+  assert msf_state_estimator.steady_state.meas_mask_lin == ArsMsfStateEstimator.meas_mask_robot_vel_robot | meas_model_velo.meas_mask
+
+  # Errors
+  for meas_type, meas_sources in [
+    ('meas_position', getMeasSourcesPosi() + [getMeasSourcesPosi()[0]]),
+    ('meas_position', [{'name': 'meas_attitude', 'topic': 'meas_robot_attitude_2', 'cov_diag': [0.1, 0.1, 0.1]}]),
+    ('meas_position', [{'name': 'meas_position_gnss', 'topic': 'meas_robot_position_gnss', 'cov_diag': [0.1, 0.1]}]),
+    ('meas_position', [{'name': 'meas_position_gnss', 'topic': 'meas_robot_position_gnss', 'cov_diag': [0.1, 0.1, 0.1], 'rate': -1.0}]),
+    ('meas_altitude', [])]:
+    config_param_error = getConfigParam('batch', [])
+    config_param_error['meas_sources'][meas_type] = meas_sources
+    with pytest.raises(ValueError):
+      ArsMsfStateEstimator().setConfigParameters(config_param_error)
+
+
+def test_meas_sources_latency_instrumentation():
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam('batch', getMeasSourcesPosi()))
+
+  # Histograms of the registered measurements, as the ROS node does
+  latency = ArsMsfStateEstimatorLatency([meas_model.meas_name for meas_model in msf_state_estimator.meas_models])
+  meas_name_mocap = msf_state_estimator.getMeasModel(16).meas_name
+  latency.addSample('receive_delay_'+meas_name_mocap, 5000)
+  latency.addSample('queue_delay_'+meas_name_mocap, 7000)
+
+  summary = latency.getSummary()
+  assert summary['receive_delay_meas_position_mocap']['count'] == 1
+  assert summary['queue_delay_meas_position_mocap']['count'] == 1
+  assert summary['receive_delay_meas_position_gnss']['count'] == 0
+
+  # Unknown quantity: the lock is released
+  with pytest.raises(KeyError):
+    latency.addSample('receive_delay_meas_position_uwb', 5000)
+  assert not latency.lock.locked()
+  latency.addSample('receive_delay_'+meas_name_mocap, 5000)
+  assert latency.getSummary()['receive_delay_meas_position_mocap']['count'] == 2
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+
+
+def getConfigParam(flag_lazy_predict=False, flag_history_enabled=False):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.3), np.sin(0.3)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.2],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.2, 0.3, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+      'meas_attitude': {'cov_diag': [0.1]},
+      'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+      'meas_velo_ang': {'cov_diag': [0.2]},
+    },
+    'lazy_predict': {'flag_enabled': flag_lazy_predict},
+    'history': {'flag_enabled': flag_history_enabled, 'size': 100},
+  }
+
+  return config_param
+
+
+def createEstimator(flag_lazy_predict=False, flag_history_enabled=False):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(flag_lazy_predict, flag_history_enabled))
+
+  # Correlated covariance
+  rng = np.random.default_rng(0)
+  mat_A = rng.normal(size=(8, 8))
+  msf_state_estimator.estim_state_cov = np.matmul(mat_A, mat_A.T) + np.eye(8)
+
+  return msf_state_estimator
+
+
+@pytest.mark.parametrize('flag_history_enabled', [False, True])
+@pytest.mark.parametrize('meas_delay_ns', [-3000000, 5000000, 50000000])
+def test_lazy_predict_equals_eager(flag_history_enabled, meas_delay_ns):
+
+  # Same as predicting at each step. With the history, the delayed
+  # measurements are replayed over the merged steps with their own noise
+
+  msf_state_estimator_eager = createEstimator(False, flag_history_enabled)
+  msf_state_estimator_lazy = createEstimator(True, flag_history_enabled)
+
+  for msf_state_estimator in [msf_state_estimator_eager, msf_state_estimator_lazy]:
+    rng = np.random.default_rng(1)
+    msf_state_estimator.predict(1000000000)
+    timestamp = 1000000000
+    for step in range(60):
+      # Timer with jitter; a measurement every 7 steps, and a few idle
+      # steps
+      timestamp += 20000000 + int(rng.integers(-2000000, 2000000))
+      msf_state_estimator.predict(timestamp)
+      if(step % 7 == 6 and step < 50):
+        msf_state_estimator.setMeasRobotPosition(timestamp-meas_delay_ns, np.array([0.1, -0.2, 1.0]) + 0.1*rng.normal(size=(3,)))
+        msf_state_estimator.setMeasRobotAttitude(timestamp-meas_delay_ns, np.array([np.cos(0.3), np.sin(0.3)]))
+        msf_state_estimator.update()
+
+  assert msf_state_estimator_lazy.estim_state_timestamp < timestamp
+
+  estim_state_snapshot_eager = msf_state_estimator_eager.getStateSnapshot()
+  estim_state_snapshot_lazy = msf_state_estimator_lazy.getStateSnapshot()
+
+  assert estim_state_snapshot_lazy.timestamp == estim_state_snapshot_eager.timestamp
+  np.testing.assert_allclose(estim_state_snapshot_lazy.state, estim_state_snapshot_eager.state, rtol=1e-10, atol=1e-12)
+  np.testing.assert_allclose(estim_state_snapshot_lazy.state_cov, estim_state_snapshot_eager.state_cov, rtol=1e-10, atol=1e-12)
+
+
+def test_lazy_predict_deferred():
+
+  msf_state_estimator = createEstimator(True)
+  msf_state_estimator.predict(1000000000)
+
+  # Only recorded
+  for step in range(1, 101):
+    msf_state_estimator.predict(1000000000+step*20000000)
+  msf_state_estimator.predict(1000000000+50*20000000)
+
+  assert msf_state_estimator.estim_state_timestamp == 1000000000
+  assert msf_state_estimator.predict_pending_num == 100
+  assert msf_state_estimator.getStateTimestamp() == 1000000000+100*20000000
+
+  # Propagated once, when read
+  estim_state_snapshot = msf_state_estimator.getStateSnapshot()
+
+  assert estim_state_snapshot.timestamp == 1000000000+100*20000000
+  assert msf_state_estimator.predict_pending_num == 0
+  assert msf_state_estimator.getStateSnapshot() is estim_state_snapshot
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_history import ArsMsfStateEstimatorHistory
+
+
+def getConfigParam(history_size=50):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.15), np.sin(0.15)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.4],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.02, 0.03, 0.04]},
+      'meas_attitude': {'cov_diag': [0.01]},
+      'meas_velo_lin': {'cov_diag': [0.05, 0.05, 0.07]},
+      'meas_velo_ang': {'cov_diag': [0.02]},
+    },
+    'history': {'flag_enabled': True, 'size': history_size},
+    'state_query': {'extrapolation_time_max': 0.1},
+  }
+
+  return config_param
+
+
+def runEstimator(msf_state_estimator, num_cycles, timestamp_start=1000000000, delta_time_ns=20000000):
+
+  # Predict and update at a fixed rate, the robot turning
+  rng = np.random.default_rng(0)
+
+  timestamp = timestamp_start
+  for idx_cycle in range(num_cycles):
+    timestamp += delta_time_ns
+    robot_atti_ang = 0.3 + 0.4*(timestamp-timestamp_start)*1e-9
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.setMeasRobotPosition(timestamp, np.array([0.1, -0.2, 1.0]) + 0.05*rng.normal(size=(3,)))
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.5*robot_atti_ang), np.sin(0.5*robot_atti_ang)]))
+    msf_state_estimator.update()
+
+  return timestamp
+
+
+def test_query_extrapolation_equals_predict():
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam())
+  timestamp = runEstimator(msf_state_estimator, 10)
+
+  msf_state_estimator_ref = ArsMsfStateEstimator()
+  msf_state_estimator_ref.setConfigParameters(getConfigParam())
+  runEstimator(msf_state_estimator_ref, 10)
+
+  # Same timestamp: the estimated state itself
+  state, state_cov, flag_valid = msf_state_estimator.getStateAtTimestamp(timestamp)
+  assert flag_valid
+  np.testing.assert_array_equal(state, msf_state_estimator.getStateSnapshot().state)
+  np.testing.assert_array_equal(state_cov, msf_state_estimator.estim_state_cov)
+
+  # Past the estimated state
+  timestamp_query = timestamp + 15000000
+  state, state_cov, flag_valid = msf_state_estimator.getStateAtTimestamp(timestamp_query)
+  msf_state_estimator_ref.predict(timestamp_query)
+
+  assert flag_valid
+  assert state.shape == (9,)
+  assert state_cov.shape == (8, 8)
+  np.testing.assert_allclose(state, msf_state_estimator_ref.getStateSnapshot().state, rtol=1e-12, atol=1e-12)
+  np.testing.assert_allclose(state_cov, msf_state_estimator_ref.estim_state_cov, rtol=1e-12, atol=1e-12)
+
+  # The filter is not modified
+  assert msf_state_estimator.estim_state_timestamp == timestamp
+
+
+def test_query_interpolation_within_history():
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam())
+  runEstimator(msf_state_estimator, 10)
+
+  history = msf_state_estimator.history
+  idx_entry = 5
+  timestamp_lo = history.getTimestamp(idx_entry)
+  timestamp_hi = history.getTimestamp(idx_entry+1)
+  robot_posi_lo, robot_atti_quat_simp_lo, _, _, state_cov_lo = history.getEntryState(idx_entry)
+  robot_posi_hi, robot_atti_quat_simp_hi, _, _, state_cov_hi = history.getEntryState(idx_entry+1)
+
+  # At the entries
+  state, state_cov, flag_valid = msf_state_estimator.getStateAtTimestamp([timestamp_lo, timestamp_hi])
+  assert flag_valid.all()
+  np.testing.assert_allclose(state[0, 0:3], robot_posi_lo, rtol=1e-12)
+  np.testing.assert_allclose(state[1, 3:5], robot_atti_quat_simp_hi, rtol=1e-12)
+  np.testing.assert_allclose(state_cov[1], state_cov_hi, rtol=1e-12)
+
+  # A quarter of the way
+  timestamp_query = timestamp_lo + (timestamp_hi-timestamp_lo)//4
+  state, state_cov, flag_valid = msf_state_estimator.getStateAtTimestamp(timestamp_query)
+  assert flag_valid
+  np.testing.assert_allclose(state[0:3], 0.75*robot_posi_lo + 0.25*robot_posi_hi, rtol=1e-12)
+  np.testing.assert_allclose(state_cov, 0.75*state_cov_lo + 0.25*state_cov_hi, rtol=1e-12)
+  robot_atti_ang_lo = 2.0*np.arctan2(robot_atti_quat_simp_lo[1], robot_atti_quat_simp_lo[0])
+  robot_atti_ang_hi = 2.0*np.arctan2(robot_atti_quat_simp_hi[1], robot_atti_quat_simp_hi[0])
+  assert 2.0*np.arctan2(state[4], state[3]) == pytest.approx(0.75*robot_atti_ang_lo + 0.25*robot_atti_ang_hi)
+
+
+def test_query_vector_of_timestamps():
+
+  # The history wraps around
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(history_size=8))
+  timestamp = runEstimator(msf_state_estimator, 20)
+
+  timestamp_oldest = msf_state_estimator.history.getTimestamp(0)
+  timestamps = np.array([
+    timestamp_oldest - 1,
+    timestamp_oldest,
+    timestamp_oldest + 7000000,
+    timestamp - 3000000,
+    timestamp,
+    timestamp + 50000000,
+    timestamp + 100000001,
+  ], dtype=np.int64)
+
+  state, state_cov, flag_valid = msf_state_estimator.getStateAtTimestamp(timestamps)
+
+  assert state.shape == (7, 9)
+  assert state_cov.shape == (7, 8, 8)
+  np.testing.assert_array_equal(flag_valid, [False, True, True, True, True, True, False])
+  assert np.isnan(state[~flag_valid]).all()
+  assert np.isnan(state_cov[~flag_valid]).all()
+
+  # Same as one at a time
+  for idx_query, timestamp_query in enumerate(timestamps[flag_valid].tolist()):
+    state_i, state_cov_i, flag_valid_i = msf_state_estimator.getStateAtTimestamp(timestamp_query)
+    assert flag_valid_i
+    np.testing.assert_allclose(state_i, state[flag_valid][idx_query], rtol=1e-12)
+    np.testing.assert_allclose(state_cov_i, state_cov[flag_valid][idx_query], rtol=1e-12)
+
+
+def test_history_interpolation_shortest_rotation():
+
+  # Between yaw 3.1 and -3.1: through pi
+  history = ArsMsfStateEstimatorHistory(4)
+  for timestamp, robot_atti_ang in [(1000, 0.0), (2000, 3.1), (3000, -3.1)]:
+    idx_entry = history.appendEntry(timestamp)
+    history.setEntryState(idx_entry, np.zeros((3,)), np.array([np.cos(0.5*robot_atti_ang), np.sin(0.5*robot_atti_ang)]), np.zeros((3,)), np.zeros((1,)), np.eye(8))
+
+  state, _ = history.interpolateState(np.array([2500, 2750]))
+
+  robot_atti_ang = 2.0*np.arctan2(state[:, 4], state[:, 3])
+  np.testing.assert_allclose(np.cos(robot_atti_ang), np.cos([np.pi, 3.1+0.75*(2.0*np.pi-6.2)]), rtol=1e-12)
+  np.testing.assert_allclose(np.sin(robot_atti_ang), np.sin([np.pi, 3.1+0.75*(2.0*np.pi-6.2)]), atol=1e-12)
+  np.testing.assert_allclose(state[:, 3]**2 + state[:, 4]**2, 1.0, rtol=1e-12)
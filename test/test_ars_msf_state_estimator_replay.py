@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+from ars_msf_state_estimator.ars_msf_state_estimator_replay import ArsMsfStateEstimatorReplay
+
+
+def getConfigParam(state_estim_mode):
+
+  config_param = {
+    'state_estim_mode': state_estim_mode,
+    'state_estim_loop_freq': 50.0,
+    'ekf': {
+      'estimated_state_init': {
+        'state': {
+          'robot_position': [0.0, 0.0, 1.0],
+          'robot_atti_quat_simp': [1.0, 0.0],
+          'robot_vel_lin_world': [0.0, 0.0, 0.0],
+          'robot_vel_ang_world': [0.0],
+        },
+        'cov_diag': [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+      },
+      'process_model': {
+        'cov_diag': [0.1, 0.1, 0.1, 0.05],
+      },
+      'measurements': {
+        'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+        'meas_attitude': {'cov_diag': [0.1]},
+        'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+        'meas_velo_ang': {'cov_diag': [0.2]},
+      },
+      'history': {'flag_enabled': True, 'size': 50},
+      'meas_queues': {
+        'meas_position': {'depth': 10, 'overflow_policy': 'drop_oldest'},
+        'meas_attitude': {'depth': 10, 'overflow_policy': 'drop_oldest'},
+        'meas_velocity': {'depth': 10, 'overflow_policy': 'drop_oldest'},
+      },
+    },
+  }
+
+  return config_param
+
+
+def createMeasLog(num_meas):
+
+  rng = np.random.default_rng(0)
+
+  timestamp = 1000000000 + np.sort(rng.integers(0, 2000000000, num_meas)).astype(np.int64)
+  meas_type = rng.choice([ArsMsfStateEstimator.meas_mask_robot_posi, ArsMsfStateEstimator.meas_mask_robot_atti, ArsMsfStateEstimator.meas_mask_robot_vel_robot], num_meas)
+  meas_value = 0.1*rng.normal(size=(num_meas, 4))
+  meas_robot_atti_ang = rng.uniform(-np.pi, np.pi, num_meas)
+  idx_meas_atti = meas_type == ArsMsfStateEstimator.meas_mask_robot_atti
+  meas_value[idx_meas_atti, 0] = np.cos(0.5*meas_robot_atti_ang[idx_meas_atti])
+  meas_value[idx_meas_atti, 1] = np.sin(0.5*meas_robot_atti_ang[idx_meas_atti])
+
+  return timestamp, meas_type, meas_value
+
+
+@pytest.mark.parametrize('state_estim_mode', ['timer', 'event'])
+def test_replay_equals_node_loop(state_estim_mode):
+
+  timestamp, meas_type, meas_value = createMeasLog(200)
+
+  msf_state_estimator_replay = ArsMsfStateEstimatorReplay()
+  msf_state_estimator_replay.setConfigParameters(getConfigParam(state_estim_mode))
+  traj_timestamp, traj_state, traj_state_cov_triu = msf_state_estimator_replay.run(timestamp, meas_type, meas_value)
+
+  # Same steps as the ROS node: measurements, then predict and update
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(state_estim_mode)['ekf'])
+  msf_state_estimator_replay.msf_state_estimator = msf_state_estimator
+
+  idx_meas = 0
+  for idx_step in range(traj_timestamp.shape[0]):
+    while(idx_meas < timestamp.shape[0] and timestamp[idx_meas] <= traj_timestamp[idx_step]):
+      msf_state_estimator_replay.setMeas(meas_type[idx_meas], meas_value[idx_meas], int(timestamp[idx_meas]))
+      idx_meas += 1
+    msf_state_estimator.predict(int(traj_timestamp[idx_step]))
+    msf_state_estimator.update()
+
+  np.testing.assert_allclose(traj_state[-1, 0:3], msf_state_estimator.estim_robot_posi, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(traj_state[-1, 3:5], msf_state_estimator.estim_robot_atti_quat_simp, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(traj_state[-1, 5:8], msf_state_estimator.estim_robot_velo_lin_world, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(traj_state_cov_triu[-1], msf_state_estimator.estim_state_cov[np.triu_indices(8)], rtol=1e-9, atol=1e-12)
+
+
+def test_replay_csv_log_and_trajectory_file(tmp_path):
+
+  timestamp, meas_type, meas_value = createMeasLog(50)
+
+  meas_log_file = str(tmp_path / 'meas_log.csv')
+  with open(meas_log_file, 'w') as file:
+    file.write('timestamp,meas_type,v0,v1,v2,v3\n')
+    # Not sorted: the replay sorts the log
+    for idx_meas in reversed(range(timestamp.shape[0])):
+      file.write('{},{},{!r},{!r},{!r},{!r}\n'.format(timestamp[idx_meas], meas_type[idx_meas], *meas_value[idx_meas].tolist()))
+
+  msf_state_estimator_replay = ArsMsfStateEstimatorReplay()
+  msf_state_estimator_replay.setConfigParameters(getConfigParam('event'))
+
+  timestamp_log, meas_type_log, meas_value_log = msf_state_estimator_replay.loadMeasLog(meas_log_file)
+  np.testing.assert_array_equal(timestamp_log, timestamp)
+  np.testing.assert_array_equal(meas_type_log, meas_type)
+  np.testing.assert_array_equal(meas_value_log, meas_value)
+
+  traj_timestamp, traj_state, traj_state_cov_triu = msf_state_estimator_replay.run(timestamp_log, meas_type_log, meas_value_log)
+
+  traj_file = str(tmp_path / 'traj.npz')
+  msf_state_estimator_replay.saveTrajectory(traj_file, traj_timestamp, traj_state, traj_state_cov_triu)
+  traj_timestamp_file, traj_state_file, traj_state_cov_file = msf_state_estimator_replay.loadTrajectory(traj_file)
+
+  np.testing.assert_array_equal(traj_timestamp_file, np.unique(timestamp))
+  np.testing.assert_array_equal(traj_state_file, traj_state)
+  # Stored as the upper triangle: symmetric up to round-off
+  np.testing.assert_allclose(traj_state_cov_file[-1], msf_state_estimator_replay.msf_state_estimator.estim_state_cov, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+
+
+def getConfigParam(update_mode, flag_steady_state_enabled):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.0, 0.0, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.15), np.sin(0.15)],
+        'robot_vel_lin_world': [0.0, 0.0, 0.0],
+        'robot_vel_ang_world': [0.0],
+      },
+      'cov_diag': [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.02, 0.03, 0.04]},
+      'meas_attitude': {'cov_diag': [0.01]},
+      'meas_velo_lin': {'cov_diag': [0.05, 0.05, 0.07]},
+      'meas_velo_ang': {'cov_diag': [0.02]},
+    },
+    'update_mode': update_mode,
+    'history': {'flag_enabled': False, 'size': 10},
+    'steady_state': {'flag_enabled': flag_steady_state_enabled, 'conv_tol': 1.0e-4, 'conv_num_cycles': 5, 'delta_time_tol': 0.05, 'robot_atti_ang_tol': 0.02, 'robot_velo_lin_tol': 0.05},
+  }
+
+  return config_param
+
+
+def createEstimators(update_mode):
+
+  msf_state_estimators = []
+  for flag_steady_state_enabled in [False, True]:
+    msf_state_estimator = ArsMsfStateEstimator()
+    msf_state_estimator.setConfigParameters(getConfigParam(update_mode, flag_steady_state_enabled))
+    msf_state_estimator.predict(1000000000)
+    msf_state_estimators.append(msf_state_estimator)
+
+  return msf_state_estimators
+
+
+def stepCycle(msf_state_estimators, timestamp, rng, robot_atti_ang=0.15):
+
+  # Robot at rest, all the sensors at every cycle
+  meas_robot_posi = np.array([0.0, 0.0, 1.0]) + 0.01*rng.normal(size=(3,))
+  meas_robot_atti_ang = robot_atti_ang + 0.005*rng.normal()
+  meas_robot_velo = 0.01*rng.normal(size=(4,))
+
+  for msf_state_estimator in msf_state_estimators:
+    msf_state_estimator.predict(timestamp)
+    msf_state_estimator.setMeasRobotPosition(timestamp, meas_robot_posi)
+    msf_state_estimator.setMeasRobotAttitude(timestamp, np.array([np.cos(0.5*meas_robot_atti_ang), np.sin(0.5*meas_robot_atti_ang)]))
+    msf_state_estimator.setMeasRobotVelRobot(timestamp, meas_robot_velo[0:3], meas_robot_velo[3:4])
+    msf_state_estimator.update()
+
+  return
+
+
+def assertEstimatorsClose(msf_state_estimator_full, msf_state_estimator_steady, atol):
+
+  # The cached cycle is the one at convergence (within conv_tol): close to
+  # the full EKF, not equal
+  rtol = 0.0
+
+  np.testing.assert_allclose(msf_state_estimator_steady.estim_robot_posi, msf_state_estimator_full.estim_robot_posi, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator_steady.estim_robot_atti_quat_simp, msf_state_estimator_full.estim_robot_atti_quat_simp, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator_steady.estim_robot_velo_lin_world, msf_state_estimator_full.estim_robot_velo_lin_world, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator_steady.estim_robot_velo_ang_world, msf_state_estimator_full.estim_robot_velo_ang_world, rtol=rtol, atol=atol)
+  np.testing.assert_allclose(msf_state_estimator_steady.estim_state_cov, msf_state_estimator_full.estim_state_cov, rtol=rtol, atol=atol)
+
+
+@pytest.mark.parametrize('update_mode', ['batch', 'sequential_block'])
+def test_steady_state_equals_full_ekf(update_mode):
+
+  rng = np.random.default_rng(0)
+  msf_state_estimator_full, msf_state_estimator_steady = createEstimators(update_mode)
+
+  # 50 Hz
+  for step in range(1, 301):
+    stepCycle([msf_state_estimator_full, msf_state_estimator_steady], 1000000000+step*20000000, rng)
+
+  # Converged, then only steady-state cycles
+  steady_state = msf_state_estimator_steady.steady_state
+  assert steady_state.num_update_steady > 200
+  assert steady_state.num_predict_steady == steady_state.num_update_steady
+
+  assertEstimatorsClose(msf_state_estimator_full, msf_state_estimator_steady, 1e-3)
+
+
+def test_steady_state_delta_time_jitter_falls_back():
+
+  rng = np.random.default_rng(1)
+  msf_state_estimator_full, msf_state_estimator_steady = createEstimators('batch')
+
+  timestamp = 1000000000
+  for step in range(100):
+    timestamp += 20000000
+    stepCycle([msf_state_estimator_full, msf_state_estimator_steady], timestamp, rng)
+
+  steady_state = msf_state_estimator_steady.steady_state
+  num_predict_steady = steady_state.num_predict_steady
+  assert num_predict_steady > 0
+
+  # Time step 30% longer: full EKF
+  timestamp += 26000000
+  stepCycle([msf_state_estimator_full, msf_state_estimator_steady], timestamp, rng)
+
+  assert steady_state.num_predict_steady == num_predict_steady
+  assert steady_state.phase is None
+  assertEstimatorsClose(msf_state_estimator_full, msf_state_estimator_steady, 1e-3)
+
+  # Back to the nominal time step: steady state again once the covariance
+  # is back to the cached one
+  for step in range(20):
+    timestamp += 20000000
+    stepCycle([msf_state_estimator_full, msf_state_estimator_steady], timestamp, rng)
+
+  assert steady_state.num_predict_steady > num_predict_steady
+
+
+def test_steady_state_attitude_change_falls_back():
+
+  rng = np.random.default_rng(2)
+  msf_state_estimator_full, msf_state_estimator_steady = createEstimators('batch')
+
+  timestamp = 1000000000
+  for step in range(100):
+    timestamp += 20000000
+    stepCycle([msf_state_estimator_full, msf_state_estimator_steady], timestamp, rng)
+
+  steady_state = msf_state_estimator_steady.steady_state
+  num_update_steady = steady_state.num_update_steady
+  assert num_update_steady > 0
+
+  # Robot turned: the Jacobian of the velocity measurement changed
+  msf_state_estimator_full.estim_robot_atti_quat_simp = np.array([np.cos(0.4), np.sin(0.4)])
+  msf_state_estimator_steady.estim_robot_atti_quat_simp = np.array([np.cos(0.4), np.sin(0.4)])
+  timestamp += 20000000
+  stepCycle([msf_state_estimator_full, msf_state_estimator_steady], timestamp, rng, 0.8)
+
+  # Full update from the cached prior: no convergence check
+  assert steady_state.num_update_steady == num_update_steady
+  assert steady_state.phase is None
+  assert steady_state.conv_meas_mask is None
+  assertEstimatorsClose(msf_state_estimator_full, msf_state_estimator_steady, 1e-3)
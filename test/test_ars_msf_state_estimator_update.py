@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import itertools
+
+import numpy as np
+import pytest
+
+from ars_msf_state_estimator.ars_msf_state_estimator import ArsMsfStateEstimator
+
+
+def getConfigParam(update_mode):
+
+  config_param = {
+    'estimated_state_init': {
+      'state': {
+        'robot_position': [0.1, -0.2, 1.0],
+        'robot_atti_quat_simp': [np.cos(0.3), np.sin(0.3)],
+        'robot_vel_lin_world': [0.5, -0.3, 0.1],
+        'robot_vel_ang_world': [0.2],
+      },
+      'cov_diag': [1.0, 2.0, 0.5, 0.3, 1.5, 1.0, 0.7, 0.4],
+    },
+    'process_model': {
+      'cov_diag': [0.1, 0.1, 0.1, 0.05],
+    },
+    'measurements': {
+      'meas_position': {'cov_diag': [0.2, 0.3, 0.4]},
+      'meas_attitude': {'cov_diag': [0.1]},
+      'meas_velo_lin': {'cov_diag': [0.5, 0.6, 0.7]},
+      'meas_velo_ang': {'cov_diag': [0.2]},
+    },
+    'update_mode': update_mode,
+    'history': {'flag_enabled': False, 'size': 10},
+  }
+
+  return config_param
+
+
+def createEstimator(update_mode):
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(getConfigParam(update_mode))
+
+  # Correlated covariance
+  rng = np.random.default_rng(0)
+  mat_A = rng.normal(size=(8, 8))
+  msf_state_estimator.estim_state_cov = np.matmul(mat_A, mat_A.T) + np.eye(8)
+
+  return msf_state_estimator
+
+
+def getMeasZ(meas_z_robot_posi, meas_z_robot_atti_quat_simp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot):
+
+  # Fields of the samples, by mask of the measurement
+  return {
+    ArsMsfStateEstimator.meas_mask_robot_posi: (meas_z_robot_posi, ),
+    ArsMsfStateEstimator.meas_mask_robot_atti: (meas_z_robot_atti_quat_simp, ),
+    ArsMsfStateEstimator.meas_mask_robot_vel_robot: (meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot),
+  }
+
+
+meas_masks = [
+  sum(meas_masks_comb)
+  for num_meas in range(1, 4)
+  for meas_masks_comb in itertools.combinations([ArsMsfStateEstimator.meas_mask_robot_posi, ArsMsfStateEstimator.meas_mask_robot_atti, ArsMsfStateEstimator.meas_mask_robot_vel_robot], num_meas)
+]
+
+
+@pytest.mark.parametrize('update_mode', ['sequential_block', 'sequential_scalar'])
+@pytest.mark.parametrize('meas_mask', meas_masks)
+def test_sequential_update_equals_batch(update_mode, meas_mask):
+
+  meas_z_robot_posi = np.array([0.3, -0.1, 1.2])
+  meas_z_robot_atti_quat_simp = np.array([np.cos(0.35), np.sin(0.35)])
+  meas_z_robot_velo_lin_robot = np.array([0.4, -0.2, 0.0])
+  meas_z_robot_velo_ang_robot = np.array([0.1])
+
+  msf_state_estimator_batch = createEstimator('batch')
+  msf_state_estimator_batch.updateState(meas_mask, getMeasZ(meas_z_robot_posi, meas_z_robot_atti_quat_simp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot))
+
+  msf_state_estimator_seq = createEstimator(update_mode)
+  msf_state_estimator_seq.updateState(meas_mask, getMeasZ(meas_z_robot_posi, meas_z_robot_atti_quat_simp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot))
+
+  np.testing.assert_allclose(msf_state_estimator_seq.estim_robot_posi, msf_state_estimator_batch.estim_robot_posi, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator_seq.estim_robot_atti_quat_simp, msf_state_estimator_batch.estim_robot_atti_quat_simp, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator_seq.estim_robot_velo_lin_world, msf_state_estimator_batch.estim_robot_velo_lin_world, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator_seq.estim_robot_velo_ang_world, msf_state_estimator_batch.estim_robot_velo_ang_world, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator_seq.estim_state_cov, msf_state_estimator_batch.estim_state_cov, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('meas_mask', meas_masks)
+def test_batch_update_equals_joseph_form(meas_mask):
+
+  meas_z_robot_posi = np.array([0.3, -0.1, 1.2])
+  meas_z_robot_atti_quat_simp = np.array([np.cos(0.35), np.sin(0.35)])
+  meas_z_robot_velo_lin_robot = np.array([0.4, -0.2, 0.05])
+  meas_z_robot_velo_ang_robot = np.array([0.1])
+
+  msf_state_estimator = createEstimator('batch')
+  estim_state_cov_prior = msf_state_estimator.estim_state_cov.copy()
+  msf_state_estimator.updateState(meas_mask, getMeasZ(meas_z_robot_posi, meas_z_robot_atti_quat_simp, meas_z_robot_velo_lin_robot, meas_z_robot_velo_ang_robot))
+
+  # Reference: explicit gain, Joseph form
+  workspace_update = msf_state_estimator.workspace.getUpdate(meas_mask)
+  jac_Hx = workspace_update.jac_Hx
+  cov_meas = workspace_update.cov_meas
+  kalman_gain = estim_state_cov_prior @ jac_Hx.T @ np.linalg.inv(jac_Hx @ estim_state_cov_prior @ jac_Hx.T + cov_meas)
+  mat_I_KH = np.eye(8) - kalman_gain @ jac_Hx
+  estim_state_cov_joseph = mat_I_KH @ estim_state_cov_prior @ mat_I_KH.T + kalman_gain @ cov_meas @ kalman_gain.T
+
+  np.testing.assert_allclose(workspace_update.delta_x, kalman_gain @ workspace_update.innov_meas, rtol=1e-9, atol=1e-12)
+  np.testing.assert_allclose(msf_state_estimator.estim_state_cov, estim_state_cov_joseph, rtol=1e-9, atol=1e-12)
+  # Symmetric storage
+  np.testing.assert_array_equal(msf_state_estimator.estim_state_cov, msf_state_estimator.estim_state_cov.T)
+
+
+def test_state_snapshot_immutable_and_versioned():
+
+  msf_state_estimator = createEstimator('batch')
+  msf_state_estimator.predict(1000000000)
+
+  estim_state_snapshot_pred = msf_state_estimator.getStateSnapshot()
+  assert estim_state_snapshot_pred.timestamp == 1000000000
+  np.testing.assert_array_equal(estim_state_snapshot_pred.robot_posi, msf_state_estimator.estim_robot_posi)
+  np.testing.assert_array_equal(estim_state_snapshot_pred.state_cov, msf_state_estimator.estim_state_cov)
+  with pytest.raises(ValueError):
+    estim_state_snapshot_pred.state[0] = 0.0
+
+  estim_state_pred = estim_state_snapshot_pred.state.copy()
+  msf_state_estimator.setMeasRobotPosition(1000000000, np.array([1.0, 2.0, 3.0]))
+  msf_state_estimator.update()
+
+  # New snapshot; the one held by the reader is unchanged
+  estim_state_snapshot_upd = msf_state_estimator.getStateSnapshot()
+  assert estim_state_snapshot_upd.version == estim_state_snapshot_pred.version + 1
+  np.testing.assert_array_equal(estim_state_snapshot_pred.state, estim_state_pred)
+  np.testing.assert_array_equal(estim_state_snapshot_upd.robot_posi, msf_state_estimator.estim_robot_posi)
+  assert not np.array_equal(estim_state_snapshot_upd.robot_posi, estim_state_pred[0:3])
+
+
+def test_state_snapshot_rotation():
+
+  msf_state_estimator = createEstimator('batch')
+  msf_state_estimator.predict(1000000000)
+
+  # Initial yaw 0.6 (quat simp [cos(0.3), sin(0.3)])
+  estim_state_snapshot = msf_state_estimator.getStateSnapshot()
+  np.testing.assert_allclose(estim_state_snapshot.cos_robot_atti_ang, np.cos(0.6), atol=1e-12)
+  np.testing.assert_allclose(estim_state_snapshot.sin_robot_atti_ang, np.sin(0.6), atol=1e-12)
+
+
+def test_config_optional_sections():
+
+  # Sections of the original config only: the others as constructed
+  config_param = getConfigParam('batch')
+  del config_param['update_mode']
+  del config_param['history']
+
+  msf_state_estimator = ArsMsfStateEstimator()
+  msf_state_estimator.setConfigParameters(config_param)
+
+  assert msf_state_estimator.update_mode == 'batch'
+  assert not msf_state_estimator.flag_lazy_predict
+  assert msf_state_estimator.flag_history_enabled
+  assert msf_state_estimator.history.size == 200
+  assert msf_state_estimator.query_extrapolation_time_max == 0
+  assert not msf_state_estimator.steady_state.flag_enabled
+  assert not msf_state_estimator.gating.flag_enabled
+  assert not msf_state_estimator.imu.flag_enabled
+  assert msf_state_estimator.getMeasSources() == []
+  assert [meas_queue.depth for meas_queue in msf_state_estimator.meas_queues.values()] == [1, 1, 1]
+
+  # Fuses as configured explicitly
+  timestamp = 1000000000
+  msf_state_estimator.predict(timestamp)
+  msf_state_estimator.setMeasRobotPosition(timestamp, np.array([0.2, -0.1, 1.1]))
+  msf_state_estimator.update()
+  assert msf_state_estimator.meas_mask_last_update == ArsMsfStateEstimator.meas_mask_robot_posi